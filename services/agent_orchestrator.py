@@ -207,7 +207,9 @@ class AgentOrchestrator:
             yield json.dumps({"stream_type": "single", "stock_code": code}, ensure_ascii=False)
 
             # Indicators and basic score (compatible with UI)
-            df = await self._data_provider.get_stock_data(code, market_type)
+            df = await self._data_provider.get_stock_data(
+                code, market_type, lookback=self._indicator.required_bars(analysis_days)
+            )
             df_ind = self._indicator.calculate_indicators(df)
             score = self._scorer.calculate_score(df_ind)
             rec0 = self._scorer.get_recommendation(score)
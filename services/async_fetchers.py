@@ -0,0 +1,303 @@
+import os
+import asyncio
+import httpx
+import numpy as np
+import pandas as pd
+from typing import Dict, Hashable, List, Optional
+from utils.logger import get_logger
+from services.fetch_scheduler import fetch_scheduler, MARKET_SOURCES
+from services.stock_history_store import ESTIMATED_COLUMNS_ATTR
+
+# 获取日志器
+logger = get_logger()
+
+# 东方财富K线接口（akshare的 stock_zh_a_hist / fund_etf_hist_em / fund_lof_hist_em 均基于此接口）
+EASTMONEY_KLINE_URL = 'https://push2his.eastmoney.com/api/qt/stock/kline/get'
+
+# 腾讯K线接口（东方财富接口的备用数据源）
+TENCENT_KLINE_URL = 'https://web.ifzq.gtimg.cn/appstock/app/fqkline/get'
+
+# 复权方式到接口参数fqt的映射
+ADJUST_FQT: Dict[str, str] = {'': '0', 'qfq': '1', 'hfq': '2'}
+
+# 接口返回的每行字段：日期,开盘,收盘,最高,最低,成交量,成交额,振幅,涨跌幅,涨跌额,换手率
+KLINE_FIELDS: List[str] = ['Open', 'Close', 'High', 'Low', 'Volume', 'Amount',
+                           'Amplitude', 'Change_pct', 'Change', 'Turnover']
+
+class AsyncClientPool:
+    """
+    进程内共享的httpx.AsyncClient连接池
+    AsyncClient的连接池绑定事件循环，按事件循环分别保存
+    """
+
+    def __init__(self, max_connections: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            max_connections: 连接池最大连接数，默认读取环境变量 ASYNC_FETCH_MAX_CONNECTIONS（默认100）
+            timeout: 单次请求超时秒数，默认读取环境变量 ASYNC_FETCH_TIMEOUT（默认15秒）
+        """
+        self.max_connections = max_connections or int(os.getenv('ASYNC_FETCH_MAX_CONNECTIONS', '100'))
+        self.timeout = timeout or float(os.getenv('ASYNC_FETCH_TIMEOUT', '15'))
+        self._clients: Dict[int, httpx.AsyncClient] = {}
+
+    def get_client(self) -> httpx.AsyncClient:
+        """返回当前事件循环共享的AsyncClient"""
+        loop_id = id(asyncio.get_running_loop())
+        client = self._clients.get(loop_id)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                headers={'User-Agent': 'Mozilla/5.0'}
+            )
+            self._clients[loop_id] = client
+        return client
+
+    async def prime(self, urls: List[str]) -> int:
+        """
+        预先与各主机建立连接（完成DNS解析和TLS握手），连接保留在连接池中供后续请求复用
+
+        Args:
+            urls: 需要预连接的地址，响应状态码不影响连接复用
+
+        Returns:
+            成功建立连接的地址数
+        """
+        client = self.get_client()
+        responses = await asyncio.gather(*[client.get(url) for url in urls], return_exceptions=True)
+        for url, response in zip(urls, responses):
+            if isinstance(response, Exception):
+                logger.warning(f"预连接 {url} 失败: {str(response)}")
+        return sum(1 for response in responses if not isinstance(response, Exception))
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的AsyncClient（应用关闭时调用）"""
+        client = self._clients.pop(id(asyncio.get_running_loop()), None)
+        if client is not None:
+            await client.aclose()
+
+# 进程内共享的连接池
+http_client_pool = AsyncClientPool()
+
+class EastmoneyKlineFetcher:
+    """
+    东方财富日K线原生异步获取器
+    使用连接池复用的httpx.AsyncClient直接请求K线接口，并把返回的文本行解析为NumPy数组，
+    不占用线程，单进程即可同时进行数百个获取请求
+    """
+
+    name = 'eastmoney_kline'
+
+    # 支持的市场类型
+    MARKETS = ('A', 'ETF', 'LOF')
+
+    @staticmethod
+    def secid(stock_code: str) -> str:
+        """
+        将6位代码转换为接口的secid：沪市（5、6、9开头）为1，深市和北交所（含92开头的新代码）为0
+        """
+        if stock_code.startswith('92'):
+            return f"0.{stock_code}"
+        market_code = '1' if stock_code[:1] in ('5', '6', '9') else '0'
+        return f"{market_code}.{stock_code}"
+
+    async def fetch_history(self, stock_code: str, market_type: str,
+                            start_date: str, end_date: str, adjust: str = '',
+                            group: Optional[Hashable] = None,
+                            timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        获取指定区间的标准化日K线，列与akshare数据源的标准化结果一致
+
+        Args:
+            stock_code: 股票/基金代码
+            market_type: 市场类型（A/ETF/LOF）
+            start_date: 开始日期，格式YYYYMMDD
+            end_date: 结束日期，格式YYYYMMDD
+            adjust: 复权方式，''/'qfq'/'hfq'
+            group: 调度分组，与线程中的获取共用并发槽位，见 FetchScheduler.arun
+            timeout: 网络请求超时秒数（不含排队和限速等待的时间）
+
+        Returns:
+            以日期为升序索引的DataFrame，代码不存在或区间内无数据时为空；请求或解析失败时抛出异常
+        """
+        if market_type not in self.MARKETS:
+            raise ValueError(f"原生异步获取不支持的市场类型: {market_type}")
+
+        params = {
+            'fields1': 'f1,f2,f3,f4,f5,f6',
+            'fields2': 'f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61',
+            'ut': '7eea3edcaed734bea9cbfc24409ed989',
+            'klt': '101',
+            'fqt': ADJUST_FQT.get(adjust, '0'),
+            'secid': self.secid(stock_code),
+            'beg': start_date,
+            'end': end_date,
+        }
+
+        logger.debug(f"原生异步获取{market_type}数据: {stock_code}")
+        response = await fetch_scheduler.arun(
+            lambda: http_client_pool.get_client().get(EASTMONEY_KLINE_URL, params=params),
+            source=MARKET_SOURCES[market_type], group=group, timeout=timeout
+        )
+        response.raise_for_status()
+        data = response.json().get('data') or {}
+        return self.parse_klines(data.get('klines') or [], stock_code if market_type == 'A' else None)
+
+    @staticmethod
+    def parse_klines(klines: List[str], stock_code: Optional[str] = None) -> pd.DataFrame:
+        """
+        将接口返回的K线文本行解析为DataFrame
+
+        Args:
+            klines: 形如 "2024-01-02,10.00,10.10,..." 的文本行
+            stock_code: 指定时添加Code列（与A股akshare结果的列保持一致）
+        """
+        if not klines:
+            return pd.DataFrame()
+
+        # 一次性拆分为二维字符串数组，再按列整体转换类型
+        rows = np.array([line.split(',') for line in klines])
+        values = rows[:, 1:len(KLINE_FIELDS) + 1]
+        values = np.where(values == '-', 'nan', values).astype(np.float64)
+
+        columns = {}
+        if stock_code is not None:
+            columns['Code'] = np.full(len(rows), stock_code, dtype=object)
+        for i, name in enumerate(KLINE_FIELDS):
+            columns[name] = values[:, i]
+        if not np.isnan(columns['Volume']).any():
+            columns['Volume'] = columns['Volume'].astype(np.int64)
+
+        index = pd.DatetimeIndex(rows[:, 0].astype('datetime64[ns]'), name='Date')
+        df = pd.DataFrame(columns, index=index)
+        # 确保按日期升序排序
+        if not df.index.is_monotonic_increasing:
+            df.sort_index(inplace=True)
+        return df
+
+class TencentKlineFetcher:
+    """
+    腾讯日K线原生异步获取器，作为东方财富接口的备用数据源
+    接口不返回成交额、换手率等字段：涨跌幅、涨跌额、振幅由前一日收盘价计算（除权除息日与交易所的值不同），
+    成交额按 成交量（手）×100×收盘价 估算，换手率为NaN；
+    这些列记录在 df.attrs[ESTIMATED_COLUMNS_ATTR] 中，写入本地存储时不覆盖已有的值
+    """
+
+    name = 'tencent_kline'
+
+    # 支持的市场类型
+    MARKETS = ('A', 'ETF', 'LOF')
+
+    # 接口单次最多返回的K线数，长区间按年分段请求
+    MAX_BARS = 640
+
+    # 向前多取的自然日数，使区间第一根K线也有前收盘价用于计算涨跌幅
+    PREV_CLOSE_DAYS = 14
+
+    @staticmethod
+    def symbol(stock_code: str) -> str:
+        """将6位代码转换为带交易所前缀的代码，如 sh600000、sz000001、bj830799、bj920001"""
+        if stock_code.startswith('92'):
+            return f"bj{stock_code}"
+        if stock_code[:1] in ('5', '6', '9'):
+            return f"sh{stock_code}"
+        if stock_code[:1] in ('4', '8'):
+            return f"bj{stock_code}"
+        return f"sz{stock_code}"
+
+    async def fetch_history(self, stock_code: str, market_type: str,
+                            start_date: str, end_date: str, adjust: str = '',
+                            group: Optional[Hashable] = None,
+                            timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        获取指定区间的标准化日K线，参数和返回值与EastmoneyKlineFetcher.fetch_history相同
+        """
+        if market_type not in self.MARKETS:
+            raise ValueError(f"原生异步获取不支持的市场类型: {market_type}")
+
+        symbol = self.symbol(stock_code)
+        start = pd.Timestamp(start_date)
+        end = pd.Timestamp(end_date)
+        fetch_start = start - pd.Timedelta(days=self.PREV_CLOSE_DAYS)
+        # 按自然年分段，避免单次请求超过接口返回上限
+        segments = []
+        for year in range(fetch_start.year, end.year + 1):
+            seg_start = max(fetch_start, pd.Timestamp(year=year, month=1, day=1))
+            seg_end = min(end, pd.Timestamp(year=year, month=12, day=31))
+            segments.append((seg_start.strftime('%Y-%m-%d'), seg_end.strftime('%Y-%m-%d')))
+
+        logger.debug(f"原生异步获取{market_type}数据（腾讯）: {stock_code}")
+        client = http_client_pool.get_client()
+        # 各年度分段在同一个槽位和令牌内并发请求
+        responses = await fetch_scheduler.arun(
+            lambda: asyncio.gather(*[
+                client.get(TENCENT_KLINE_URL, params={'param': f"{symbol},day,{seg_start},{seg_end},{self.MAX_BARS},{adjust}"})
+                for seg_start, seg_end in segments
+            ]),
+            source='tencent_hist', group=group, timeout=timeout
+        )
+
+        rows = []
+        for response in responses:
+            response.raise_for_status()
+            data = (response.json().get('data') or {}).get(symbol) or {}
+            if not isinstance(data, dict):
+                continue
+            rows.extend(data.get(f"{adjust}day") or data.get('day') or [])
+        df = self.parse_rows(rows, stock_code if market_type == 'A' else None)
+        if df.empty:
+            return df
+        # 去掉只用于计算前收盘价的K线
+        result = df[df.index >= start]
+        result.attrs = dict(df.attrs)
+        return result
+
+    @staticmethod
+    def parse_rows(rows: List[list], stock_code: Optional[str] = None) -> pd.DataFrame:
+        """
+        将接口返回的 [日期, 开盘, 收盘, 最高, 最低, 成交量, ...] 行解析为标准列的DataFrame
+
+        Args:
+            rows: K线行列表
+            stock_code: 指定时添加Code列
+
+        Returns:
+            第一行没有前收盘价，涨跌幅、涨跌额、振幅为NaN
+        """
+        if not rows:
+            return pd.DataFrame()
+
+        values = np.array([row[:6] for row in rows])
+        dates = values[:, 0].astype('datetime64[ns]')
+        open_, close, high, low, volume = values[:, 1:6].astype(np.float64).T
+
+        order = np.argsort(dates, kind='stable')
+        dates, open_, close, high, low, volume = (arr[order] for arr in (dates, open_, close, high, low, volume))
+        # 分段请求的边界可能重复，保留最后一条，再计算前收盘价
+        last = np.append(dates[1:] != dates[:-1], True)
+        dates, open_, close, high, low, volume = (arr[last] for arr in (dates, open_, close, high, low, volume))
+        prev_close = np.concatenate(([np.nan], close[:-1]))
+
+        columns = {}
+        if stock_code is not None:
+            columns['Code'] = np.full(len(dates), stock_code, dtype=object)
+        columns.update({
+            'Open': open_,
+            'Close': close,
+            'High': high,
+            'Low': low,
+            'Volume': volume.astype(np.int64),
+            'Amount': volume * 100 * close,
+            'Amplitude': (high - low) / prev_close * 100,
+            'Change_pct': (close - prev_close) / prev_close * 100,
+            'Change': close - prev_close,
+            'Turnover': np.full(len(dates), np.nan),
+        })
+        df = pd.DataFrame(columns, index=pd.DatetimeIndex(dates, name='Date'))
+        df.attrs[ESTIMATED_COLUMNS_ATTR] = ('Amount', 'Turnover', 'Amplitude', 'Change_pct', 'Change')
+        return df
+
+# 进程内共享的获取器实例
+eastmoney_kline_fetcher = EastmoneyKlineFetcher()
+tencent_kline_fetcher = TencentKlineFetcher()
@@ -0,0 +1,331 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from utils.logger import get_logger
+from utils.single_flight import SingleFlight
+from services.trading_calendar import get_trading_calendar
+
+# 获取日志器
+logger = get_logger()
+
+class DataFrameCache:
+    """
+    进程内DataFrame LRU缓存
+    按字节预算（而非条目数）淘汰，过期时间随市场交易时段变化：
+    盘中使用较短的TTL（不超过本时段收盘），收盘后使用较长的TTL（但不超过按交易日历计算的下一次开盘）
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None,
+                 trading_ttl: Optional[int] = None,
+                 closed_ttl: Optional[int] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_bytes: 缓存字节预算，默认读取环境变量 DATA_CACHE_MAX_MB（默认256MB）
+            trading_ttl: 盘中TTL（秒），默认读取 DATA_CACHE_TRADING_TTL（默认60秒）
+            closed_ttl: 收盘后TTL（秒），默认读取 DATA_CACHE_CLOSED_TTL（默认6小时）
+        """
+        self.max_bytes = max_bytes or int(os.getenv('DATA_CACHE_MAX_MB', '256')) * 1024 * 1024
+        self.trading_ttl = trading_ttl or int(os.getenv('DATA_CACHE_TRADING_TTL', '60'))
+        self.closed_ttl = closed_ttl or int(os.getenv('DATA_CACHE_CLOSED_TTL', str(6 * 3600)))
+
+        # key -> (value, size, expires_at)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        logger.debug(f"初始化DataFrameCache，字节预算: {self.max_bytes}")
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        """估算缓存值占用的字节数"""
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, pd.Series):
+            return int(value.memory_usage(deep=True))
+        return sys.getsizeof(value)
+
+    def session_ttl(self, market_type: str, now: Optional[datetime] = None) -> int:
+        """
+        根据市场交易时段计算TTL
+
+        Args:
+            market_type: 市场类型
+            now: 当前时间（带时区），默认为系统当前时间
+
+        Returns:
+            TTL秒数
+        """
+        calendar = get_trading_calendar(market_type)
+        now = now.astimezone(calendar.tz) if now is not None else calendar.now()
+
+        if calendar.is_open(now):
+            # 盘中：不超过本时段收盘，收盘后的首次读取即可拿到收盘数据
+            return int(max(1, min(self.trading_ttl, (calendar.next_close(now) - now).total_seconds())))
+
+        # 非交易时段（含周末、节假日和午间休市）：不超过距下一次开盘的时间
+        return int(max(self.trading_ttl, min(self.closed_ttl, (calendar.next_open(now) - now).total_seconds())))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取缓存，命中时将条目移到最近使用位置
+
+        Returns:
+            缓存值，未命中或已过期时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[int] = None,
+            market_type: Optional[str] = None) -> None:
+        """
+        写入缓存，超出字节预算时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+            ttl: 过期秒数，未指定时按 market_type 的交易时段计算
+            market_type: 用于计算TTL的市场类型
+        """
+        if ttl is None:
+            ttl = self.session_ttl(market_type or 'A')
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            logger.debug(f"缓存值过大（{size}字节），跳过缓存: {key}")
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (value, size, time.time() + ttl)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """删除指定缓存条目"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def clear(self) -> None:
+        """清空缓存（不重置统计计数）"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+class NegativeCache:
+    """
+    失败结果缓存（负缓存）
+    记录确认没有数据的键（如 代码+请求区间），按连续失败次数指数退避，退避期内直接返回失败而不请求上游
+    """
+
+    # 触发清理的记录数
+    MAX_ENTRIES = 10000
+
+    def __init__(self, base_delay: Optional[float] = None, max_delay: Optional[float] = None):
+        """
+        Args:
+            base_delay: 首次失败后的退避秒数，默认读取环境变量 NEGATIVE_CACHE_BASE（默认30秒）
+            max_delay: 退避秒数上限，默认读取环境变量 NEGATIVE_CACHE_MAX（默认6小时）
+        """
+        self.base_delay = base_delay or float(os.getenv('NEGATIVE_CACHE_BASE', '30'))
+        self.max_delay = max_delay or float(os.getenv('NEGATIVE_CACHE_MAX', str(6 * 3600)))
+        # key -> (连续失败次数, 退避截止时间, 失败原因)
+        self._entries: Dict[Hashable, Tuple[int, float, str]] = {}
+        self._lock = threading.Lock()
+
+    def check(self, key: Hashable) -> Optional[str]:
+        """
+        检查键是否处于退避期
+
+        Returns:
+            退避期内返回失败原因，否则返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[2]
+
+    def record_failure(self, key: Hashable, reason: str) -> float:
+        """
+        记录一次失败
+
+        Returns:
+            本次退避秒数
+        """
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                # 清理早已过期的记录，避免大量无效代码导致无限增长
+                expired_before = time.time() - self.max_delay
+                self._entries = {k: v for k, v in self._entries.items() if v[1] > expired_before}
+            failures = self._entries.get(key, (0, 0.0, ''))[0] + 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+            self._entries[key] = (failures, time.time() + delay, reason)
+            return delay
+
+    def clear(self, key: Hashable) -> None:
+        """获取成功后清除失败记录"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回负缓存统计信息"""
+        now = time.time()
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'active': sum(1 for _, until, _ in self._entries.values() if until > now),
+            }
+
+class RefreshingDataset:
+    """
+    单个整表数据集（如美股、ETF、LOF全市场行情表）的stale-while-revalidate缓存
+    到期后继续返回旧数据，同时只由一个后台任务刷新；到期时间按市场交易时段计算，
+    并随机提前一部分，避免多个数据集同时到期；另按代码建立行号字典，单行查找无需扫描整表
+    """
+
+    # 后台刷新失败后的重试间隔（秒）
+    RETRY_INTERVAL = 30
+
+    def __init__(self, name: str, loader: Callable[[], Awaitable[pd.DataFrame]], market_type: str,
+                 key_column: str = 'symbol', key_func: Optional[Callable[[pd.Series], pd.Series]] = None,
+                 jitter: Optional[float] = None, max_stale: Optional[float] = None):
+        """
+        Args:
+            name: 数据集名称（用于日志和请求合并）
+            loader: 获取整表的协程函数
+            market_type: 用于计算到期时间的市场类型
+            key_column: 代码列名
+            key_func: 生成代码别名的函数（如美股'105.AAPL' -> 'AAPL'），别名也可用于查找
+            jitter: 到期时间随机提前的最大比例，默认读取环境变量 SPOT_DATASET_JITTER（默认0.2）
+            max_stale: 旧数据最多使用的秒数，超过后请求等待刷新完成，
+                       默认读取环境变量 SPOT_DATASET_MAX_STALE（默认1天）
+        """
+        self.name = name
+        self._loader = loader
+        self.market_type = market_type
+        self.key_column = key_column
+        self._key_func = key_func
+        self.jitter = jitter if jitter is not None else float(os.getenv('SPOT_DATASET_JITTER', '0.2'))
+        self.max_stale = max_stale or float(os.getenv('SPOT_DATASET_MAX_STALE', str(24 * 3600)))
+        # (整表, 代码 -> 行号)，刷新完成后整体替换
+        self._data: Optional[Tuple[pd.DataFrame, Dict[str, int]]] = None
+        self._loaded_at = 0.0
+        self._refresh_at = 0.0
+        self._flight = SingleFlight()
+        self._background: Optional[asyncio.Task] = None
+
+    def _positions(self, df: pd.DataFrame) -> Dict[str, int]:
+        keys = df[self.key_column].astype(str)
+        positions: Dict[str, int] = {}
+        # 倒序写入，重复代码保留第一行；别名先写入，不覆盖原始代码
+        if self._key_func is not None:
+            positions.update(zip(self._key_func(keys).iloc[::-1], range(len(df) - 1, -1, -1)))
+        positions.update(zip(keys.iloc[::-1], range(len(df) - 1, -1, -1)))
+        return positions
+
+    async def _load(self) -> pd.DataFrame:
+        df = await self._loader()
+        if df is None or df.empty:
+            raise ValueError(f"{self.name}数据为空")
+        self._data = (df, self._positions(df))
+        self._loaded_at = time.time()
+        ttl = data_cache.session_ttl(self.market_type)
+        self._refresh_at = self._loaded_at + ttl * (1 - random.uniform(0, self.jitter))
+        logger.debug(f"{self.name}已刷新，共 {len(df)} 行，{self._refresh_at - self._loaded_at:.0f} 秒后到期")
+        return df
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            await self._flight.do(self.name, self._load)
+        except Exception as e:
+            # 刷新失败时继续使用旧数据，稍后重试
+            self._refresh_at = time.time() + self.RETRY_INTERVAL * (1 + random.uniform(0, self.jitter))
+            logger.warning(f"后台刷新{self.name}失败，继续使用旧数据: {str(e)}")
+
+    def current(self) -> Optional[pd.DataFrame]:
+        """
+        返回当前数据（可能已到期），到期时启动后台刷新；从未加载过时返回None（不等待加载）
+        """
+        data = self._data
+        if data is not None and time.time() >= self._refresh_at and (self._background is None or self._background.done()):
+            self._background = asyncio.ensure_future(self._refresh_in_background())
+        return data[0] if data is not None else None
+
+    async def get(self) -> pd.DataFrame:
+        """
+        返回整表：首次使用或旧数据超过max_stale时等待加载，否则立即返回（到期时在后台刷新）
+        """
+        if self._data is None or time.time() - self._loaded_at > self.max_stale:
+            return await self._flight.do(self.name, self._load)
+        return self.current()
+
+    async def lookup(self, symbol: str) -> Optional[pd.Series]:
+        """
+        按代码（或别名）查找单行
+
+        Returns:
+            该行数据，代码不存在时返回None
+        """
+        await self.get()
+        df, positions = self._data
+        position = positions.get(str(symbol))
+        return df.iloc[position] if position is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回数据集状态"""
+        data = self._data
+        now = time.time()
+        return {
+            'rows': len(data[0]) if data is not None else 0,
+            'age': round(now - self._loaded_at, 1) if data is not None else None,
+            'stale': data is not None and now >= self._refresh_at,
+            'refreshing': self._background is not None and not self._background.done(),
+        }
+
+# 进程内共享的缓存实例
+data_cache = DataFrameCache()
+negative_cache = NegativeCache()
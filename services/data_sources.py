@@ -0,0 +1,433 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, Hashable, Optional, Protocol, Sequence, Tuple, runtime_checkable
+from utils.logger import get_logger
+from services.data_cache import data_cache
+from services.trading_calendar import get_trading_calendar
+from services.fetch_scheduler import fetch_scheduler, MARKET_SOURCES
+from services.stock_history_store import StockHistoryStore
+from services.async_fetchers import eastmoney_kline_fetcher, tencent_kline_fetcher
+from services.source_health import source_health
+
+# 获取日志器
+logger = get_logger()
+
+# 支持的市场类型
+SUPPORTED_MARKETS = ('A', 'HK', 'US', 'ETF', 'LOF')
+
+def slice_date_range(df: pd.DataFrame, start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    在按日期升序的索引上通过二分查找截取日期区间
+
+    Args:
+        df: 以DatetimeIndex升序排列的DataFrame
+        start_date: 开始日期，格式YYYYMMDD
+        end_date: 结束日期，格式YYYYMMDD
+
+    Returns:
+        区间内数据的副本
+    """
+    start_dt = pd.to_datetime(start_date, format='%Y%m%d')
+    end_dt = pd.to_datetime(end_date, format='%Y%m%d')
+    left = df.index.searchsorted(start_dt, side='left')
+    right = df.index.searchsorted(end_dt, side='right')
+    return df.iloc[left:right].copy()
+
+def compact_bars(df: pd.DataFrame, columns: Optional[Sequence[str]] = None,
+                 downcast: bool = True) -> pd.DataFrame:
+    """
+    生成标准化K线的紧凑表示
+
+    Args:
+        df: 标准化K线
+        columns: 下游需要的列，未指定时保留除Code外的全部列（Code在单只股票的数据中是常量）
+        downcast: 是否压缩数据类型：浮点列转为float32，成交量转为能容纳的最小整数类型，
+                  其余对象列转为category
+
+    Returns:
+        新的DataFrame，不修改原数据
+    """
+    if df.empty:
+        return df
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    else:
+        df = df.drop(columns=['Code'], errors='ignore')
+    if not downcast:
+        return df.copy()
+
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if col == 'Volume' and not df[col].isna().any():
+            values = df[col].to_numpy()
+            if np.abs(values).max() < np.iinfo(np.int32).max and (values == np.round(values)).all():
+                dtypes[col] = np.int32
+            else:
+                dtypes[col] = np.int64 if pd.api.types.is_integer_dtype(dtype) else np.float32
+        elif pd.api.types.is_float_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            dtypes[col] = np.float32
+        elif pd.api.types.is_object_dtype(dtype):
+            dtypes[col] = 'category'
+    return df.astype(dtypes)
+
+@runtime_checkable
+class DataSource(Protocol):
+    """
+    K线数据源接口
+    返回标准化后的日线数据：以日期为升序索引，列名为 Open/High/Low/Close/Volume/Amount 等
+    """
+
+    name: str
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        获取指定区间的标准化K线，失败时抛出异常
+
+        Args:
+            stock_code: 股票代码
+            market_type: 市场类型
+            start_date: 开始日期，格式YYYYMMDD
+            end_date: 结束日期，格式YYYYMMDD
+        """
+        ...
+
+    def fetch_full_history(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        """
+        如果数据源能低成本提供全部历史（如接口本身返回全量数据），返回全量K线，否则返回None
+        """
+        ...
+
+    # 数据源还可以选择实现异步接口（见AkshareDataSource）：
+    #   supports_async(market_type) -> bool
+    #   async afetch_history(stock_code, market_type, start_date, end_date, group=None, timeout=None) -> pd.DataFrame
+    # 支持时StockDataProvider直接在事件循环中获取，不占用获取线程
+
+class AkshareDataSource:
+    """
+    基于akshare的数据源
+    负责调用akshare接口并将各市场返回的列名统一为标准K线格式；
+    A股和ETF/LOF日线优先使用原生异步获取器，慢或失败时对冲/回退到备用接口和akshare
+    """
+
+    name = 'akshare'
+
+    # 接口一次返回全部上市历史的市场
+    FULL_HISTORY_MARKETS = ('HK', 'US')
+
+    def __init__(self, adjust: str = 'qfq'):
+        """
+        Args:
+            adjust: 复权方式
+        """
+        self.adjust = adjust
+        # 全量历史获取锁，避免同一代码的不同区间请求在线程中重复下载
+        self._full_history_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._full_history_locks_guard = threading.Lock()
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        import akshare as ak
+
+        if market_type in self.FULL_HISTORY_MARKETS:
+            # 港股/美股接口返回全部上市历史，全量数据按天缓存，区间请求直接切片
+            full_df = self._get_full_history(stock_code, market_type)
+            if full_df.empty:
+                return full_df
+            return slice_date_range(full_df, start_date, end_date)
+
+        fetch_scheduler.throttle(MARKET_SOURCES[market_type])
+        if market_type == 'A':
+            logger.debug(f"获取A股数据: {stock_code}")
+            df = ak.stock_zh_a_hist(
+                symbol=stock_code,
+                start_date=start_date,
+                end_date=end_date,
+                adjust=self.adjust
+            )
+        elif market_type == 'ETF':
+            logger.debug(f"获取{market_type}基金数据: {stock_code}")
+            df = ak.fund_etf_hist_em(
+                symbol=stock_code,
+                start_date=start_date,
+                end_date=end_date
+            )
+        elif market_type == 'LOF':
+            logger.debug(f"获取{market_type}基金数据: {stock_code}")
+            df = ak.fund_lof_hist_em(
+                symbol=stock_code,
+                start_date=start_date,
+                end_date=end_date
+            )
+        else:
+            raise ValueError(f"不支持的市场类型: {market_type}")
+
+        if df.empty:
+            return df
+
+        # 标准化列名
+        if market_type == 'A':
+            # 根据实际数据结构调整列名映射
+            # 实际数据列：['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+            df.columns = ['Date', 'Code', 'Open', 'Close', 'High', 'Low', 'Volume', 'Amount', 'Amplitude', 'Change_pct', 'Change', 'Turnover']
+        else:
+            # 基金数据可能有不同的列
+            df.columns = ['Date', 'Open', 'Close', 'High', 'Low', 'Volume', 'Amount', 'Amplitude', 'Change_pct', 'Change', 'Turnover']
+
+        # 确保日期列是日期类型
+        df['Date'] = pd.to_datetime(df['Date'])
+        df.set_index('Date', inplace=True)
+
+        # 确保按日期升序排序
+        df.sort_index(inplace=True)
+        return df
+
+    def supports_async(self, market_type: str) -> bool:
+        """是否可以使用原生异步获取器获取该市场的数据"""
+        return market_type in eastmoney_kline_fetcher.MARKETS
+
+    async def afetch_history(self, stock_code: str, market_type: str,
+                             start_date: str, end_date: str,
+                             group: Optional[Hashable] = None,
+                             timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        fetch_history的原生异步版本
+
+        依次使用东方财富、腾讯K线接口和akshare（在获取线程池中执行）：
+        东方财富接口超过其p95延迟未返回时向腾讯接口发出对冲请求，
+        接口失败时立即回退到下一个，连续失败的接口会被熔断一段时间
+
+        Args:
+            group: 调度分组，异步获取器和回退的akshare调用与其他请求按分组轮询获得槽位
+            timeout: 每个数据源单次请求的超时秒数（不含排队和限速等待的时间），超时按失败处理并尝试下一个
+        """
+        # 现有akshare调用中ETF/LOF不复权，保持一致
+        adjust = self.adjust if market_type == 'A' else ''
+        return await source_health.hedged_request([
+            (eastmoney_kline_fetcher.name,
+             lambda: eastmoney_kline_fetcher.fetch_history(stock_code, market_type, start_date, end_date, adjust,
+                                                           group=group, timeout=timeout)),
+            (tencent_kline_fetcher.name,
+             lambda: tencent_kline_fetcher.fetch_history(stock_code, market_type, start_date, end_date, adjust,
+                                                         group=group, timeout=timeout)),
+            (self.name,
+             lambda: fetch_scheduler.run(self.fetch_history, stock_code, market_type, start_date, end_date,
+                                         group=group, timeout=timeout)),
+        ])
+
+    def fetch_full_history(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        if market_type not in self.FULL_HISTORY_MARKETS:
+            return None
+        return self._get_full_history(stock_code, market_type)
+
+    def _get_full_history(self, stock_code: str, market_type: str) -> pd.DataFrame:
+        """
+        获取港股/美股全量历史，按市场当地日期在内存缓存中保存一天
+
+        Returns:
+            以日期为索引、按日期升序排列的DataFrame
+        """
+        now = get_trading_calendar(market_type).now()
+        cache_key = ('full_history', market_type, stock_code, self.adjust, now.strftime('%Y%m%d'))
+
+        with self._full_history_locks_guard:
+            lock = self._full_history_locks.setdefault((market_type, stock_code), threading.Lock())
+
+        with lock:
+            df = data_cache.get(cache_key)
+            if df is not None:
+                logger.debug(f"使用当日缓存的{market_type}全量历史: {stock_code}")
+                return df
+
+            df = self._fetch_full_history(stock_code, market_type)
+            if not df.empty:
+                next_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+                data_cache.set(cache_key, df, ttl=int((next_midnight - now).total_seconds()) + 1)
+            return df
+
+    def _fetch_full_history(self, stock_code: str, market_type: str) -> pd.DataFrame:
+        """
+        从akshare下载港股/美股的全部上市历史并标准化列名
+
+        Returns:
+            以日期为索引、按日期升序排列的DataFrame
+        """
+        import akshare as ak
+
+        fetch_scheduler.throttle(MARKET_SOURCES[market_type])
+        if market_type == 'HK':
+            logger.debug(f"获取港股数据: {stock_code}")
+            df = ak.stock_hk_daily(
+                symbol=stock_code,
+                adjust=self.adjust
+            )
+        else:
+            logger.debug(f"获取美股数据: {stock_code}")
+            try:
+                df = ak.stock_us_daily(
+                    symbol=stock_code,
+                    adjust=self.adjust
+                )
+            except Exception as e:
+                logger.error(f"获取美股数据失败 {stock_code}: {str(e)}")
+                raise ValueError(f"获取美股数据失败 {stock_code}: {str(e)}")
+
+        if df.empty:
+            return df
+
+        logger.debug(f"{market_type}数据原始列: {df.columns.tolist()}, 形状: {df.shape}")
+
+        # 确保索引是日期时间类型
+        if not isinstance(df.index, pd.DatetimeIndex):
+            # 如果存在命名为'date'的列，将其设为索引
+            if 'date' in df.columns:
+                df['date'] = pd.to_datetime(df['date'])
+                df.set_index('date', inplace=True)
+            elif market_type == 'HK':
+                # 尝试将第一列转换为日期索引
+                date_col = df.columns[0]
+                df[date_col] = pd.to_datetime(df[date_col])
+                df.set_index(date_col, inplace=True)
+            else:
+                # 否则将当前索引转换为日期类型
+                df.index = pd.to_datetime(df.index)
+
+        # 将所有列名转为小写以进行统一处理
+        df.columns = [col.lower() for col in df.columns]
+
+        if market_type == 'US':
+            # 计算美股的成交额（Amount）= 成交量（Volume）× 收盘价（Close）
+            if 'volume' in df.columns and 'close' in df.columns:
+                df['amount'] = df['volume'] * df['close']
+            else:
+                logger.warning(f"美股数据缺少volume或close列，无法计算amount。当前列: {df.columns.tolist()}")
+                # 添加空的amount列，避免后续处理错误
+                df['amount'] = 0.0
+
+        # 港股/美股数据列可能不同，需要通过映射处理
+        columns_mapping = {
+            'open': 'Open',
+            'high': 'High',
+            'low': 'Low',
+            'close': 'Close',
+            'volume': 'Volume',
+            'amount': 'Amount'
+        }
+
+        # 创建新的DataFrame以确保列顺序和存在性
+        new_df = pd.DataFrame(index=df.index)
+        for orig_col, new_col in columns_mapping.items():
+            if orig_col in df.columns:
+                new_df[new_col] = df[orig_col]
+            else:
+                # 如果原始列不存在，创建一个填充0的列
+                logger.warning(f"数据中缺少{orig_col}列，使用0值填充")
+                new_df[new_col] = 0.0
+
+        # 确保按日期升序排序，切片依赖有序索引
+        new_df.sort_index(inplace=True)
+        return new_df
+
+class LocalFileDataSource:
+    """
+    本地文件数据源
+    从本地目录读取（回放）已录制的标准化K线，文件格式与StockHistoryStore相同，
+    可用于离线运行完整流程和基准测试
+    """
+
+    name = 'local'
+
+    def __init__(self, base_dir: Optional[str] = None):
+        """
+        Args:
+            base_dir: 数据目录，默认读取环境变量 STOCK_DATA_SOURCE_DIR，未设置时为 data/replay
+        """
+        self.base_dir = base_dir or os.getenv('STOCK_DATA_SOURCE_DIR', os.path.join('data', 'replay'))
+        self._files = StockHistoryStore(self.base_dir)
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        df = self.fetch_full_history(stock_code, market_type)
+        return slice_date_range(df, start_date, end_date)
+
+    def fetch_full_history(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        df = self._files.load(market_type, stock_code)
+        if df is None:
+            raise FileNotFoundError(f"本地数据目录 {self.base_dir} 中没有 {market_type}:{stock_code} 的数据")
+        df.attrs = {}
+        return df
+
+    def record(self, stock_code: str, market_type: str, df: pd.DataFrame) -> None:
+        """将标准化K线写入（合并到）本地数据目录"""
+        if df is not None and not df.empty:
+            self._files.append(market_type, stock_code, df)
+
+class RecordingDataSource:
+    """
+    录制数据源
+    包装另一个数据源，把获取到的每一段标准化K线同时录制到本地目录，
+    之后可用LocalFileDataSource回放
+    """
+
+    name = 'record'
+
+    def __init__(self, inner: DataSource, recorder: Optional[LocalFileDataSource] = None):
+        """
+        Args:
+            inner: 实际获取数据的数据源
+            recorder: 录制目标，默认为 STOCK_DATA_SOURCE_DIR 对应的本地文件数据源
+        """
+        self.inner = inner
+        self.recorder = recorder or LocalFileDataSource()
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        df = self.inner.fetch_history(stock_code, market_type, start_date, end_date)
+        self.recorder.record(stock_code, market_type, df)
+        return df
+
+    def fetch_full_history(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        df = self.inner.fetch_full_history(stock_code, market_type)
+        if df is not None:
+            self.recorder.record(stock_code, market_type, df)
+        return df
+
+def create_data_source(name: str, adjust: str = 'qfq') -> DataSource:
+    """
+    按名称创建数据源
+
+    Args:
+        name: 'akshare'、'local'（回放本地数据）或 'record'（使用akshare并录制到本地）
+        adjust: 复权方式（akshare数据源使用）
+    """
+    name = (name or 'akshare').lower()
+    if name == 'akshare':
+        return AkshareDataSource(adjust=adjust)
+    if name == 'local':
+        return LocalFileDataSource()
+    if name == 'record':
+        return RecordingDataSource(AkshareDataSource(adjust=adjust))
+    raise ValueError(f"不支持的数据源: {name}")
+
+# 进程内共享的数据源实例，键为(数据源名称, 复权方式)
+_data_sources: Dict[Tuple[str, str], DataSource] = {}
+_data_sources_lock = threading.Lock()
+
+def get_data_source(market_type: str, adjust: str = 'qfq') -> DataSource:
+    """
+    返回指定市场配置的共享数据源实例
+
+    数据源由环境变量 STOCK_DATA_SOURCE 指定（默认akshare），
+    可按市场用 STOCK_DATA_SOURCE_<市场>（如 STOCK_DATA_SOURCE_HK=local）单独覆盖
+    """
+    name = os.getenv(f'STOCK_DATA_SOURCE_{market_type}', os.getenv('STOCK_DATA_SOURCE', 'akshare')).lower()
+    with _data_sources_lock:
+        source = _data_sources.get((name, adjust))
+        if source is None:
+            source = create_data_source(name, adjust)
+            _data_sources[(name, adjust)] = source
+            logger.info(f"{market_type}市场使用数据源: {name}")
+        return source
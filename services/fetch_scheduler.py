@@ -0,0 +1,345 @@
+import os
+import time
+import asyncio
+import threading
+import functools
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 当前上下文登记的请求开始回调（见 FetchScheduler.on_start），随任务创建时的上下文复制传递到子任务
+_start_callbacks: ContextVar[Tuple[Callable[[], None], ...]] = ContextVar('fetch_start_callbacks', default=())
+
+# 各上游数据源的默认限速（每秒请求数）
+DEFAULT_RATE_LIMITS: Dict[str, float] = {
+    'a_hist': 5.0,
+    'hk_hist': 2.0,
+    'us_hist': 2.0,
+    'etf_hist': 5.0,
+    'lof_hist': 5.0,
+    'spot': 1.0,
+    'tencent_hist': 5.0,
+}
+
+# 市场类型对应的历史数据源
+MARKET_SOURCES: Dict[str, str] = {
+    'A': 'a_hist',
+    'HK': 'hk_hist',
+    'US': 'us_hist',
+    'ETF': 'etf_hist',
+    'LOF': 'lof_hist',
+}
+
+class TokenBucket:
+    """
+    令牌桶限速器（线程安全）
+    采用预约方式：令牌不足时记为负数，调用者按需等待，保证排队顺序
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数），默认与rate相同且不少于1
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        预约一个令牌
+
+        Returns:
+            需要等待的秒数（0表示可立即执行）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def refund(self) -> None:
+        """归还一个已预约但未使用的令牌（预约者在等待期间被取消或超时）"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def acquire(self) -> None:
+        """阻塞等待一个令牌（在工作线程中调用）"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+class SharedGroup:
+    """
+    被多个调用者共享的获取任务（如合并后的相同请求）的调度分组
+    任务同时在每个调用者的分组中排队，先轮到的分组为其取得槽位；
+    加入共享任务的交互请求不会因为发起者属于批量扫描而排在扫描的分组后面
+    """
+
+    def __init__(self, scheduler: 'FetchScheduler', group: Optional[Hashable] = None):
+        self._scheduler = scheduler
+        self.groups: List[Hashable] = [group if group is not None else object()]
+        # 正在排队等待槽位的Future
+        self._pending: Set[asyncio.Future] = set()
+
+    def add(self, group: Optional[Hashable] = None) -> None:
+        """
+        加入一个调用者的分组，正在排队的请求同时在该分组中排队
+
+        Args:
+            group: 调用者的调度分组，未指定时该调用者单独成组
+        """
+        if group is None:
+            group = object()
+        if any(existing is group for existing in self.groups):
+            return
+        self.groups.append(group)
+        for future in self._pending:
+            self._scheduler._enqueue(group, future)
+
+class FetchScheduler:
+    """
+    进程级数据获取调度器
+    所有上游数据调用在专用线程池中执行，并发槽位在不同请求（分组）之间轮询分配，
+    同时对每个上游数据源按令牌桶限速
+    """
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 rate_limits: Optional[Dict[str, float]] = None):
+        """
+        初始化调度器
+
+        Args:
+            max_workers: 线程池大小，默认读取环境变量 FETCH_MAX_WORKERS（默认8）
+            rate_limits: 各数据源每秒请求数，默认使用 DEFAULT_RATE_LIMITS，
+                         并可通过环境变量 FETCH_RATE_LIMITS（如 "a_hist=5,us_hist=2"）覆盖
+        """
+        self.max_workers = max_workers or int(os.getenv('FETCH_MAX_WORKERS', '8'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fetch')
+
+        limits = dict(DEFAULT_RATE_LIMITS)
+        limits.update(rate_limits or self._parse_rate_limits(os.getenv('FETCH_RATE_LIMITS', '')))
+        self._buckets: Dict[str, TokenBucket] = {name: TokenBucket(rate) for name, rate in limits.items()}
+        self._buckets_lock = threading.Lock()
+
+        # 并发槽位：active为正在执行的任务数，waiters按分组保存等待中的Future
+        self._active = 0
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+        logger.debug(f"初始化FetchScheduler，线程数: {self.max_workers}，限速: {limits}")
+
+    @staticmethod
+    def _parse_rate_limits(value: str) -> Dict[str, float]:
+        """解析形如 "a_hist=5,us_hist=2" 的限速配置"""
+        limits = {}
+        for item in value.split(','):
+            if '=' not in item:
+                continue
+            name, rate = item.split('=', 1)
+            try:
+                limits[name.strip()] = float(rate)
+            except ValueError:
+                logger.warning(f"忽略无效的限速配置: {item}")
+        return limits
+
+    def throttle(self, source: str) -> None:
+        """
+        在工作线程中等待指定数据源的令牌，应在真正发起上游请求前调用
+
+        Args:
+            source: 数据源名称，未配置的数据源不限速
+        """
+        bucket = self._buckets.get(source)
+        if bucket is not None:
+            bucket.acquire()
+
+    async def athrottle(self, source: str) -> None:
+        """
+        throttle的异步版本，供不占用线程的原生异步请求使用，与线程中的调用共用同一个令牌桶
+
+        Args:
+            source: 数据源名称，未配置的数据源不限速
+        """
+        bucket = self._buckets.get(source)
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait > 0:
+                try:
+                    await asyncio.sleep(wait)
+                except asyncio.CancelledError:
+                    # 等待期间被取消，令牌未被使用，归还给后面的请求
+                    bucket.refund()
+                    raise
+
+    @staticmethod
+    @contextlib.contextmanager
+    def on_start(callback: Callable[[], None]) -> Iterator[None]:
+        """
+        在with块内登记请求开始回调：块内（含其中创建的任务）的上游请求取得槽位和限速令牌、
+        真正发出时调用，用于让超时和延迟统计不包含排队时间
+
+        Args:
+            callback: 无参回调，同一个with块内的多次请求会多次调用
+        """
+        token = _start_callbacks.set(_start_callbacks.get() + (callback,))
+        try:
+            yield
+        finally:
+            _start_callbacks.reset(token)
+
+    @staticmethod
+    def _notify_start() -> None:
+        for callback in _start_callbacks.get():
+            callback()
+
+    def set_rate_limit(self, source: str, rate: float) -> None:
+        """设置或更新某个数据源的限速"""
+        with self._buckets_lock:
+            self._buckets[source] = TokenBucket(rate)
+
+    async def _acquire_slot(self, group: Hashable) -> None:
+        """获取一个并发槽位，槽位已满时按分组排队"""
+        if self._active < self.max_workers and not self._waiters:
+            self._active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        if isinstance(group, SharedGroup):
+            # 在每个调用者的分组中排队，先被分配的生效，其余分组中的同一Future在轮到时跳过
+            for member in group.groups:
+                self._enqueue(member, future)
+            group._pending.add(future)
+            future.add_done_callback(group._pending.discard)
+        else:
+            self._enqueue(group, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已被分配槽位后才取消，需要归还槽位
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _enqueue(self, group: Hashable, future: asyncio.Future) -> None:
+        self._waiters.setdefault(group, deque()).append(future)
+
+    def shared_group(self, group: Optional[Hashable] = None) -> SharedGroup:
+        """
+        创建共享获取任务的调度分组，可作为run/arun的group参数
+
+        Args:
+            group: 发起者的调度分组
+        """
+        return SharedGroup(self, group)
+
+    def _release_slot(self) -> None:
+        """释放槽位，按分组轮询把槽位转交给下一个等待者"""
+        while self._waiters:
+            group, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                # 该分组还有等待者，放到队尾实现轮询
+                self._waiters[group] = queue
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def run(self, func: Callable[..., Any], *args: Any,
+                  source: Optional[str] = None, group: Optional[Hashable] = None,
+                  timeout: Optional[float] = None) -> Any:
+        """
+        在专用线程池中执行同步数据获取函数
+
+        Args:
+            func: 同步函数
+            *args: 函数参数
+            source: 数据源名称，指定时在调用func前先按该数据源限速；
+                    对可能命中本地存储的调用应在函数内部按需调用throttle
+            group: 请求分组，同一分组（如一次批量扫描）的任务与其他分组轮询获得槽位，
+                   未指定时每次调用单独成组；共享的任务使用 shared_group 创建的分组
+            timeout: 执行超时秒数（不含排队时间），超时抛出asyncio.TimeoutError；
+                     工作线程无法中断，槽位在线程实际结束后才释放。
+                     指定source或timeout的调用视为上游请求，取得槽位后调用 on_start 登记的回调
+
+        Returns:
+            func的返回值
+        """
+        if group is None:
+            group = object()
+        await self._acquire_slot(group)
+        try:
+            if source is not None or timeout is not None:
+                self._notify_start()
+            call = functools.partial(func, *args)
+            if source is not None:
+                call = functools.partial(self._throttled_call, source, call)
+            future = asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except BaseException:
+            self._release_slot()
+            raise
+        future.add_done_callback(self._on_call_done)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    async def arun(self, func: Callable[[], Awaitable[Any]],
+                   source: Optional[str] = None, group: Optional[Hashable] = None,
+                   timeout: Optional[float] = None) -> Any:
+        """
+        调度原生异步获取：与线程中的调用共用并发槽位（按分组轮询）和令牌桶，
+        只有取得槽位后才预约令牌，批量请求不会提前占满令牌；取得令牌后调用 on_start 登记的回调
+
+        Args:
+            func: 返回协程的无参可调用对象（实际的网络请求）
+            source: 数据源名称，指定时先按该数据源限速
+            group: 请求分组，见run
+            timeout: 网络请求超时秒数（不含排队和限速等待的时间），超时抛出asyncio.TimeoutError
+
+        Returns:
+            func的返回值
+        """
+        if group is None:
+            group = object()
+        await self._acquire_slot(group)
+        try:
+            if source is not None:
+                await self.athrottle(source)
+            self._notify_start()
+            return await asyncio.wait_for(func(), timeout)
+        finally:
+            self._release_slot()
+
+    def _on_call_done(self, future: asyncio.Future) -> None:
+        """线程执行结束后释放槽位；调用者已超时离开时读取异常，避免未处理异常告警"""
+        self._release_slot()
+        if not future.cancelled():
+            future.exception()
+
+    def _throttled_call(self, source: str, call: Callable[[], Any]) -> Any:
+        """先限速再执行调用（在工作线程中运行）"""
+        self.throttle(source)
+        return call()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回调度器状态"""
+        return {
+            'max_workers': self.max_workers,
+            'active': self._active,
+            'waiting': len({id(f) for q in self._waiters.values() for f in q if not f.done()}),
+            'waiting_groups': len(self._waiters),
+            'rate_limits': {name: bucket.rate for name, bucket in self._buckets.items()},
+        }
+
+# 进程内共享的调度器实例
+fetch_scheduler = FetchScheduler()
@@ -1,8 +1,10 @@
 import asyncio
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 from utils.logger import get_logger
-from datetime import datetime, timedelta
+from services.data_cache import RefreshingDataset
+from services.fetch_scheduler import fetch_scheduler
+from services.symbol_search import SpotSearchIndex, format_search_rows
 
 # 获取日志器
 logger = get_logger()
@@ -16,12 +18,20 @@ class FundServiceAsync:
     def __init__(self):
         """初始化异步基金服务"""
         logger.debug("初始化FundServiceAsync")
-        
-        # 添加缓存
-        self._etf_cache = None
-        self._lof_cache = None
-        self._cache_timestamp = None
-        self._cache_duration = timedelta(minutes=30)  # 缓存30分钟
+        # ETF和LOF行情表各自独立到期和刷新，到期后继续使用旧数据并在后台刷新
+        self._datasets: Dict[str, RefreshingDataset] = {
+            'ETF': RefreshingDataset('ETF行情', self._load_etf_data, 'ETF'),
+            'LOF': RefreshingDataset('LOF行情', self._load_lof_data, 'LOF'),
+        }
+        # 各行情表的搜索索引
+        self._search_indexes: Dict[str, SpotSearchIndex] = {
+            market_type: SpotSearchIndex(market_type, dataset.get, dataset.current)
+            for market_type, dataset in self._datasets.items()
+        }
+    
+    async def warm_up(self) -> None:
+        """预先加载ETF和LOF行情表并构建搜索索引（应用启动预热时调用）"""
+        await asyncio.gather(*[index.get() for index in self._search_indexes.values()])
     
     async def search_funds(self, keyword: str, market_type: str = 'ETF') -> List[Dict[str, Any]]:
         """
@@ -37,28 +47,11 @@ class FundServiceAsync:
         try:
             logger.info(f"异步搜索基金: {keyword}, 类型: {market_type}")
             
-            # 获取基金数据
-            df = await self._get_funds_data(market_type)
-            
-            # 模糊匹配搜索（同时匹配代码和名称）
-            mask = (df['name'].str.contains(keyword, case=False, na=False) | 
-                   df['symbol'].str.contains(keyword, case=False, na=False))
-            results = df[mask]
-            
-            # 格式化返回结果并处理 NaN 值
-            formatted_results = []
-            for _, row in results.iterrows():
-                formatted_results.append({
-                    'name': row['name'] if pd.notna(row['name']) else '',
-                    'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                    'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                    'volume': float(row['volume']) if pd.notna(row['volume']) else 0.0,
-                    'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0,
-                    'total_value': float(row['total_value']) if pd.notna(row['total_value']) else 0.0,
-                })
-                # 限制只返回前10个结果
-                if len(formatted_results) >= 10:
-                    break
+            # 在内存索引中搜索（同时匹配代码和名称，索引在后台随行情表刷新），并整体格式化结果
+            market_type = 'ETF' if market_type == 'ETF' else 'LOF'
+            rows = await self._search_indexes[market_type].search(keyword, limit=10)
+            formatted_results = format_search_rows(
+                rows, ['name', 'symbol'], ['price', 'volume', 'market_value', 'total_value'])
             
             logger.info(f"基金搜索完成，找到 {len(formatted_results)} 个匹配项（限制显示前10个）")
             return formatted_results
@@ -71,7 +64,7 @@ class FundServiceAsync:
     
     async def _get_funds_data(self, market_type: str = 'ETF') -> pd.DataFrame:
         """
-        异步获取基金数据，支持缓存
+        异步获取基金数据，ETF和LOF各自缓存，到期后先返回旧数据并在后台刷新
         
         Args:
             market_type: 市场类型，'ETF'或'LOF'
@@ -79,39 +72,16 @@ class FundServiceAsync:
         Returns:
             包含基金数据的DataFrame
         """
-        # 检查缓存是否有效
-        now = datetime.now()
-        cache_valid = (
-            self._cache_timestamp is not None and 
-            (now - self._cache_timestamp) < self._cache_duration
-        )
-        
-        if market_type == 'ETF' and cache_valid and self._etf_cache is not None:
-            logger.debug("使用ETF缓存数据")
-            return self._etf_cache
-        elif market_type == 'LOF' and cache_valid and self._lof_cache is not None:
-            logger.debug("使用LOF缓存数据")
-            return self._lof_cache
-        
-        # 缓存无效，重新获取数据
-        try:
-            logger.debug(f"从API获取{market_type}数据")
-            
-            # 使用线程池执行同步的akshare调用
-            if market_type == 'ETF':
-                df = await asyncio.to_thread(self._get_etf_data)
-                self._etf_cache = df
-            else:
-                df = await asyncio.to_thread(self._get_lof_data)
-                self._lof_cache = df
-                
-            self._cache_timestamp = now
-            return df
-            
-        except Exception as e:
-            logger.error(f"获取{market_type}数据失败: {str(e)}")
-            logger.exception(e)
-            raise
+        market_type = 'ETF' if market_type == 'ETF' else 'LOF'
+        return await self._datasets[market_type].get()
+    
+    async def _load_etf_data(self) -> pd.DataFrame:
+        """获取ETF行情表（由数据集在需要刷新时调用），使用专用获取线程池执行同步的akshare调用"""
+        return await fetch_scheduler.run(self._get_etf_data, source='spot')
+    
+    async def _load_lof_data(self) -> pd.DataFrame:
+        """获取LOF行情表（由数据集在需要刷新时调用），使用专用获取线程池执行同步的akshare调用"""
+        return await fetch_scheduler.run(self._get_lof_data, source='spot')
     
     def _get_etf_data(self) -> pd.DataFrame:
         """
@@ -193,18 +163,13 @@ class FundServiceAsync:
         try:
             logger.info(f"获取{market_type}基金详情: {symbol}")
             
-            # 获取基金数据
-            df = await self._get_funds_data(market_type)
-            
-            # 精确匹配基金代码
-            result = df[df['symbol'] == symbol]
+            # 按代码字典查找（行情表到期时返回旧数据并在后台刷新）
+            market_type = 'ETF' if market_type == 'ETF' else 'LOF'
+            row = await self._datasets[market_type].lookup(symbol)
             
-            if len(result) == 0:
+            if row is None:
                 raise Exception(f"未找到基金代码: {symbol}")
             
-            # 获取第一行数据
-            row = result.iloc[0]
-            
             # 格式化为字典
             fund_detail = {
                 'name': row['name'] if pd.notna(row['name']) else '',
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence, Set
+from utils.logger import get_logger
+from services.data_cache import DataFrameCache
+from services.indicator_state import IndicatorState
+
+# 获取日志器
+logger = get_logger()
+
+def frame_fingerprint(df: pd.DataFrame, tail: int = 32) -> str:
+    """
+    计算K线数据的低成本指纹：行数、首末日期、列名和类型，以及最后tail行数据的校验和
+
+    历史数据在尾部之前被改写（如前复权基准变化）时尾部价格同样会变化，指纹随之改变
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{len(df)}|{df.index[0] if len(df) else ''}|{df.index[-1] if len(df) else ''}".encode())
+    rows = df.iloc[-tail:]
+    index = rows.index.to_numpy()
+    digest.update(index.astype(str).tobytes() if index.dtype == object else np.ascontiguousarray(index).tobytes())
+    for col, dtype in df.dtypes.items():
+        digest.update(f"|{col}:{dtype}|".encode())
+        values = rows[col].to_numpy()
+        if values.dtype.kind in 'biufcmM':
+            digest.update(np.ascontiguousarray(values).tobytes())
+        else:
+            digest.update('\x1f'.join(map(str, values)).encode())
+    return digest.hexdigest()
+
+class IndicatorCache:
+    """
+    技术指标结果缓存
+    键为输入K线的指纹 + TechnicalIndicator.params + 请求的输出列，同一只股票同一天的指标结果
+    在单股分析、多角色分析和不同用户之间共用；内存层按字节LRU淘汰，
+    完整指标结果同时在后台线程中写入磁盘层，重启后仍可直接读取；
+    另外在内存中保存盘中临时K线使用的增量指标状态（键为历史K线的缓存键）
+    """
+
+    # 内存中最多保存的增量指标状态数（每个约几KB）
+    MAX_STATES = 1024
+
+    def __init__(self, base_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 disk_days: Optional[float] = None):
+        """
+        Args:
+            base_dir: 磁盘层目录，默认读取环境变量 INDICATOR_CACHE_DIR，未设置时为 data/indicators
+            max_bytes: 内存层字节预算，默认读取 INDICATOR_CACHE_MAX_MB（默认64MB）
+            disk_days: 磁盘层文件保留天数，默认读取 INDICATOR_CACHE_DISK_DAYS（默认7天）
+        """
+        self.enabled = os.getenv('ENABLE_INDICATOR_CACHE', 'true').lower() == 'true'
+        self.disk_enabled = os.getenv('ENABLE_INDICATOR_DISK_CACHE', 'true').lower() == 'true'
+        self.base_dir = base_dir or os.getenv('INDICATOR_CACHE_DIR', os.path.join('data', 'indicators'))
+        self.memory = DataFrameCache(max_bytes=max_bytes or int(os.getenv('INDICATOR_CACHE_MAX_MB', '64')) * 1024 * 1024)
+        self.disk_days = disk_days or float(os.getenv('INDICATOR_CACHE_DISK_DAYS', '7'))
+        # 键由内容决定，不会过期失效，内存层TTL只用于释放长期不用的条目
+        self.ttl = 24 * 3600
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+        # 磁盘写入和清理在单独的线程中进行，调用方（通常是事件循环）不等待文件读写
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indicator-cache')
+        self._pending: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._states: 'OrderedDict[str, IndicatorState]' = OrderedDict()
+        self._states_lock = threading.Lock()
+        logger.debug(f"初始化IndicatorCache，启用: {self.enabled}，磁盘目录: {self.base_dir}")
+
+    @staticmethod
+    def key(df: pd.DataFrame, params: Dict[str, Any], outputs: Optional[Sequence[str]] = None) -> str:
+        """
+        计算缓存键
+
+        Args:
+            df: 输入K线
+            params: 指标参数
+            outputs: 请求的输出列，None表示全部指标
+        """
+        extra = json.dumps([params, list(outputs) if outputs is not None else None], sort_keys=True, default=str)
+        return hashlib.blake2b(f"{frame_fingerprint(df)}|{extra}".encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.base_dir, key[:2], f"{key}.npz")
+
+    def get(self, key: str, persistent: bool = True) -> Optional[pd.DataFrame]:
+        """
+        读取缓存的指标结果（返回副本），内存未命中时读取磁盘层并放回内存
+
+        Args:
+            persistent: 是否查找磁盘层
+        """
+        df = self.memory.get(key)
+        if df is None and persistent and self.disk_enabled:
+            df = self._read(key)
+            if df is not None:
+                self.disk_hits += 1
+                self.memory.set(key, df, ttl=self.ttl)
+        return df.copy() if df is not None else None
+
+    def set(self, key: str, df: pd.DataFrame, persistent: bool = True) -> None:
+        """
+        写入指标结果：立即写入内存层，磁盘层在后台线程中写入
+
+        Args:
+            persistent: 是否同时写入磁盘层（批量扫描的部分指标结果只保存在内存中）
+        """
+        df = df.copy()
+        self.memory.set(key, df, ttl=self.ttl)
+        if persistent and self.disk_enabled and isinstance(df.index, pd.DatetimeIndex):
+            with self._pending_lock:
+                if key in self._pending:
+                    return
+                self._pending.add(key)
+            self._writer.submit(self._write_in_background, key, df)
+
+    def _write_in_background(self, key: str, df: pd.DataFrame) -> None:
+        try:
+            self._write(key, df)
+            if time.time() - self._last_prune > 3600:
+                self.prune()
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def flush(self) -> None:
+        """等待已提交的磁盘写入完成"""
+        self._writer.submit(lambda: None).result()
+
+    def get_state(self, key: str) -> Optional[IndicatorState]:
+        """读取增量指标状态（共享对象，调用方只能通过 preview 使用，不能 update）"""
+        with self._states_lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def set_state(self, key: str, state: IndicatorState) -> None:
+        """保存增量指标状态，超过 MAX_STATES 时淘汰最久未使用的"""
+        with self._states_lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.MAX_STATES:
+                self._states.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = [str(c) for c in data['__columns__']]
+                index = pd.DatetimeIndex(data['__index__'].astype('datetime64[ns]'),
+                                         name=str(data['__index_name__']) or None,
+                                         freq=str(data['__freq__']) or None if '__freq__' in data else None)
+                return pd.DataFrame({col: data[f"col:{col}"] for col in columns}, index=index)
+        except Exception as e:
+            logger.warning(f"读取指标缓存失败 {key}: {str(e)}")
+            return None
+
+    def _write(self, key: str, df: pd.DataFrame) -> None:
+        arrays: Dict[str, Any] = {
+            '__index__': df.index.asi8,
+            '__index_name__': np.array(df.index.name or ''),
+            '__freq__': np.array(df.index.freqstr or ''),
+            '__columns__': np.array([str(c) for c in df.columns]),
+        }
+        for col in df.columns:
+            values = df[col].to_numpy()
+            # 对象列（如股票代码）转为定长字符串，避免依赖pickle
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"col:{col}"] = values
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+            self.disk_writes += 1
+        except Exception as e:
+            logger.warning(f"写入指标缓存失败 {key}: {str(e)}")
+
+    def prune(self) -> int:
+        """
+        删除磁盘层中超过保留天数未更新的文件
+
+        Returns:
+            删除的文件数
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return 0
+        removed = 0
+        try:
+            self._last_prune = time.time()
+            cutoff = self._last_prune - self.disk_days * 86400
+            if not os.path.isdir(self.base_dir):
+                return 0
+            for bucket in os.scandir(self.base_dir):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        continue
+            if removed:
+                logger.info(f"已清理 {removed} 个过期的指标缓存文件")
+        finally:
+            self._prune_lock.release()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        return {**self.memory.stats(), 'enabled': self.enabled,
+                'disk_hits': self.disk_hits, 'disk_writes': self.disk_writes,
+                'disk_pending': len(self._pending), 'states': len(self._states)}
+
+# 进程内共享的指标结果缓存
+indicator_cache = IndicatorCache()
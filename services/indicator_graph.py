@@ -0,0 +1,148 @@
+import numpy as np
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from utils.logger import get_logger
+from services.indicator_kernels import ema, rolling_mean, rolling_std, shift, true_range
+
+# 获取日志器
+logger = get_logger()
+
+class IndicatorGraph:
+    """
+    技术指标依赖图
+    指标和中间结果（如20日收盘价均值、滚动标准差、EMA）都是带名称的节点，
+    每个节点只计算一次并被所有依赖它的指标共用；调用方指定需要的输出时，只计算这些输出及其依赖
+
+    输入节点：High/Low/Close/Volume 及可选的 valid（真实K线位置的布尔掩码，面板补齐的位置为False）
+    """
+
+    INPUTS = ('High', 'Low', 'Close', 'Volume', 'valid')
+
+    def __init__(self, params: Dict[str, Any]):
+        """
+        Args:
+            params: TechnicalIndicator.params 格式的指标参数
+        """
+        self.params = params
+        # 节点名称 -> (依赖的节点, 计算函数)
+        self.nodes: Dict[str, Tuple[Tuple[str, ...], Callable[..., np.ndarray]]] = {}
+        # 指标输出列（按 calculate_indicators 添加列的顺序）
+        self.outputs: List[str] = []
+        self._build()
+
+    def add(self, name: str, deps: Iterable[str], func: Callable[..., np.ndarray],
+            output: bool = False) -> None:
+        """
+        添加一个节点
+
+        Args:
+            name: 节点名称（输出节点即指标列名）
+            deps: 依赖的节点名称，计算时按顺序作为func的参数
+            func: 计算函数
+            output: 是否为指标输出
+        """
+        self.nodes[name] = (tuple(deps), func)
+        if output and name not in self.outputs:
+            self.outputs.append(name)
+
+    def _close_mean(self, window: int) -> str:
+        name = f'close_mean_{window}'
+        self.add(name, ['Close'], lambda close: rolling_mean(close, window))
+        return name
+
+    def _close_std(self, window: int) -> str:
+        name = f'close_std_{window}'
+        self.add(name, ['Close'], lambda close: rolling_std(close, window))
+        return name
+
+    def _ema(self, source: str, period: int) -> str:
+        name = f'ema_{period}' if source == 'Close' else f'{source.lower()}_ema_{period}'
+        self.add(name, [source], lambda values: ema(values, period))
+        return name
+
+    def _build(self) -> None:
+        p = self.params
+        identity = lambda values: values
+
+        # 移动平均线
+        for period in p['ma_periods'].values():
+            self.add(f'MA{period}', [self._close_mean(period)], identity, output=True)
+
+        # RSI：首根K线的涨跌记为0（与pandas的where一致），面板补齐位置保持NaN
+        self.add('delta', ['Close'], lambda close: close - shift(close))
+        self.add('gain', ['delta', 'valid'],
+                 lambda delta, valid: np.where(valid, np.where(delta > 0, delta, 0.0), np.nan))
+        self.add('loss', ['delta', 'valid'],
+                 lambda delta, valid: np.where(valid, np.where(delta < 0, -delta, 0.0), np.nan))
+        rsi_period = p['rsi_period']
+        self.add('avg_gain', ['gain'], lambda gain: rolling_mean(gain, rsi_period))
+        self.add('avg_loss', ['loss'], lambda loss: rolling_mean(loss, rsi_period))
+        self.add('RSI', ['avg_gain', 'avg_loss'], lambda gain, loss: 100 - (100 / (1 + gain / loss)), output=True)
+
+        # MACD
+        self.add('MACD', [self._ema('Close', 12), self._ema('Close', 26)], np.subtract, output=True)
+        self.add('Signal', [self._ema('MACD', 9)], identity, output=True)
+        self.add('Histogram', ['MACD', 'Signal'], np.subtract, output=True)
+
+        # 布林带（中轨与同周期均线共用节点）
+        std_dev = p['bollinger_std']
+        middle = self._close_mean(p['bollinger_period'])
+        std = self._close_std(p['bollinger_period'])
+        self.add('BB_Middle', [middle], identity, output=True)
+        self.add('BB_Upper', [middle, std], lambda m, s: m + std_dev * s, output=True)
+        self.add('BB_Lower', [middle, std], lambda m, s: m - std_dev * s, output=True)
+
+        # 成交量移动平均和成交量比率
+        volume_period = p['volume_ma_period']
+        self.add('Volume_MA', ['Volume'], lambda volume: rolling_mean(volume, volume_period), output=True)
+        self.add('Volume_Ratio', ['Volume', 'Volume_MA'], np.divide, output=True)
+
+        # ATR
+        self.add('prev_close', ['Close'], shift)
+        self.add('true_range', ['High', 'Low', 'prev_close'], true_range)
+        atr_period = p['atr_period']
+        self.add('ATR', ['true_range'], lambda tr: rolling_mean(tr, atr_period), output=True)
+
+        # 波动率 (过去20天收盘价的标准差/均值)
+        self.add('Volatility', [self._close_std(20), self._close_mean(20)],
+                 lambda s, m: s / m * 100, output=True)
+
+    def required_nodes(self, outputs: Iterable[str]) -> List[str]:
+        """返回计算指定输出需要的全部节点（按依赖顺序，不含输入节点）"""
+        order: List[str] = []
+        seen = set()
+
+        def visit(name: str) -> None:
+            if name in seen or name in self.INPUTS:
+                return
+            if name not in self.nodes:
+                raise KeyError(f"未知的指标: {name}")
+            seen.add(name)
+            for dep in self.nodes[name][0]:
+                visit(dep)
+            order.append(name)
+
+        for name in outputs:
+            visit(name)
+        return order
+
+    def evaluate(self, inputs: Dict[str, np.ndarray],
+                 outputs: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        计算指定的输出
+
+        Args:
+            inputs: 输入节点 -> 数组（一维或 日期×代码 二维），未提供valid时视为全部为真实K线
+            outputs: 需要的指标列，默认为全部指标
+
+        Returns:
+            指标列名 -> 数组，按 outputs 的顺序
+        """
+        outputs = list(self.outputs if outputs is None else outputs)
+        values = dict(inputs)
+        if 'valid' not in values:
+            values['valid'] = np.ones(values['Close'].shape, dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name in self.required_nodes(outputs):
+                deps, func = self.nodes[name]
+                values[name] = func(*(values[dep] for dep in deps))
+        return {name: values[name] for name in outputs}
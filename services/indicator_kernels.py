@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.signal import lfilter
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 技术指标的数组计算函数，逐只计算（一维数组）和面板计算（日期×代码二维数组）共用同一实现；
+# 均按第0维（日期）计算，结果与对应的pandas写法（rolling/ewm/concat.max）一致
+
+def _as_2d(values: np.ndarray) -> np.ndarray:
+    return values.reshape(len(values), -1).astype(np.float64, copy=False)
+
+def _first_valid(values: np.ndarray) -> tuple:
+    """
+    返回每列第一个有效值所在的行及该值（整列为NaN时行为len(values)，值为0）
+    """
+    valid = ~np.isnan(values)
+    has_valid = valid.any(axis=0)
+    start = np.where(has_valid, valid.argmax(axis=0), len(values))
+    first = np.where(has_valid, values[np.minimum(start, len(values) - 1), np.arange(values.shape[1])], 0.0)
+    return start, first
+
+def _flat_windows(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    以第 window-1 行起每一行结尾的窗口内的值是否全部相同（对应pandas滚动计算中连续相同值的特殊处理）
+    """
+    same = np.zeros(values.shape)
+    same[1:] = values[1:] == values[:-1]
+    counts = np.cumsum(same, axis=0)
+    return counts[window - 1:] - counts[:len(values) - window + 1] == window - 1
+
+def _window_sums(values: np.ndarray, window: int) -> tuple:
+    """
+    基于累计和的滚动窗口和：返回(窗口内偏移后的值之和, 偏移后的平方和, 窗口内NaN个数, 偏移量)
+
+    每列减去第一个有效值后再累计，降低累计和的量级，减小大数相消带来的误差
+    """
+    _, offset = _first_valid(values)
+    shifted = values - offset
+    missing = np.isnan(shifted)
+    shifted = np.where(missing, 0.0, shifted)
+    zeros = np.zeros((1, values.shape[1]))
+    cum = np.concatenate([zeros, np.cumsum(shifted, axis=0)])
+    cum_sq = np.concatenate([zeros, np.cumsum(shifted * shifted, axis=0)])
+    cum_missing = np.concatenate([zeros, np.cumsum(missing, axis=0)])
+    total = cum[window:] - cum[:-window]
+    total_sq = cum_sq[window:] - cum_sq[:-window]
+    nan_count = cum_missing[window:] - cum_missing[:-window]
+    return total, total_sq, nan_count, offset
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    滚动均值，等价于 rolling(window).mean()：窗口内有NaN或不足window行时为NaN
+
+    Args:
+        values: 一维数组或 日期×代码 二维数组
+        window: 窗口长度
+    """
+    data = _as_2d(values)
+    result = np.full(data.shape, np.nan)
+    if len(data) >= window:
+        total, _, nan_count, offset = _window_sums(data, window)
+        mean = offset + total / window
+        # 窗口内全部值相同时直接取该值，与pandas一致
+        flat = _flat_windows(data, window)
+        mean = np.where(flat, data[window - 1:], mean)
+        result[window - 1:] = np.where(nan_count > 0, np.nan, mean)
+    return result.reshape(values.shape)
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    滚动样本标准差（ddof=1），等价于 rolling(window).std()
+
+    使用偏移数据的累计和与平方和计算方差（偏移后的一遍算法），
+    窗口内全部值相同时标准差精确为0，舍入产生的负方差截断为0
+    """
+    data = _as_2d(values)
+    result = np.full(data.shape, np.nan)
+    if len(data) >= window and window > 1:
+        total, total_sq, nan_count, _ = _window_sums(data, window)
+        var = (total_sq - total * total / window) / (window - 1)
+        flat = _flat_windows(data, window)
+        std = np.sqrt(np.maximum(np.where(flat, 0.0, var), 0.0))
+        result[window - 1:] = np.where(nan_count > 0, np.nan, std)
+    return result.reshape(values.shape)
+
+def _ema_recursive(values: np.ndarray, alpha: float) -> np.ndarray:
+    """逐行递推的EMA，处理中间有NaN的列（pandas的缺失值权重规则）"""
+    result = np.empty(values.shape)
+    prev = np.full(values.shape[1:], np.nan)
+    # 上一个值的权重，遇到NaN时按 (1-alpha) 继续衰减
+    old_weight = np.full(values.shape[1:], 1 - alpha)
+    for i in range(len(values)):
+        x = values[i]
+        missing = np.isnan(x)
+        # 与pandas一致：新值等于上一个值时不重新加权
+        current = np.where(np.isnan(prev) | (prev == x), x, (old_weight * prev + alpha * x) / (old_weight + alpha))
+        old_weight = np.where(missing & ~np.isnan(prev), old_weight * (1 - alpha), 1 - alpha)
+        prev = np.where(missing, prev, current)
+        result[i] = prev
+    return result
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    指数移动平均，等价于 ewm(span=period, adjust=False).mean()
+
+    用 scipy.signal.lfilter 按一阶IIR滤波整列计算：每列减去第一个有效值（常数序列结果精确不变），
+    前部NaN（面板补齐）用该值填充后滤波再还原为NaN；中间有NaN的列按pandas规则逐行递推
+    """
+    data = _as_2d(values)
+    result = np.full(data.shape, np.nan)
+    if not len(data):
+        return result.reshape(values.shape)
+    alpha = 2.0 / (period + 1.0)
+    start, first = _first_valid(data)
+    leading = np.arange(len(data))[:, None] < start[None, :]
+    gaps = (np.isnan(data) & ~leading).any(axis=0)
+
+    simple = ~gaps
+    if simple.any():
+        shifted = np.where(leading[:, simple], 0.0, data[:, simple] - first[simple])
+        filtered = lfilter([alpha], [1.0, alpha - 1.0], shifted, axis=0)
+        result[:, simple] = np.where(leading[:, simple], np.nan, filtered + first[simple])
+    if gaps.any():
+        result[:, gaps] = _ema_recursive(data[:, gaps], alpha)
+    return result.reshape(values.shape)
+
+def shift(values: np.ndarray) -> np.ndarray:
+    """向后移动一行（首行为NaN）"""
+    result = np.full(values.shape, np.nan)
+    result[1:] = values[:-1]
+    return result
+
+def true_range(high: np.ndarray, low: np.ndarray, prev_close: np.ndarray) -> np.ndarray:
+    """
+    真实波幅：max(最高-最低, |最高-前收|, |最低-前收|)
+
+    用 np.fmax.reduce 逐元素取最大值并跳过NaN（首根K线没有前收盘价时取最高-最低），
+    与 pd.concat([...], axis=1).max(axis=1) 一致
+    """
+    return np.fmax.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Mapping, Optional
+from utils.logger import get_logger
+from services.indicator_graph import IndicatorGraph
+
+# 获取日志器
+logger = get_logger()
+
+def join_indicators(df: pd.DataFrame, indicators: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    一次性构造 原始列 + 指标列 的新DataFrame（同名列以指标为准），避免逐列插入的开销
+
+    紧凑输入（float32价格）时指标列也保持float32
+    """
+    dtype = np.float32 if df['Close'].dtype == np.float32 else np.float64
+    columns = {col: df[col] for col in df.columns if col not in indicators}
+    columns.update({name: values.astype(dtype, copy=False) for name, values in indicators.items()})
+    result = pd.DataFrame(columns, index=df.index)
+    result.attrs = dict(df.attrs)
+    return result
+
+class IndicatorPanel:
+    """
+    多只股票的 日期×代码 二维面板
+    把N只股票的K线对齐为二维数组，用指标依赖图（IndicatorGraph）一次计算全部股票的技术指标，
+    结果与 TechnicalIndicator.calculate_indicators 逐只计算一致
+
+    对齐方式：各股票的最新K线对齐到最后一行，按K线序号向前排列（都交易到最近交易日时即为共同的交易日历）；
+    停牌缺失的日期不插入空行，滚动窗口与单只计算使用同样的K线，较短的历史在前部补NaN
+    """
+
+    def __init__(self, frames: Mapping[str, pd.DataFrame], columns: Optional[List[str]] = None):
+        """
+        Args:
+            frames: 代码 -> 以日期为升序索引的K线
+            columns: 需要对齐的输入列，默认为 High/Low/Close/Volume
+        """
+        self.frames = dict(frames)
+        self.codes = list(self.frames)
+        self.lengths = np.array([len(df) for df in self.frames.values()], dtype=np.int64)
+        self.rows = int(self.lengths.max()) if len(self.lengths) else 0
+        # 每列（股票）第一根真实K线所在的行
+        self.starts = self.rows - self.lengths
+        # 真实K线位置为True，前部补齐的位置为False
+        self.valid = np.arange(self.rows)[:, None] >= self.starts[None, :]
+
+        self.arrays: Dict[str, np.ndarray] = {}
+        for col in columns or ['High', 'Low', 'Close', 'Volume']:
+            panel = np.full((self.rows, len(self.codes)), np.nan)
+            for j, df in enumerate(self.frames.values()):
+                if len(df):
+                    panel[self.starts[j]:, j] = df[col].to_numpy(dtype=np.float64)
+            self.arrays[col] = panel
+
+    def calculate(self, params: Dict[str, Any], outputs: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        计算指标
+
+        Args:
+            params: TechnicalIndicator.params 格式的指标参数
+            outputs: 需要的指标列，默认为全部指标
+
+        Returns:
+            指标列名 -> 日期×代码 二维数组，列顺序与 calculate_indicators 添加的列一致
+        """
+        return IndicatorGraph(params).evaluate(dict(self.arrays, valid=self.valid), outputs)
+
+    def to_frames(self, indicators: Dict[str, np.ndarray]) -> Dict[str, pd.DataFrame]:
+        """
+        把指标数组拆回每只股票的DataFrame（原始列 + 指标列）
+        """
+        return {code: join_indicators(df, {name: values[self.starts[j]:, j] for name, values in indicators.items()})
+                for j, (code, df) in enumerate(self.frames.items())}
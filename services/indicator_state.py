@@ -0,0 +1,302 @@
+import math
+import copy
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+class RollingWindow:
+    """
+    固定长度滚动窗口，环形缓冲区加滑动Welford均值/平方差和，追加一个值为O(1)
+
+    与pandas一致：窗口内有NaN时均值和标准差为NaN（NaN不计入累计量，移出窗口后恢复），
+    窗口内全部值相同时标准差精确为0；每 RESYNC_INTERVAL 次追加按缓冲区重新计算，
+    消除长期累积的浮点误差
+    """
+
+    RESYNC_INTERVAL = 1000
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values: List[float] = []
+        self.pos = 0
+        # 窗口内非NaN值的个数、均值和平方差和
+        self.count = 0
+        self.avg = 0.0
+        self.m2 = 0.0
+        self.nan_count = 0
+        # 末尾连续相同值的个数
+        self.run = 0
+        self.pushes = 0
+
+    def _add(self, value: float) -> None:
+        if math.isnan(value):
+            self.nan_count += 1
+            return
+        self.count += 1
+        delta = value - self.avg
+        self.avg += delta / self.count
+        self.m2 += delta * (value - self.avg)
+
+    def _remove(self, value: float) -> None:
+        if math.isnan(value):
+            self.nan_count -= 1
+            return
+        self.count -= 1
+        if self.count == 0:
+            self.avg = self.m2 = 0.0
+            return
+        delta = value - self.avg
+        self.avg -= delta / self.count
+        self.m2 -= delta * (value - self.avg)
+
+    def push(self, value: float) -> None:
+        """追加一个值，窗口已满时移出最早的值"""
+        if self.values and value == self.values[self.pos - 1]:
+            self.run += 1
+        else:
+            self.run = 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+            self._add(value)
+            self.pos = len(self.values) % self.size
+        else:
+            old = self.values[self.pos]
+            self.values[self.pos] = value
+            self.pos = (self.pos + 1) % self.size
+            if math.isnan(old) or math.isnan(value):
+                self._remove(old)
+                self._add(value)
+            else:
+                # 同时移出和加入一个值（窗口内有NaN时非NaN值少于size个）
+                delta = value - old
+                old_avg = self.avg
+                self.avg += delta / self.count
+                self.m2 += delta * (value - self.avg + old - old_avg)
+        self.pushes += 1
+        if self.pushes % self.RESYNC_INTERVAL == 0:
+            self._resync()
+
+    def _resync(self) -> None:
+        valid = [v for v in self.values if not math.isnan(v)]
+        self.count = len(valid)
+        self.nan_count = len(self.values) - self.count
+        self.avg = sum(valid) / self.count if valid else 0.0
+        self.m2 = sum((v - self.avg) ** 2 for v in valid)
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.size
+
+    def mean(self) -> float:
+        """窗口均值，窗口未满或含NaN时为NaN（与 rolling(window).mean() 一致）"""
+        if not self.full or self.nan_count:
+            return math.nan
+        return self.values[self.pos - 1] if self.run >= self.size else self.avg
+
+    def std(self) -> float:
+        """窗口样本标准差（ddof=1），窗口未满或含NaN时为NaN"""
+        if not self.full or self.nan_count or self.size < 2:
+            return math.nan
+        if self.run >= self.size:
+            return 0.0
+        return math.sqrt(max(self.m2 / (self.size - 1), 0.0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        # 按时间顺序保存窗口内的值（NaN保存为None），恢复时重新累计
+        ordered = self.values[self.pos:] + self.values[:self.pos] if self.full else list(self.values)
+        return {'size': self.size, 'values': [None if math.isnan(v) else v for v in ordered]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RollingWindow':
+        window = cls(int(data['size']))
+        for value in data['values']:
+            window.push(math.nan if value is None else float(value))
+        return window
+
+class IndicatorState:
+    """
+    单只股票的增量技术指标状态
+    保存EMA/MACD递推值、MA/布林带/成交量均线的滚动窗口和RSI涨跌窗口，
+    每追加一根K线以常数时间更新全部指标，结果与 TechnicalIndicator.calculate_indicators 的最后一行一致
+    （含缺失值的K线按相同规则处理：滚动窗口内有NaN时为NaN，EMA沿用上一个值并按pandas规则衰减权重）；
+    可序列化为JSON兼容的字典，与K线历史一起保存
+    """
+
+    def __init__(self, params: Dict[str, Any]):
+        """
+        Args:
+            params: TechnicalIndicator.params 格式的指标参数
+        """
+        self.params = copy.deepcopy(params)
+        self.last_date: Optional[pd.Timestamp] = None
+        self.bars = 0
+        self.prev_close = math.nan
+        # MACD的三条EMA（span=12/26/9，adjust=False），首个值为第一根K线
+        self.ema_fast = math.nan
+        self.ema_slow = math.nan
+        self.ema_signal = math.nan
+        # 各EMA上一个值的权重，遇到NaN时按 (1-alpha) 衰减（与pandas的缺失值处理一致）
+        self.ema_weights = [math.nan, math.nan, math.nan]
+        # (序列, 窗口长度) -> 滚动窗口，相同序列和长度的指标共用一个窗口（如MA20与布林带中轨）
+        self.windows: Dict[str, RollingWindow] = {}
+        self.values: Dict[str, float] = {}
+
+    def _window(self, series: str, size: int) -> RollingWindow:
+        key = f"{series}:{size}"
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = RollingWindow(size)
+        return window
+
+    @staticmethod
+    def _ema(prev: float, weight: float, value: float, span: int) -> tuple:
+        """
+        EMA递推一步，返回(新的值, 上一个值的权重)
+
+        与 ewm(span, adjust=False) 一致：NaN不更新值，只让上一个值的权重继续衰减
+        """
+        alpha = 2.0 / (span + 1.0)
+        if math.isnan(weight):
+            weight = 1 - alpha
+        if math.isnan(value):
+            return prev, weight * (1 - alpha) if not math.isnan(prev) else 1 - alpha
+        if math.isnan(prev) or prev == value:
+            return value, 1 - alpha
+        return (weight * prev + alpha * value) / (weight + alpha), 1 - alpha
+
+    @staticmethod
+    def _div(a: float, b: float) -> float:
+        # 与pandas除法一致：x/0为±inf，0/0为NaN
+        if b == 0:
+            return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a)
+        return a / b
+
+    def _windows_for(self) -> Dict[str, RollingWindow]:
+        """按参数创建各指标使用的窗口（保证首根K线之前全部创建，窗口内容同步）"""
+        p = self.params
+        windows = {f"close:{n}": self._window('close', n) for n in p['ma_periods'].values()}
+        windows['bollinger'] = self._window('close', p['bollinger_period'])
+        windows['volatility'] = self._window('close', 20)
+        windows['gain'] = self._window('gain', p['rsi_period'])
+        windows['loss'] = self._window('loss', p['rsi_period'])
+        windows['volume'] = self._window('volume', p['volume_ma_period'])
+        windows['tr'] = self._window('tr', p['atr_period'])
+        return windows
+
+    def update(self, bar: Dict[str, Any], date: Optional[pd.Timestamp] = None) -> Dict[str, float]:
+        """
+        追加一根K线并返回该K线的全部指标值
+
+        Args:
+            bar: 包含High, Low, Close, Volume的K线（字典或pandas行）
+            date: K线日期
+
+        Returns:
+            指标名称 -> 值，键与 calculate_indicators 添加的列一致
+        """
+        high, low = float(bar['High']), float(bar['Low'])
+        close, volume = float(bar['Close']), float(bar['Volume'])
+        windows = self._windows_for()
+        p = self.params
+
+        # 收盘价窗口（MA、布林带、波动率共用）每根K线只追加一次
+        for key, window in self.windows.items():
+            if key.startswith('close:'):
+                window.push(close)
+
+        # RSI：首根K线的涨跌记为0
+        delta = close - self.prev_close if self.bars else math.nan
+        windows['gain'].push(delta if delta > 0 else 0.0)
+        windows['loss'].push(-delta if delta < 0 else 0.0)
+        windows['volume'].push(volume)
+        # 真实波幅：跳过NaN取最大值（首根K线没有前收盘价，取最高价-最低价），全部为NaN时为NaN
+        ranges = [v for v in (high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+                  if not math.isnan(v)]
+        windows['tr'].push(max(ranges) if ranges else math.nan)
+
+        weights = self.ema_weights
+        self.ema_fast, weights[0] = self._ema(self.ema_fast, weights[0], close, 12)
+        self.ema_slow, weights[1] = self._ema(self.ema_slow, weights[1], close, 26)
+        macd = self.ema_fast - self.ema_slow
+        self.ema_signal, weights[2] = self._ema(self.ema_signal, weights[2], macd, 9)
+
+        values: Dict[str, float] = {}
+        for period in p['ma_periods'].values():
+            values[f'MA{period}'] = windows[f"close:{period}"].mean()
+        rs = self._div(windows['gain'].mean(), windows['loss'].mean())
+        values['RSI'] = 100 - (100 / (1 + rs)) if not math.isinf(rs) else 100.0
+        values['MACD'] = macd
+        values['Signal'] = self.ema_signal
+        values['Histogram'] = macd - self.ema_signal
+        middle = windows['bollinger'].mean()
+        std = windows['bollinger'].std()
+        values['BB_Middle'] = middle
+        values['BB_Upper'] = middle + p['bollinger_std'] * std
+        values['BB_Lower'] = middle - p['bollinger_std'] * std
+        volume_ma = windows['volume'].mean()
+        values['Volume_MA'] = volume_ma
+        values['Volume_Ratio'] = self._div(volume, volume_ma)
+        values['ATR'] = windows['tr'].mean()
+        values['Volatility'] = self._div(windows['volatility'].std(), windows['volatility'].mean()) * 100
+
+        self.prev_close = close
+        self.bars += 1
+        self.last_date = pd.Timestamp(date) if date is not None else None
+        self.values = values
+        return values
+
+    def preview(self, bar: Dict[str, Any], date: Optional[pd.Timestamp] = None) -> Dict[str, float]:
+        """
+        计算一根临时K线（如盘中未收盘的K线）的指标值，不改变状态；
+        收盘后用 update 追加正式K线
+        """
+        return self.copy().update(bar, date)
+
+    def copy(self) -> 'IndicatorState':
+        return copy.deepcopy(self)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, params: Dict[str, Any]) -> 'IndicatorState':
+        """
+        用已有的K线历史初始化状态（逐根追加，之后每根新K线O(1)更新）
+
+        Args:
+            df: 以日期为升序索引、包含High, Low, Close, Volume列的K线
+            params: 指标参数
+        """
+        state = cls(params)
+        columns = [df[col].to_numpy() for col in ('High', 'Low', 'Close', 'Volume')]
+        for date, high, low, close, volume in zip(df.index, *columns):
+            state.update({'High': high, 'Low': low, 'Close': close, 'Volume': volume}, date)
+        return state
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为JSON兼容的字典（NaN保存为None）"""
+        def num(value: float) -> Optional[float]:
+            return None if math.isnan(value) else value
+        return {
+            'params': self.params,
+            'last_date': self.last_date.isoformat() if self.last_date is not None else None,
+            'bars': self.bars,
+            'prev_close': num(self.prev_close),
+            'ema': [num(self.ema_fast), num(self.ema_slow), num(self.ema_signal)],
+            'ema_weights': [num(w) for w in self.ema_weights],
+            'windows': {key: window.to_dict() for key, window in self.windows.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'IndicatorState':
+        """从 to_dict 的结果恢复状态"""
+        def num(value: Optional[float]) -> float:
+            return math.nan if value is None else float(value)
+        state = cls(data['params'])
+        state.last_date = pd.Timestamp(data['last_date']) if data.get('last_date') else None
+        state.bars = int(data['bars'])
+        state.prev_close = num(data['prev_close'])
+        state.ema_fast, state.ema_slow, state.ema_signal = (num(v) for v in data['ema'])
+        state.ema_weights = [num(v) for v in data.get('ema_weights', [None, None, None])]
+        state.windows = {key: RollingWindow.from_dict(window) for key, window in data['windows'].items()}
+        return state
@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from services.fetch_scheduler import fetch_scheduler
+from services.stock_data_provider import StockDataProvider
+from services.technical_indicator import TechnicalIndicator
+from services.trading_calendar import get_trading_calendar
+from services.user_service import user_service
+
+# 获取日志器
+logger = get_logger()
+
+# 按交易日历分组预取的市场：同一日历的市场在同一时间点预取
+PREFETCH_GROUPS: Dict[str, Tuple[str, ...]] = {
+    'A': ('A', 'ETF', 'LOF'),
+    'HK': ('HK',),
+    'US': ('US',),
+}
+
+class Prefetcher:
+    """
+    后台数据预取任务
+    在每个交易日收盘后（等待日线数据生成）和开盘前，为用户持仓、收藏和近期热门分析代码
+    预先获取分析所需的K线并计算技术指标，写入本地历史存储、内存缓存和指标缓存，使交互式分析直接命中缓存
+    """
+
+    def __init__(self, provider: Optional[StockDataProvider] = None,
+                 budget: Optional[int] = None,
+                 before_open: Optional[float] = None,
+                 after_close: Optional[float] = None):
+        """
+        Args:
+            provider: 数据提供者，默认新建（与交互请求共用进程内缓存和本地历史存储）
+            budget: 每个市场分组每次最多预取的代码数，默认读取环境变量 PREFETCH_BUDGET（默认200）
+            before_open: 开盘前多少秒预取，默认读取 PREFETCH_BEFORE_OPEN（默认1800秒）
+            after_close: 收盘后多少秒预取，默认读取 PREFETCH_AFTER_CLOSE（默认900秒）
+        """
+        self.enabled = os.getenv('ENABLE_PREFETCH', 'false').lower() == 'true'
+        self.provider = provider or StockDataProvider()
+        self.budget = budget or int(os.getenv('PREFETCH_BUDGET', '200'))
+        self.before_open = before_open or float(os.getenv('PREFETCH_BEFORE_OPEN', '1800'))
+        self.after_close = after_close or float(os.getenv('PREFETCH_AFTER_CLOSE', '900'))
+        # 统计最近多少天的分析历史
+        self.history_days = int(os.getenv('PREFETCH_HISTORY_DAYS', '30'))
+        # 预取默认分析周期所需的K线数，与交互式分析的缓存键一致
+        self.indicator = TechnicalIndicator()
+        self.lookback = self.indicator.required_bars()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._last_runs: Dict[str, Dict[str, Any]] = {}
+        self._next_runs: Dict[str, datetime] = {}
+        logger.debug(f"初始化Prefetcher，启用: {self.enabled}，预算: {self.budget}")
+
+    def next_run(self, calendar_market: str, now: Optional[datetime] = None) -> datetime:
+        """
+        返回下一次预取时间：最近一个交易日的 开盘前before_open秒 或 收盘后after_close秒
+
+        Args:
+            calendar_market: 交易日历对应的市场（A/HK/US）
+            now: 当前时间（带时区），默认为系统当前时间
+        """
+        calendar = get_trading_calendar(calendar_market)
+        now = now.astimezone(calendar.tz) if now is not None else calendar.now()
+        day = now.date()
+        for _ in range(31):
+            if calendar.is_trading_day(day):
+                open_dt, close_dt = calendar.session_bounds(day)
+                for run_at in (open_dt - timedelta(seconds=self.before_open),
+                               close_dt + timedelta(seconds=self.after_close)):
+                    if run_at > now:
+                        return run_at
+            day += timedelta(days=1)
+        return now + timedelta(days=1)
+
+    async def candidates(self, markets: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        """返回指定市场的预取候选代码（按优先级排列，不超过预算）"""
+        rows = await fetch_scheduler.run(user_service.get_prefetch_candidates, self.history_days)
+        return [row for row in rows if row['market_type'] in markets][:self.budget]
+
+    async def run_once(self, calendar_market: str) -> Dict[str, Any]:
+        """
+        立即为一个市场分组执行一次预取
+
+        Returns:
+            本次预取的统计信息
+        """
+        started = time.time()
+        rows = await self.candidates(PREFETCH_GROUPS[calendar_market])
+        by_market: Dict[str, List[str]] = {}
+        for row in rows:
+            by_market.setdefault(row['market_type'], []).append(row['stock_code'])
+
+        loaded = failed = 0
+        for market_type, codes in by_market.items():
+            # 批量获取使用独立调度分组，与交互请求轮询分配获取线程
+            async for code, df in self.provider.iter_multiple_stocks_data(codes, market_type, lookback=self.lookback):
+                if df.empty or hasattr(df, 'error'):
+                    failed += 1
+                    logger.debug(f"预取 {market_type}:{code} 失败: {getattr(df, 'error', '无数据')}")
+                else:
+                    loaded += 1
+                    # 预先计算默认参数的技术指标，写入指标缓存
+                    if self.indicator.cache is not None:
+                        await fetch_scheduler.run(self.indicator.calculate_indicators, df)
+
+        result = {
+            'started_at': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'symbols': len(rows),
+            'loaded': loaded,
+            'failed': failed,
+            'elapsed': round(time.time() - started, 1),
+        }
+        self._last_runs[calendar_market] = result
+        logger.info(f"{calendar_market}市场预取完成: {result}")
+        return result
+
+    async def _loop(self, calendar_market: str) -> None:
+        while True:
+            run_at = self.next_run(calendar_market)
+            self._next_runs[calendar_market] = run_at
+            delay = (run_at - datetime.now(run_at.tzinfo)).total_seconds()
+            logger.debug(f"{calendar_market}市场下一次预取时间: {run_at.isoformat()}")
+            await asyncio.sleep(max(0.0, delay))
+            try:
+                await self.run_once(calendar_market)
+            except Exception as e:
+                logger.error(f"{calendar_market}市场预取失败: {str(e)}")
+
+    def start(self) -> None:
+        """启动各市场分组的定时预取任务（应用启动时调用），未启用时不做任何事"""
+        if not self.enabled:
+            return
+        for calendar_market in PREFETCH_GROUPS:
+            task = self._tasks.get(calendar_market)
+            if task is None or task.done():
+                self._tasks[calendar_market] = asyncio.ensure_future(self._loop(calendar_market))
+
+    async def stop(self) -> None:
+        """停止定时预取任务（应用关闭时调用）"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回预取任务状态"""
+        return {
+            'enabled': self.enabled,
+            'budget': self.budget,
+            'next_runs': {market: run_at.isoformat() for market, run_at in self._next_runs.items()},
+            'last_runs': dict(self._last_runs),
+        }
+
+# 进程内共享的预取任务
+prefetcher = Prefetcher()
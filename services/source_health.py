@@ -0,0 +1,283 @@
+import os
+import time
+import asyncio
+import threading
+import numpy as np
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from services.fetch_scheduler import fetch_scheduler
+
+# 获取日志器
+logger = get_logger()
+
+class SourceUnavailableError(Exception):
+    """所有候选数据源均失败或处于熔断状态"""
+
+class SourceHealth:
+    """
+    单个数据源的健康状态：最近请求的延迟分布和熔断器
+    熔断器状态：closed（正常）→ 连续失败达到阈值后 open（拒绝请求）→
+    冷却结束后 half_open（放行一个试探请求），试探成功恢复closed，失败重新open
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float,
+                 window: int = 100):
+        """
+        Args:
+            name: 数据源名称
+            failure_threshold: 连续失败多少次后熔断
+            cooldown: 熔断持续秒数
+            window: 用于计算延迟分位数的最近请求数
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.hedged = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许向该数据源发起请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() >= self.open_until:
+                # 冷却结束，放行一个试探请求
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self, latency: float) -> None:
+        """记录一次成功请求及其耗时（秒）"""
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            if self.state != 'closed':
+                logger.info(f"数据源 {self.name} 恢复正常")
+            self.state = 'closed'
+
+    def record_failure(self) -> None:
+        """记录一次失败请求，达到阈值或试探失败时熔断"""
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"数据源 {self.name} 连续失败 {self.consecutive_failures} 次，熔断 {self.cooldown} 秒")
+                self.state = 'open'
+                self.open_until = time.monotonic() + self.cooldown
+
+    def release_trial(self) -> None:
+        """试探请求被取消（未得出结果）时恢复open状态，下次allow可重新试探"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """返回最近请求耗时的分位数（秒），没有样本时返回None"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            return float(np.percentile(self._latencies, q))
+
+    def sample_count(self) -> int:
+        """返回延迟样本数"""
+        return len(self._latencies)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回可序列化的健康状态"""
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'open_remaining': max(0.0, round(self.open_until - time.monotonic(), 1)) if self.state == 'open' else 0.0,
+                'requests': self.requests,
+                'failures': self.failures,
+                'hedged': self.hedged,
+                'latency_p50': round(p50, 3) if p50 is not None else None,
+                'latency_p95': round(p95, 3) if p95 is not None else None,
+                'samples': len(self._latencies),
+            }
+
+class SourceHealthRegistry:
+    """
+    进程级数据源健康状态表
+    提供按数据源熔断和对冲请求：主数据源发出请求后超过其p95延迟仍未返回时，
+    向下一个数据源发出对冲请求，取先成功的非空结果
+    """
+
+    def __init__(self, failure_threshold: Optional[int] = None,
+                 cooldown: Optional[float] = None,
+                 hedge_delay: Optional[float] = None,
+                 hedge_max_delay: Optional[float] = None):
+        """
+        Args:
+            failure_threshold: 熔断阈值，默认读取环境变量 SOURCE_BREAKER_FAILURES（默认5）
+            cooldown: 熔断秒数，默认读取 SOURCE_BREAKER_COOLDOWN（默认60秒）
+            hedge_delay: 延迟样本不足时的对冲等待秒数，默认读取 SOURCE_HEDGE_DELAY（默认2秒）
+            hedge_max_delay: 对冲等待的上限秒数，默认读取 SOURCE_HEDGE_MAX_DELAY（默认5秒）
+        """
+        self.failure_threshold = failure_threshold or int(os.getenv('SOURCE_BREAKER_FAILURES', '5'))
+        self.cooldown = cooldown or float(os.getenv('SOURCE_BREAKER_COOLDOWN', '60'))
+        self.hedge_delay = hedge_delay or float(os.getenv('SOURCE_HEDGE_DELAY', '2'))
+        self.hedge_max_delay = hedge_max_delay or float(os.getenv('SOURCE_HEDGE_MAX_DELAY', '5'))
+        # p95至少需要的样本数
+        self.min_samples = 20
+        self._sources: Dict[str, SourceHealth] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> SourceHealth:
+        """返回（必要时创建）数据源的健康状态"""
+        with self._lock:
+            health = self._sources.get(name)
+            if health is None:
+                health = SourceHealth(name, self.failure_threshold, self.cooldown)
+                self._sources[name] = health
+            return health
+
+    def hedge_delay_for(self, name: str) -> float:
+        """主数据源等待多久后发出对冲请求：其p95延迟，样本不足时使用默认值"""
+        health = self.get(name)
+        if health.sample_count() < self.min_samples:
+            return self.hedge_delay
+        return min(self.hedge_max_delay, health.latency_percentile(95))
+
+    async def _timed_call(self, name: str, func: Callable[[], Awaitable[Any]],
+                          started: asyncio.Event) -> Any:
+        """
+        执行调用并记录耗时和成败（被取消的调用不计入）
+
+        耗时从请求取得槽位和限速令牌、真正发出时开始计算（见 FetchScheduler.on_start），
+        排队等待不计入延迟；发出时置位started
+        """
+        health = self.get(name)
+        started_at = time.monotonic()
+
+        def mark_started() -> None:
+            nonlocal started_at
+            if not started.is_set():
+                started_at = time.monotonic()
+                started.set()
+
+        try:
+            with fetch_scheduler.on_start(mark_started):
+                result = await func()
+        except asyncio.CancelledError:
+            health.release_trial()
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        health.record_success(time.monotonic() - started_at)
+        return result
+
+    @staticmethod
+    def _is_empty(result: Any) -> bool:
+        return bool(getattr(result, 'empty', False))
+
+    async def hedged_request(self, candidates: List[Tuple[str, Callable[[], Awaitable[Any]]]],
+                             max_hedges: int = 1) -> Any:
+        """
+        按顺序尝试候选数据源
+
+        跳过熔断中的数据源；当前请求发出后超过其p95延迟仍未返回时发出对冲请求（最多max_hedges次），
+        请求失败或返回空结果时立即尝试下一个数据源，返回最先成功的非空结果并取消其余请求
+
+        Args:
+            candidates: (数据源名称, 返回协程的无参可调用对象) 列表，按优先级排列
+            max_hedges: 因超时而发出的对冲请求数上限（失败后的回退不计入）
+
+        Returns:
+            最先成功的非空结果；所有可用数据源都返回空结果时返回空结果
+
+        Raises:
+            SourceUnavailableError: 所有数据源均失败或处于熔断状态
+        """
+        queue = list(candidates)
+        running: Dict[asyncio.Future, str] = {}
+        started: Dict[asyncio.Future, asyncio.Event] = {}
+        started_at: Dict[asyncio.Future, float] = {}
+        errors: List[str] = []
+        empty_result = None
+        hedges = 0
+
+        def launch_next() -> bool:
+            while queue:
+                name, func = queue.pop(0)
+                if self.get(name).allow():
+                    event = asyncio.Event()
+                    task = asyncio.ensure_future(self._timed_call(name, func, event))
+                    running[task] = name
+                    started[task] = event
+                    return True
+                errors.append(f"{name}: 熔断中")
+            return False
+
+        launch_next()
+        watchers: List[asyncio.Future] = []
+        try:
+            while running:
+                current = list(running)[-1]
+                waits = set(running)
+                timeout = None
+                if queue and hedges < max_hedges:
+                    if started[current].is_set():
+                        # 对冲计时从当前请求真正发出时开始，排队等待槽位和令牌的时间不计入
+                        started_at.setdefault(current, time.monotonic())
+                        elapsed = time.monotonic() - started_at[current]
+                        timeout = max(0.0, self.hedge_delay_for(running[current]) - elapsed)
+                    else:
+                        watcher = asyncio.ensure_future(started[current].wait())
+                        watchers.append(watcher)
+                        waits.add(watcher)
+                done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                done = {task for task in done if task in running}
+                if not done:
+                    if timeout is None:
+                        # 当前请求已发出，重新计算对冲等待时间
+                        continue
+                    # 当前请求过慢，向下一个数据源发出对冲请求
+                    slow = running[current]
+                    if launch_next():
+                        hedges += 1
+                        self.get(slow).hedged += 1
+                        logger.info(f"数据源 {slow} 超过 {self.hedge_delay_for(slow):.2f} 秒未返回，发出对冲请求")
+                    continue
+                for task in done:
+                    name = running.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{name}: {task.exception()}")
+                    elif self._is_empty(task.result()):
+                        # 空结果可能是备用数据源的缺失，继续尝试下一个数据源
+                        if empty_result is None:
+                            empty_result = task.result()
+                        errors.append(f"{name}: 无数据")
+                    else:
+                        return task.result()
+                if not running:
+                    launch_next()
+        finally:
+            for task in list(running) + watchers:
+                task.cancel()
+        if empty_result is not None:
+            return empty_result
+        raise SourceUnavailableError("所有数据源均不可用 - " + "; ".join(errors))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有数据源的健康状态"""
+        with self._lock:
+            sources = list(self._sources.values())
+        return {health.name: health.snapshot() for health in sources}
+
+# 进程内共享的数据源健康状态表
+source_health = SourceHealthRegistry()
@@ -0,0 +1,172 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+from utils.logger import get_logger
+from utils.single_flight import SingleFlight
+from services.data_cache import data_cache
+from services.trading_calendar import get_trading_calendar
+from services.fetch_scheduler import fetch_scheduler
+
+# 获取日志器
+logger = get_logger()
+
+# 各市场的全市场实时行情接口
+SPOT_FUNCTIONS: Dict[str, str] = {
+    'A': 'stock_zh_a_spot_em',
+    'HK': 'stock_hk_spot_em',
+    'US': 'stock_us_spot_em',
+    'ETF': 'fund_etf_spot_em',
+    'LOF': 'fund_lof_spot_em',
+}
+
+# 实时行情列名到标准K线列名的映射（不同接口的列名略有差异）
+SPOT_COLUMNS_MAPPING: Dict[str, str] = {
+    '代码': 'Code',
+    '最新价': 'Close',
+    '今开': 'Open',
+    '开盘价': 'Open',
+    '最高': 'High',
+    '最高价': 'High',
+    '最低': 'Low',
+    '最低价': 'Low',
+    '成交量': 'Volume',
+    '成交额': 'Amount',
+    '振幅': 'Amplitude',
+    '涨跌幅': 'Change_pct',
+    '涨跌额': 'Change',
+    '换手率': 'Turnover',
+}
+
+class SpotSnapshotService:
+    """
+    全市场实时行情快照服务
+    每个市场每隔N秒最多请求一次全市场快照，并将快照作为盘中临时K线
+    合并到已缓存的历史数据上，批量扫描时无需逐只重新获取历史数据
+    """
+
+    def __init__(self, refresh_interval: Optional[int] = None):
+        """
+        初始化快照服务
+
+        Args:
+            refresh_interval: 快照刷新间隔（秒），默认读取环境变量 SPOT_SNAPSHOT_INTERVAL（默认30秒）
+        """
+        self.refresh_interval = refresh_interval or int(os.getenv('SPOT_SNAPSHOT_INTERVAL', '30'))
+        self._flight = SingleFlight()
+        logger.debug(f"初始化SpotSnapshotService，刷新间隔: {self.refresh_interval}秒")
+
+    async def get_snapshot(self, market_type: str) -> pd.DataFrame:
+        """
+        获取指定市场的实时行情快照
+
+        Args:
+            market_type: 市场类型
+
+        Returns:
+            以代码为索引、标准K线列名的DataFrame
+        """
+        cache_key = ('spot_snapshot', market_type)
+        snapshot = data_cache.get(cache_key)
+        if snapshot is not None:
+            return snapshot
+
+        async def fetch():
+            df = await fetch_scheduler.run(self._fetch_snapshot_sync, market_type, source='spot')
+            data_cache.set(cache_key, df, ttl=self.refresh_interval)
+            return df
+
+        return await self._flight.do(cache_key, fetch)
+
+    def _fetch_snapshot_sync(self, market_type: str) -> pd.DataFrame:
+        """
+        同步获取并标准化全市场快照（将被异步方法调用）
+        """
+        import akshare as ak
+
+        func_name = SPOT_FUNCTIONS.get(market_type)
+        if func_name is None:
+            raise ValueError(f"不支持的市场类型: {market_type}")
+
+        logger.info(f"获取{market_type}全市场实时行情快照: ak.{func_name}()")
+        raw = getattr(ak, func_name)()
+        df = raw.rename(columns=SPOT_COLUMNS_MAPPING)
+        df = df.loc[:, ~df.columns.duplicated()]
+
+        # 美股快照代码形如'105.AAPL'，历史数据接口使用'AAPL'
+        codes = df['Code'].astype(str)
+        if market_type == 'US':
+            codes = codes.str.split('.').str[-1]
+        df.index = codes.values
+        df = df[[col for col in dict.fromkeys(SPOT_COLUMNS_MAPPING.values()) if col in df.columns and col != 'Code']]
+        df = df.apply(pd.to_numeric, errors='coerce')
+        logger.info(f"{market_type}实时行情快照获取完成，共 {len(df)} 条")
+        return df
+
+    async def merge_provisional_bar(self, df: pd.DataFrame, stock_code: str,
+                                    market_type: str) -> pd.DataFrame:
+        """
+        将实时快照作为当日临时K线合并到历史数据末尾
+
+        当日K线尚不存在时追加一行，已存在时（盘中获取的未收盘K线）用快照覆盖。
+        非交易日（按交易日历）、开盘前、快照中没有该代码或最新价无效时原样返回。
+
+        Args:
+            df: 以日期为索引的历史K线数据
+            stock_code: 股票代码
+            market_type: 市场类型
+
+        Returns:
+            合并后的DataFrame，合并成功时 df.attrs['provisional_bar'] 为True
+        """
+        if df.empty or market_type not in SPOT_FUNCTIONS:
+            return df
+
+        calendar = get_trading_calendar(market_type)
+        now = calendar.now()
+        if not calendar.is_trading_day(now.date()) or now < calendar.session_bounds(now.date())[0]:
+            return df
+
+        today = pd.Timestamp(now.date())
+        last_dt = df.index[-1]
+        if last_dt > today:
+            return df
+
+        try:
+            snapshot = await self.get_snapshot(market_type)
+        except Exception as e:
+            logger.warning(f"获取{market_type}实时快照失败，跳过临时K线合并: {str(e)}")
+            return df
+
+        if stock_code not in snapshot.index:
+            return df
+        quote = snapshot.loc[stock_code]
+        if isinstance(quote, pd.DataFrame):
+            quote = quote.iloc[0]
+        if not np.isfinite(quote.get('Close', np.nan)) or quote['Close'] <= 0:
+            # 停牌或尚未成交
+            return df
+
+        row = {}
+        for col in df.columns:
+            if col == 'Code':
+                row[col] = stock_code
+            else:
+                row[col] = quote.get(col, np.nan)
+        provisional = pd.DataFrame([row], index=pd.DatetimeIndex([today], name=df.index.name))
+
+        original_dtypes = df.dtypes
+        if last_dt == today:
+            df = pd.concat([df.iloc[:-1], provisional])
+        else:
+            df = pd.concat([df, provisional])
+        # 保持整数列（如成交量）的原始类型
+        for col, dtype in original_dtypes.items():
+            if pd.api.types.is_integer_dtype(dtype) and not df[col].isna().any():
+                df[col] = df[col].astype(dtype)
+        df.attrs['provisional_bar'] = True
+        logger.debug(f"已合并{market_type}临时K线 {stock_code}: 收盘价 {quote['Close']}")
+        return df
+
+# 进程内共享的快照服务实例
+spot_snapshot_service = SpotSnapshotService()
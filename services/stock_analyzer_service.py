@@ -1,6 +1,8 @@
+import os
 import json
+import asyncio
 from datetime import datetime
-from typing import List, AsyncGenerator, Optional
+from typing import Any, List, AsyncGenerator, AsyncIterator, Optional
 from utils.logger import get_logger
 from services.stock_data_provider import StockDataProvider
 from services.technical_indicator import TechnicalIndicator
@@ -16,6 +18,11 @@ class StockAnalyzerService:
     作为门面类协调数据提供、指标计算、评分和AI分析等组件
     """
     
+    # 批量扫描评分阶段需要的列：指标输入列和推送的涨跌幅
+    SCAN_COLUMNS = TechnicalIndicator.REQUIRED_COLUMNS + ('Change_pct',)
+    # 批量扫描评分阶段只计算评分和推送字段使用的指标
+    SCAN_INDICATORS = StockScorer.REQUIRED_INDICATORS
+    
     def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None):
         """
         初始化股票分析服务
@@ -30,6 +37,12 @@ class StockAnalyzerService:
         self.data_provider = StockDataProvider()
         self.indicator = TechnicalIndicator()
         self.scorer = StockScorer()
+        # 批量扫描是否使用紧凑数据类型（float32价格、整数成交量）
+        self.compact_scan = os.getenv('ENABLE_COMPACT_SCAN', 'true').lower() == 'true'
+        # 批量扫描时每攒够多少只股票在 日期×代码 面板上一次计算指标（1为逐只计算）
+        self.scan_batch_size = max(1, int(os.getenv('SCAN_INDICATOR_BATCH_SIZE', '100')))
+        # 批次未攒满时，超过该秒数没有新数据到达就立即计算并推送已到达的股票
+        self.scan_flush_delay = float(os.getenv('SCAN_INDICATOR_FLUSH_DELAY', '0.1'))
         self.ai_analyzer = AIAnalyzer(
             custom_api_url=custom_api_url,
             custom_api_key=custom_api_key,
@@ -59,7 +72,10 @@ class StockAnalyzerService:
             
             # 获取股票数据
             logger.debug(f"准备从 data_provider 获取股票代码为 '{stock_code}' 的数据...")
-            df = await self.data_provider.get_stock_data(stock_code, market_type)
+            # 只获取指标预热和分析周期所需的K线
+            df = await self.data_provider.get_stock_data(
+                stock_code, market_type, lookback=self.indicator.required_bars(analysis_days)
+            )
             logger.debug(f"从 data_provider 获取数据完成。DataFrame is empty: {df.empty}")
             
             # 检查是否有错误
@@ -178,6 +194,115 @@ class StockAnalyzerService:
             logger.exception(e)
             yield json.dumps({"error": error_msg, "stock_code": stock_code}, ensure_ascii=False)
     
+    def _calculate_scan_indicators(self, frames: dict) -> dict:
+        """
+        计算一批扫描股票的技术指标
+        
+        Returns:
+            代码 -> 添加了技术指标的DataFrame，计算出错时为异常对象
+        """
+        if len(frames) > 1:
+            try:
+                return self.indicator.calculate_indicators_batch(frames, self.SCAN_INDICATORS)
+            except Exception as e:
+                # 面板计算出错时逐只计算，定位出错的股票
+                logger.warning(f"面板计算 {len(frames)} 只股票的技术指标出错，改为逐只计算: {str(e)}")
+        
+        result = {}
+        for code, df in frames.items():
+            try:
+                result[code] = self.indicator.calculate_indicators(df, self.SCAN_INDICATORS)
+            except Exception as e:
+                result[code] = e
+        return result
+    
+    @staticmethod
+    async def _batched(items: AsyncIterator[Any], max_size: int, max_delay: float) -> AsyncIterator[List[Any]]:
+        """
+        把异步迭代器的结果按批返回：攒够max_size个，或max_delay秒内没有新结果到达时，
+        立即返回已到达的部分，数据陆续到达时不会等到整批获取完成才推送
+        """
+        iterator = items.__aiter__()
+        next_item = asyncio.ensure_future(iterator.__anext__())
+        batch: List[Any] = []
+        try:
+            while True:
+                if batch:
+                    done, _ = await asyncio.wait({next_item}, timeout=max_delay)
+                    if not done:
+                        yield batch
+                        batch = []
+                        continue
+                try:
+                    item = await next_item
+                except StopAsyncIteration:
+                    break
+                next_item = asyncio.ensure_future(iterator.__anext__())
+                batch.append(item)
+                if len(batch) >= max_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            next_item.cancel()
+            if hasattr(iterator, 'aclose'):
+                await asyncio.gather(next_item, return_exceptions=True)
+                await iterator.aclose()
+    
+    def _score_scan_batch(self, frames: dict, min_score: int, results: list):
+        """
+        计算一批股票的指标和评分，生成推送消息，评分结果追加到results
+        """
+        for code, df in self._calculate_scan_indicators(frames).items():
+            if isinstance(df, Exception):
+                logger.error(f"计算 {code} 技术指标时出错: {str(df)}")
+                # 发送错误状态
+                yield json.dumps({
+                    "stock_code": code,
+                    "error": f"计算技术指标时出错: {str(df)}",
+                    "status": "error"
+                }, ensure_ascii=False)
+                continue
+            
+            # 评分股票
+            try:
+                score = self.scorer.calculate_score(df)
+                rec = self.scorer.get_recommendation(score)
+            except Exception as e:
+                logger.error(f"评分股票 {code} 时出错: {str(e)}")
+                continue
+            results.append((code, score, rec))
+            
+            if len(df) > 0:
+                # 获取最新数据
+                latest_data = df.iloc[-1]
+                previous_data = df.iloc[-2] if len(df) > 1 else latest_data
+                
+                # 价格变动绝对值
+                price_change_value = latest_data['Close'] - previous_data['Close']
+                
+                # 获取涨跌幅（紧凑数据为float32，保留4位小数避免输出二进制误差）
+                change_percent = latest_data.get('Change_pct')
+                if change_percent is not None:
+                    change_percent = round(float(change_percent), 4)
+                
+                # 发送股票基本信息和评分
+                yield json.dumps({
+                    "stock_code": code,
+                    "score": score,
+                    "recommendation": rec,
+                    "price": round(float(latest_data.get('Close', 0)), 4),
+                    "price_change_value": round(float(price_change_value), 4),  # 价格变动绝对值
+                    "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
+                    "change_percent": change_percent,  # 涨跌幅百分比，新字段
+                    "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
+                    "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
+                    "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
+                    "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
+                    "status": "completed" if score < min_score else "waiting"
+                }, ensure_ascii=False)
+    
     async def scan_stocks(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0, stream: bool = False, analysis_days: int = 30) -> AsyncGenerator[str, None]:
         """
         批量扫描股票
@@ -203,69 +328,44 @@ class StockAnalyzerService:
                 "min_score": min_score
             }, ensure_ascii=False)
             
-            # 批量获取股票数据
-            logger.debug(f"准备从 data_provider 批量获取 {len(stock_codes)} 个股票代码的数据...")
-            stock_data_dict = await self.data_provider.get_multiple_stocks_data(stock_codes, market_type)
-            logger.debug(f"批量获取数据完成。获取到 {len(stock_data_dict)} 个股票的数据。")
-            
-            # 计算技术指标
-            stock_with_indicators = {}
-            for code, df in stock_data_dict.items():
-                try:
-                    stock_with_indicators[code] = self.indicator.calculate_indicators(df)
-                except Exception as e:
-                    logger.error(f"计算 {code} 技术指标时出错: {str(e)}")
-                    # 发送错误状态
-                    yield json.dumps({
-                        "stock_code": code,
-                        "error": f"计算技术指标时出错: {str(e)}",
-                        "status": "error"
-                    }, ensure_ascii=False)
-            
-            # 评分股票
-            results = self.scorer.batch_score_stocks(stock_with_indicators)
+            # 流水线处理：已到达的数据按批在面板上计算指标、评分并推送，批次攒满或短暂没有新数据时即推送，
+            # 无需等待整批获取完成；评分阶段只使用指标和推送字段需要的列，并使用紧凑数据类型，降低全市场扫描的内存占用
+            results = []
+            lookback = self.indicator.required_bars(analysis_days)
+            fetched = self.data_provider.iter_multiple_stocks_data(
+                stock_codes, market_type, lookback=lookback,
+                columns=self.SCAN_COLUMNS, compact=self.compact_scan)
+            async for batch in self._batched(fetched, self.scan_batch_size, self.scan_flush_delay):
+                pending = {}
+                for code, df in batch:
+                    if hasattr(df, 'error') or df.empty:
+                        error = getattr(df, 'error', None) or "未获取到数据"
+                        logger.error(f"获取 {code} 数据失败: {error}")
+                        yield json.dumps({
+                            "stock_code": code,
+                            "error": error,
+                            "status": "error"
+                        }, ensure_ascii=False)
+                        continue
+                    pending[code] = df
+                
+                for message in self._score_scan_batch(pending, min_score, results):
+                    yield message
             
-            # 过滤低于最低评分的股票
+            # 按评分降序排序，过滤低于最低评分的股票
+            results.sort(key=lambda x: x[1], reverse=True)
             filtered_results = [r for r in results if r[1] >= min_score]
             
-            # 为每只股票发送基本评分和推荐信息
-            for code, score, rec in results:
-                df = stock_with_indicators.get(code)
-                if df is not None and len(df) > 0:
-                    # 获取最新数据
-                    latest_data = df.iloc[-1]
-                    previous_data = df.iloc[-2] if len(df) > 1 else latest_data
-                    
-                    # 价格变动绝对值
-                    price_change_value = latest_data['Close'] - previous_data['Close']
-                    
-                    # 获取涨跌幅
-                    change_percent = latest_data.get('Change_pct')
-                    
-                    # 发送股票基本信息和评分
-                    yield json.dumps({
-                        "stock_code": code,
-                        "score": score,
-                        "recommendation": rec,
-                        "price": float(latest_data.get('Close', 0)),
-                        "price_change_value": float(price_change_value),  # 价格变动绝对值
-                        "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
-                        "change_percent": change_percent,  # 涨跌幅百分比，新字段
-                        "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
-                        "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
-                        "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
-                        "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
-                        "status": "completed" if score < min_score else "waiting"
-                    }, ensure_ascii=False)
-            
             # 如果需要进一步分析，对评分较高的股票进行AI分析
             if stream and filtered_results:
                 # 只分析前5只评分最高的股票，避免分析过多导致前端卡顿
                 top_stocks = filtered_results[:5]
                 
                 for stock_code, score, _ in top_stocks:
-                    df = stock_with_indicators.get(stock_code)
-                    if df is not None:
+                    # AI分析需要完整列和精度，重新读取（命中内存缓存）并计算指标
+                    df = await self.data_provider.get_stock_data(stock_code, market_type, lookback=lookback)
+                    if not hasattr(df, 'error') and not df.empty:
+                        df = self.indicator.calculate_indicators(df)
                         # 输出正在分析的股票信息
                         yield json.dumps({
                             "stock_code": stock_code,
@@ -1,290 +1,655 @@
+import os
+import time
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import asyncio
-from typing import Dict, List, Optional, Tuple, Any
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Sequence, Tuple
 from utils.logger import get_logger
+from services.stock_history_store import (
+    StockHistoryStore, ESTIMATED_COLUMNS_ATTR, FACTOR_COLUMN, apply_adjustment, derive_factors
+)
+from services.data_cache import data_cache, negative_cache
+from services.symbol_master import symbol_master
+from services.trading_calendar import get_trading_calendar
+from services.technical_indicator import TechnicalIndicator
+from services.spot_snapshot import spot_snapshot_service
+from services.fetch_scheduler import SharedGroup, fetch_scheduler
+from services.data_sources import DataSource, SUPPORTED_MARKETS, compact_bars, get_data_source, slice_date_range
+from utils.single_flight import SingleFlight
 
 # 获取日志器
 logger = get_logger()
 
+# 进程内共享的请求合并器，所有StockDataProvider实例共用
+_stock_data_flight = SingleFlight()
+
+# 进行中的共享获取：(事件循环, 缓存键) -> (调度分组, 上游请求发出事件)
+_shared_fetches: Dict[Tuple[int, Tuple], Tuple[SharedGroup, asyncio.Event]] = {}
+
 class StockDataProvider:
     """
     异步股票数据提供服务
     负责获取股票、基金等金融产品的历史数据
     """
     
-    def __init__(self):
-        """初始化数据提供者服务"""
+    # 按K线数计算开始日期时的余量倍数，应对停牌等缺失的交易日
+    LOOKBACK_MARGIN = 1.1
+    
+    # 本地存储不复权K线和复权因子、读取时再复权的市场（其余市场存储数据源返回的复权数据）
+    FACTOR_MARKETS = ('A',)
+    
+    # 判断 收盘价 - 涨跌额 是否等于前一日收盘价的容差（A股最小价格单位0.01的一半）
+    PREV_CLOSE_TOLERANCE = 0.005
+    
+    def __init__(self, history_store: Optional[StockHistoryStore] = None):
+        """
+        初始化数据提供者服务
+        
+        Args:
+            history_store: 本地K线历史存储，默认根据环境变量 ENABLE_STOCK_HISTORY_STORE 创建
+        """
         logger.debug("初始化StockDataProvider")
+        
+        if history_store is None and os.getenv('ENABLE_STOCK_HISTORY_STORE', 'true').lower() == 'true':
+            history_store = StockHistoryStore()
+        self.history_store = history_store
+        # 本地存储在该时间（秒）内更新过则直接读取，不再请求增量数据
+        self.history_refresh_interval = int(os.getenv('STOCK_HISTORY_REFRESH_INTERVAL', '600'))
+        # 复权方式，参与缓存键
+        self.adjust = 'qfq'
+        # 本地存储是否保存不复权K线和复权因子：除权除息时只追加因子，不需要重新获取全部历史
+        self.adjust_factor_store = os.getenv('ENABLE_ADJUST_FACTOR_STORE', 'true').lower() == 'true'
+        # 未指定开始日期和lookback时获取的K线数：默认指标参数的预热期 + 30天分析周期
+        self.default_lookback = TechnicalIndicator().required_bars()
+        # 批量获取时单只股票的默认超时秒数，同时是每次上游网络请求的超时秒数
+        self.fetch_timeout = float(os.getenv('STOCK_FETCH_TIMEOUT', '30'))
+        # 数据源支持时使用原生异步获取（不占用获取线程）
+        self.native_async_fetch = os.getenv('ENABLE_NATIVE_ASYNC_FETCH', 'true').lower() == 'true'
+        # 请求上游前是否用代码主表校验代码
+        self.validate_symbols = os.getenv('ENABLE_SYMBOL_VALIDATION', 'true').lower() == 'true'
+        # 盘中是否使用全市场快照合并当日临时K线
+        self.intraday = os.getenv('ENABLE_INTRADAY_SPOT', 'false').lower() == 'true'
+        # 按市场分派的数据源，可通过register_data_source替换
+        self.data_sources: Dict[str, DataSource] = {}
+    
+    def register_data_source(self, market_type: str, source: DataSource) -> None:
+        """
+        为指定市场注册数据源，替换环境变量配置的默认数据源
+        
+        Args:
+            market_type: 市场类型
+            source: 实现DataSource接口的数据源
+        """
+        self.data_sources[market_type] = source
+    
+    def get_data_source(self, market_type: str, adjust: Optional[str] = None) -> DataSource:
+        """
+        返回指定市场使用的数据源
+        
+        Args:
+            adjust: 指定时返回按该复权方式获取的配置数据源（用于获取不复权K线和复权因子）
+        """
+        source = self.data_sources.get(market_type)
+        if source is None or adjust is not None:
+            source = get_data_source(market_type, self.adjust if adjust is None else adjust)
+        return source
+    
+    def _uses_factors(self, market_type: str) -> bool:
+        """该市场的本地存储是否保存不复权K线和复权因子"""
+        return self.adjust_factor_store and self.adjust in ('qfq', 'hfq') and \
+            market_type in self.FACTOR_MARKETS and market_type not in self.data_sources and \
+            self.get_data_source(market_type).name == 'akshare'
     
     async def get_stock_data(self, stock_code: str, market_type: str = 'A', 
                             start_date: Optional[str] = None, 
-                            end_date: Optional[str] = None) -> pd.DataFrame:
+                            end_date: Optional[str] = None,
+                            intraday: Optional[bool] = None,
+                            fetch_group: Optional[Hashable] = None,
+                            timeout: Optional[float] = None,
+                            lookback: Optional[int] = None,
+                            columns: Optional[Sequence[str]] = None,
+                            compact: bool = False) -> pd.DataFrame:
         """
         异步获取股票或基金数据
         
         Args:
             stock_code: 股票代码
             market_type: 市场类型，默认为'A'股
-            start_date: 开始日期，格式YYYYMMDD，默认为一年前
-            end_date: 结束日期，格式YYYYMMDD，默认为今天
+            start_date: 开始日期，格式YYYYMMDD，默认按lookback计算
+            end_date: 结束日期，格式YYYYMMDD，默认为最近交易日
+            intraday: 是否用全市场快照合并当日临时K线，默认读取环境变量 ENABLE_INTRADAY_SPOT
+            fetch_group: 调度分组，同一批量请求内的获取任务共用一个分组，与其他请求公平分配线程
+            timeout: 等待获取结果的超时秒数，从上游请求发出时开始计算（不含排队等待槽位和限速的时间），
+                     超时抛出asyncio.TimeoutError；合并的相同请求各自按自己的timeout等待
+            lookback: 未指定start_date时获取的K线数（通常为 TechnicalIndicator.required_bars），
+                      默认为 default_lookback；更长的区间需显式指定start_date
+            columns: 只返回下游声明需要的列（如 TechnicalIndicator.REQUIRED_COLUMNS）
+            compact: 是否返回紧凑数据类型（float32价格、整数成交量），见 compact_bars
             
         Returns:
             包含历史数据的DataFrame
         """
-        # 使用线程池执行同步的akshare调用
-        return await asyncio.to_thread(
-            self._get_stock_data_sync, 
-            stock_code, 
-            market_type, 
-            start_date, 
-            end_date
-        )
+        start_date, end_date = self._resolve_date_range(start_date, end_date, market_type, lookback)
+        cache_key = (market_type, stock_code, start_date, end_date, self.adjust)
+        
+        cached = data_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"命中内存缓存: {market_type}:{stock_code}")
+            df = self._copy_result(cached)
+        elif (rejected := self._reject_reason(cache_key, stock_code, market_type)) is not None:
+            # 无效代码或该区间处于无数据退避期，不请求上游
+            df = pd.DataFrame()
+            df.error = rejected
+            return df
+        else:
+            # 相同(代码, 市场, 区间)的并发请求共享同一次获取，每个调用者拿到独立副本
+            df = await self._join_fetch(cache_key, stock_code, market_type, start_date, end_date,
+                                        fetch_group, timeout)
+            df = self._copy_result(df)
+        
+        if intraday is None:
+            intraday = self.intraday
+        if intraday and not hasattr(df, 'error') and self._range_includes_today(market_type, end_date):
+            df = await spot_snapshot_service.merge_provisional_bar(df, stock_code, market_type)
+        if (columns is not None or compact) and not hasattr(df, 'error'):
+            # 缓存中保存完整数据，按调用方需要返回裁剪/压缩后的副本
+            attrs = df.attrs
+            df = compact_bars(df, columns, downcast=compact)
+            df.attrs = attrs
+        return df
+    
+    @staticmethod
+    def _range_includes_today(market_type: str, end_date: str) -> bool:
+        """判断请求区间是否包含市场当地的今天"""
+        return end_date >= get_trading_calendar(market_type).now().strftime('%Y%m%d')
+    
+    async def _join_fetch(self, cache_key: Tuple, stock_code: str, market_type: str,
+                          start_date: str, end_date: str,
+                          fetch_group: Optional[Hashable] = None,
+                          timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        发起或加入相同(代码, 市场, 区间)的共享获取
+        
+        共享的获取不使用任何调用者的超时（网络请求按 fetch_timeout 超时），并同时在所有调用者的
+        调度分组中排队；每个调用者从上游请求真正发出起按自己的timeout等待，超时只影响该调用者
+        """
+        flight_key = (id(asyncio.get_running_loop()), cache_key)
+        shared = _shared_fetches.get(flight_key)
+        if shared is None:
+            shared = _shared_fetches[flight_key] = (fetch_scheduler.shared_group(fetch_group), asyncio.Event())
+        else:
+            shared[0].add(fetch_group)
+        group, started = shared
+        
+        async def fetch() -> pd.DataFrame:
+            try:
+                with fetch_scheduler.on_start(started.set):
+                    return await self._fetch_and_cache(cache_key, stock_code, market_type, start_date, end_date, group)
+            finally:
+                if _shared_fetches.get(flight_key) is shared:
+                    del _shared_fetches[flight_key]
+                started.set()
+        
+        waiter = asyncio.ensure_future(_stock_data_flight.do(cache_key, fetch))
+        try:
+            if timeout is not None:
+                # 排队等待槽位和限速令牌的时间不计入超时
+                watcher = asyncio.ensure_future(started.wait())
+                try:
+                    await asyncio.wait({waiter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    watcher.cancel()
+            # 超时只取消该调用者的等待，共享的获取继续进行
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            waiter.cancel()
     
-    def _get_stock_data_sync(self, stock_code: str, market_type: str = 'A', 
-                           start_date: Optional[str] = None, 
-                           end_date: Optional[str] = None) -> pd.DataFrame:
+    async def _fetch_and_cache(self, cache_key: Tuple, stock_code: str, market_type: str,
+                               start_date: str, end_date: str,
+                               fetch_group: Optional[Hashable] = None) -> pd.DataFrame:
         """
-        同步获取股票数据的实现
-        将被异步方法调用
+        获取数据，成功的非空结果写入内存缓存
+        数据源支持原生异步获取时在事件循环中获取，否则在专用获取线程池中执行；
+        网络请求按 fetch_timeout 超时
+        """
+        calendar = get_trading_calendar(market_type)
+        if calendar.needs_load():
+            # 交易所日历每天加载一次，加载失败时按工作日规则判断
+            await fetch_scheduler.run(calendar.load, group=fetch_group)
+        source = self.get_data_source(market_type) if market_type in SUPPORTED_MARKETS else None
+        if self.native_async_fetch and source is not None and \
+                getattr(source, 'supports_async', None) and source.supports_async(market_type):
+            # 超时只作用于网络请求，排队等待槽位和限速令牌的时间不计入
+            df = await self._load_stock_data_async(source, stock_code, market_type, start_date, end_date,
+                                                   fetch_group, self.fetch_timeout)
+        else:
+            df = await fetch_scheduler.run(
+                self._load_stock_data_sync, 
+                stock_code, 
+                market_type, 
+                start_date, 
+                end_date,
+                group=fetch_group,
+                timeout=self.fetch_timeout
+            )
+        if hasattr(df, 'error'):
+            # 获取错误可能是暂时的（超时、所有数据源均失败），不进入负缓存
+            return df
+        if not df.empty:
+            data_cache.set(cache_key, df, market_type=market_type)
+            negative_cache.clear(cache_key)
+        else:
+            # 数据源确认该区间没有数据（无效代码、节假日区间、新股上市前），只对该区间退避
+            delay = negative_cache.record_failure(cache_key, f"未获取到{market_type}数据 {stock_code}")
+            logger.debug(f"{market_type}:{stock_code} {start_date}-{end_date} 无数据，{delay:.0f}秒内不再请求")
+        return df
+    
+    def _reject_reason(self, cache_key: Tuple, stock_code: str, market_type: str) -> Optional[str]:
         """
-        import akshare as ak
+        请求上游之前的快速检查：该请求区间的无数据退避期和代码主表校验
         
-        if start_date is None:
-            start_date = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
-        if end_date is None:
-            end_date = datetime.now().strftime('%Y%m%d')
-            
+        Returns:
+            应直接返回失败时的错误信息，否则返回None
+        """
+        reason = negative_cache.check(cache_key)
+        if reason is not None:
+            return f"{reason}（无数据退避中，暂不重试）"
+        
+        if not self._should_validate(market_type):
+            return None
+        known = symbol_master.is_known(market_type, stock_code)
+        if known is None:
+            # 代码表尚未加载，本次不校验，后台加载供之后的请求使用
+            symbol_master.load_in_background(market_type)
+            return None
+        if not known:
+            return f"无效的{market_type}代码: {stock_code}"
+        return None
+    
+    def _should_validate(self, market_type: str) -> bool:
+        """是否用代码主表校验该市场的代码（回放本地数据时不依赖在线代码表）"""
+        return self.validate_symbols and market_type in SUPPORTED_MARKETS and \
+            self.get_data_source(market_type).name != 'local'
+    
+    @staticmethod
+    def _copy_result(df: pd.DataFrame) -> pd.DataFrame:
+        """复制共享的结果，保留error属性"""
+        result = df.copy()
+        if hasattr(df, 'error'):
+            result.error = df.error
+        return result
+    
+    def _resolve_date_range(self, start_date: Optional[str] = None, 
+                            end_date: Optional[str] = None,
+                            market_type: str = 'A',
+                            lookback: Optional[int] = None) -> Tuple[str, str]:
+        """
+        补全默认日期并统一为YYYYMMDD格式
+        
+        默认结束日期为市场最近一个已开盘的交易日，周末和节假日的请求与上一交易日共用缓存；
+        默认开始日期为结束日期往前第 lookback 个交易日（另留出停牌余量）
+        
+        Returns:
+            (开始日期, 结束日期)的元组
+        """
         # 确保日期格式统一（移除可能的'-'符号）
         if isinstance(start_date, str) and '-' in start_date:
             start_date = start_date.replace('-', '')
         if isinstance(end_date, str) and '-' in end_date:
             end_date = end_date.replace('-', '')
+        
+        calendar = get_trading_calendar(market_type)
+        if end_date is None:
+            end_date = calendar.latest_session_date().strftime('%Y%m%d')
+        if start_date is None:
+            bars = int((lookback or self.default_lookback) * self.LOOKBACK_MARGIN)
+            end_day = datetime.strptime(end_date, '%Y%m%d').date()
+            start_date = calendar.trading_days_back(end_day, bars).strftime('%Y%m%d')
+        
+        return start_date, end_date
+    
+    def _load_stock_data_sync(self, stock_code: str, market_type: str = 'A', 
+                              start_date: Optional[str] = None, 
+                              end_date: Optional[str] = None) -> pd.DataFrame:
+        """
+        优先从本地历史存储读取数据，只在需要时增量获取最后存储日期之后的K线
+        """
+        start_date, end_date = self._resolve_date_range(start_date, end_date, market_type)
+        if self.history_store is None:
+            return self._get_stock_data_sync(stock_code, market_type, start_date, end_date)
+        
+        start_dt = pd.to_datetime(start_date, format='%Y%m%d')
+        end_dt = pd.to_datetime(end_date, format='%Y%m%d')
+        
+        stored = self.history_store.load(market_type, stock_code)
+        action = self._plan_store_update(stored, market_type, start_dt, end_dt)
+        uses_factors = self._uses_factors(market_type)
+        if action == 'full':
+            fetch_end = self._full_fetch_end(stored, market_type, end_date)
+            fetch_end_dt = pd.to_datetime(fetch_end, format='%Y%m%d')
+        if action == 'full' and not uses_factors:
+            # 本地没有覆盖请求区间，完整获取后写入存储
+            df = self._get_stock_data_sync(stock_code, market_type, start_date, fetch_end)
+            if not hasattr(df, 'error') and not df.empty:
+                full_df = self._get_full_history_sync(stock_code, market_type)
+                if full_df is not None and not full_df.empty:
+                    # 数据源本身返回全量历史时整体替换存储，之后任意区间都可直接读取
+                    self.history_store.save(market_type, stock_code, full_df, pd.Timestamp.min)
+                else:
+                    self._store_full(stored, stock_code, market_type, df, start_dt, fetch_end_dt)
+                if fetch_end != end_date:
+                    df = slice_date_range(df, start_date, end_date)
+            return df
+        
+        if action == 'full':
+            # 获取不复权K线和复权因子写入存储，再按复权方式读取
+            bars = self._get_factor_bars_sync(stock_code, market_type, start_date, fetch_end)
+            if hasattr(bars, 'error') or bars.empty:
+                return bars
+            stored = self._store_full(stored, stock_code, market_type, bars, start_dt, fetch_end_dt)
+        elif action == 'delta' and not uses_factors and \
+                (full_df := self._get_full_history_sync(stock_code, market_type)) is not None and not full_df.empty:
+            # 港股/美股数据源每次返回按最新基准前复权的全量历史：整体替换存储，
+            # 除权除息后旧K线不会保留旧的复权基准而与新K线混在一起
+            logger.debug(f"使用全量历史替换{market_type}数据 {stock_code}")
+            self.history_store.save(market_type, stock_code, full_df, pd.Timestamp.min)
+            stored = full_df
+        elif action == 'delta':
+            # 从最后存储日期（含）开始增量获取，以覆盖盘中未收盘的K线
+            delta_start = stored.index[-1].strftime('%Y%m%d')
+            if uses_factors:
+                delta = self._get_factor_bars_sync(stock_code, market_type, delta_start, end_date, stored)
+            else:
+                delta = self._get_stock_data_sync(stock_code, market_type, delta_start, end_date)
+            stored = self._merge_delta(stored, delta, stock_code, market_type)
+        else:
+            logger.debug(f"使用本地存储的{market_type}数据 {stock_code}")
+        
+        return self._read_stored(stored, start_date, end_date)
+    
+    def _plan_store_update(self, stored: Optional[pd.DataFrame], market_type: str,
+                           start_dt: pd.Timestamp, end_dt: pd.Timestamp) -> Optional[str]:
+        """
+        根据本地存储的覆盖范围和交易日历决定获取方式
+        
+        Returns:
+            'full'：本地未覆盖请求区间，需要完整获取；
+            'delta'：需要从最后存储日期增量获取；
+            None：直接使用本地存储
+        """
+        if stored is None or stored.empty or not self._store_compatible(stored, market_type):
+            # 存储格式（是否含复权因子）与当前配置不一致，如升级前保存的前复权K线，重新获取后整体替换
+            return 'full'
+        if stored.attrs['store_meta']['coverage_start'] > start_dt:
+            # 请求区间早于覆盖起点，获取到覆盖起点为止（见 _full_fetch_end）
+            return 'full'
+        last_dt = stored.index[-1]
+        updated_at = stored.attrs['store_meta']['updated_at']
+        if end_dt < last_dt or time.time() - updated_at < self.history_refresh_interval:
+            return None
+        if not get_trading_calendar(market_type).has_new_data(last_dt, updated_at):
+            # 最后一根K线已是最近交易日且在收盘后更新过：周末、节假日和盘后不再请求
+            return None
+        return 'delta'
+    
+    def _store_compatible(self, stored: pd.DataFrame, market_type: str) -> bool:
+        """本地存储格式（是否含复权因子）是否与当前配置一致"""
+        return (FACTOR_COLUMN in stored.columns) == self._uses_factors(market_type)
+    
+    def _full_fetch_end(self, stored: Optional[pd.DataFrame], market_type: str, end_date: str) -> str:
+        """
+        完整获取的结束日期：请求区间在本地覆盖起点之前时延长到覆盖起点，
+        同时补齐中间缺失的K线，使本地存储始终是一段连续的已覆盖区间
+        """
+        if stored is None or stored.empty or not self._store_compatible(stored, market_type):
+            return end_date
+        coverage_start = stored.attrs['store_meta']['coverage_start'].strftime('%Y%m%d')
+        return max(end_date, coverage_start)
+    
+    def _store_full(self, stored: Optional[pd.DataFrame], stock_code: str, market_type: str,
+                    df: pd.DataFrame, coverage_start: pd.Timestamp,
+                    coverage_end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """
+        将完整获取的K线写入本地存储，存储格式与当前配置不一致时整体替换而不是合并
+        
+        Args:
+            coverage_start: 本次获取的开始日期
+            coverage_end: 本次获取的结束日期
+        
+        Returns:
+            写入后的完整存储数据
+        """
+        if stored is not None and not stored.empty and \
+                (FACTOR_COLUMN in stored.columns) != (FACTOR_COLUMN in df.columns):
+            self.history_store.save(market_type, stock_code, df, coverage_start)
+            return df
+        return self.history_store.append(market_type, stock_code, df,
+                                         coverage_start=coverage_start, coverage_end=coverage_end)
+    
+    def _read_stored(self, stored: pd.DataFrame, start_date: str, end_date: str) -> pd.DataFrame:
+        """截取本地存储数据的请求区间，含复权因子时按复权方式换算价格（以最新K线为前复权基准）"""
+        df = slice_date_range(stored, start_date, end_date)
+        df.attrs = {}
+        if FACTOR_COLUMN in df.columns:
+            df = apply_adjustment(df, self.adjust, anchor=float(stored[FACTOR_COLUMN].iloc[-1]))
+        return df
+    
+    def _merge_delta(self, stored: pd.DataFrame, delta: pd.DataFrame,
+                     stock_code: str, market_type: str) -> pd.DataFrame:
+        """将增量数据合并写入本地存储，增量获取失败时继续使用已存储的数据"""
+        if hasattr(delta, 'error'):
+            logger.warning(f"增量获取{market_type}数据失败 {stock_code}，使用本地存储数据: {delta.error}")
+            return stored
+        logger.debug(f"增量更新{market_type}数据 {stock_code}, 新增数据点数: {len(delta)}")
+        # 增量从最后存储日期开始获取，与已覆盖区间相接
+        return self.history_store.append(market_type, stock_code, delta, coverage_start=stored.index[-1])
+    
+    async def _load_stock_data_async(self, source: DataSource, stock_code: str, market_type: str,
+                                     start_date: str, end_date: str,
+                                     fetch_group: Optional[Hashable] = None,
+                                     timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        _load_stock_data_sync的异步版本：网络获取在事件循环中进行，
+        只有本地存储的读写在获取线程池中执行
+        """
+        if self.history_store is None:
+            return await self._get_stock_data_async(source, stock_code, market_type, start_date, end_date,
+                                                    fetch_group, timeout)
+        
+        start_dt = pd.to_datetime(start_date, format='%Y%m%d')
+        end_dt = pd.to_datetime(end_date, format='%Y%m%d')
+        
+        stored = await fetch_scheduler.run(self.history_store.load, market_type, stock_code, group=fetch_group)
+        action = self._plan_store_update(stored, market_type, start_dt, end_dt)
+        if self._uses_factors(market_type):
+            fetch = lambda start, end, stored=None: self._get_factor_bars_async(
+                stock_code, market_type, start, end, fetch_group, timeout, stored)
+        else:
+            fetch = lambda start, end, stored=None: self._get_stock_data_async(
+                source, stock_code, market_type, start, end, fetch_group, timeout)
+        
+        if action == 'full':
+            # 本地没有覆盖请求区间，完整获取后写入存储（支持异步获取的市场没有全量历史接口）
+            fetch_end = self._full_fetch_end(stored, market_type, end_date)
+            df = await fetch(start_date, fetch_end)
+            if hasattr(df, 'error') or df.empty:
+                return df
+            stored = await fetch_scheduler.run(self._store_full, stored, stock_code, market_type, df, start_dt,
+                                               pd.to_datetime(fetch_end, format='%Y%m%d'), group=fetch_group)
+        elif action == 'delta':
+            delta = await fetch(stored.index[-1].strftime('%Y%m%d'), end_date, stored)
+            stored = await fetch_scheduler.run(self._merge_delta, stored, delta, stock_code, market_type,
+                                               group=fetch_group)
+        else:
+            logger.debug(f"使用本地存储的{market_type}数据 {stock_code}")
+        
+        return self._read_stored(stored, start_date, end_date)
+    
+    async def _get_stock_data_async(self, source: DataSource, stock_code: str, market_type: str,
+                                    start_date: str, end_date: str,
+                                    fetch_group: Optional[Hashable] = None,
+                                    timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        _get_stock_data_sync的异步版本，通过数据源的原生异步接口获取
+        
+        Args:
+            timeout: 单次网络请求的超时秒数
+        """
+        try:
+            logger.debug(f"通过数据源 {source.name} 异步获取{market_type}数据: {stock_code}")
+            df = await source.afetch_history(stock_code, market_type, start_date, end_date,
+                                             group=fetch_group, timeout=timeout)
+            
+            if df.empty:
+                logger.warning(f"无法获取{market_type}数据: {stock_code}，返回的DataFrame为空")
+                return df
+            
+            logger.info(f"成功获取{market_type}数据 {stock_code}, 数据点数: {len(df)}")
+            return df
+            
+        except Exception as e:
+            return self._error_result(stock_code, market_type, e)
+    
+    async def _get_factor_bars_async(self, stock_code: str, market_type: str, start_date: str, end_date: str,
+                                     fetch_group: Optional[Hashable] = None,
+                                     timeout: Optional[float] = None,
+                                     stored: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        _get_factor_bars_sync的异步版本：完整获取时同时获取不复权和后复权K线，
+        增量获取时先获取不复权K线，只在期间有除权除息时再获取后复权K线
+        """
+        fetch = lambda adjust: self._get_stock_data_async(self.get_data_source(market_type, adjust), stock_code,
+                                                          market_type, start_date, end_date, fetch_group, timeout)
+        if stored is None:
+            raw, hfq = await asyncio.gather(fetch(''), fetch('hfq'))
+            return self._combine_factor_bars(raw, hfq)
+        raw = await fetch('')
+        if hasattr(raw, 'error') or raw.empty:
+            return raw
+        carried = self._carry_factor(stored, raw)
+        if carried is not None:
+            return carried
+        return self._combine_factor_bars(raw, await fetch('hfq'))
+    
+    def _get_factor_bars_sync(self, stock_code: str, market_type: str,
+                              start_date: str, end_date: str,
+                              stored: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        获取不复权K线及其后复权累计因子（由同一区间的后复权收盘价计算）
+        
+        Args:
+            stored: 增量获取时为已存储的K线；期间没有除权除息时沿用其最新因子，不请求后复权K线
+        
+        Returns:
+            含 Factor 列的不复权K线；失败时返回带有error属性的空DataFrame
+        """
+        raw = self._get_stock_data_sync(stock_code, market_type, start_date, end_date, adjust='')
+        if hasattr(raw, 'error') or raw.empty:
+            return raw
+        carried = self._carry_factor(stored, raw)
+        if carried is not None:
+            return carried
+        hfq = self._get_stock_data_sync(stock_code, market_type, start_date, end_date, adjust='hfq')
+        return self._combine_factor_bars(raw, hfq)
+    
+    @classmethod
+    def _carry_factor(cls, stored: Optional[pd.DataFrame], raw: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        增量K线期间没有除权除息时，新K线沿用已存储的最新复权因子
+        
+        除权除息日交易所的涨跌额按除权后的参考价计算，收盘价 - 涨跌额 与不复权的前一日收盘价不同；
+        每根新K线都相同时说明因子没有变化。涨跌额缺失或由收盘价推算（见 ESTIMATED_COLUMNS_ATTR）时无法判断
+        
+        Returns:
+            含 Factor 列的不复权K线，无法确认因子未变化时返回None
+        """
+        if stored is None or stored.empty or FACTOR_COLUMN not in stored.columns or 'Change' not in raw.columns:
+            return None
+        if 'Change' in raw.attrs.get(ESTIMATED_COLUMNS_ATTR, ()):
+            return None
+        closes = pd.concat([stored['Close'][stored.index < raw.index[0]], raw['Close']])
+        prev_close = closes.shift(1).reindex(raw.index)
+        # NaN（缺少前一日收盘价或涨跌额）比较结果为False，按有除权除息处理
+        if not ((raw['Close'] - raw['Change'] - prev_close).abs() <= cls.PREV_CLOSE_TOLERANCE).all():
+            logger.debug("增量K线期间可能有除权除息，获取后复权K线重新计算复权因子")
+            return None
+        result = raw.copy()
+        result[FACTOR_COLUMN] = float(stored[FACTOR_COLUMN].iloc[-1])
+        return result
+    
+    @staticmethod
+    def _combine_factor_bars(raw: pd.DataFrame, hfq: pd.DataFrame) -> pd.DataFrame:
+        if hasattr(raw, 'error') or raw.empty:
+            return raw
+        if hasattr(hfq, 'error'):
+            return hfq
+        if hfq.empty:
+            df = pd.DataFrame()
+            df.error = "未获取到后复权数据，无法计算复权因子"
+            return df
+        return derive_factors(raw, hfq)
+    
+    @staticmethod
+    def _error_result(stock_code: str, market_type: str, e: Exception) -> pd.DataFrame:
+        """记录获取错误并返回带有error属性的空DataFrame"""
+        error_msg = f"获取{market_type}数据失败 {stock_code}: {str(e)}"
+        logger.error(error_msg)
+        logger.exception(e)
+        # 使用空的DataFrame并添加错误信息，而不是抛出异常
+        # 这样上层调用者可以检查是否有错误并适当处理
+        df = pd.DataFrame()
+        df.error = error_msg  # 添加错误属性
+        return df
+    
+    def _get_stock_data_sync(self, stock_code: str, market_type: str = 'A', 
+                           start_date: Optional[str] = None, 
+                           end_date: Optional[str] = None,
+                           adjust: Optional[str] = None) -> pd.DataFrame:
+        """
+        同步获取股票数据的实现，按市场分派到对应的数据源
+        将被异步方法调用
+        
+        Args:
+            adjust: 复权方式，默认为 self.adjust
+        """
+        start_date, end_date = self._resolve_date_range(start_date, end_date, market_type)
             
         try:
-            if market_type == 'A':
-                logger.debug(f"获取A股数据: {stock_code}")
-                
-                df = ak.stock_zh_a_hist(
-                    symbol=stock_code,
-                    start_date=start_date,
-                    end_date=end_date,
-                    adjust="qfq"
-                )
-                if df.empty:
-                    logger.warning(f"无法获取A股数据: {stock_code}，返回的DataFrame为空")
-                    return df
-                
-            elif market_type in ['HK']:
-                logger.debug(f"获取港股数据: {stock_code}")
-                df = ak.stock_hk_daily(
-                    symbol=stock_code,
-                    adjust="qfq"
-                )
-                if df.empty:
-                    logger.warning(f"无法获取港股数据: {stock_code}，返回的DataFrame为空")
-                    return df
-                
-                # 在获取数据后进行日期过滤
-                try:
-                    if not isinstance(df.index, pd.DatetimeIndex):
-                        # 如果存在命名为'date'的列，将其设为索引
-                        if 'date' in df.columns:
-                            df['date'] = pd.to_datetime(df['date'])
-                            df.set_index('date', inplace=True)
-                        else:
-                            # 尝试将第一列转换为日期索引
-                            date_col = df.columns[0]
-                            df[date_col] = pd.to_datetime(df[date_col])
-                            df.set_index(date_col, inplace=True)
-                    
-                    # 转换日期字符串为日期对象
-                    if start_date:
-                        if start_date.isdigit() and len(start_date) == 8:
-                            start_date_dt = pd.to_datetime(start_date, format='%Y%m%d')
-                        else:
-                            start_date_dt = pd.to_datetime(start_date)
-                    else:
-                        start_date_dt = pd.to_datetime((datetime.now() - timedelta(days=365)).strftime('%Y%m%d'))
-                        
-                    if end_date:
-                        if end_date.isdigit() and len(end_date) == 8:
-                            end_date_dt = pd.to_datetime(end_date, format='%Y%m%d')
-                        else:
-                            end_date_dt = pd.to_datetime(end_date)
-                    else:
-                        end_date_dt = pd.to_datetime(datetime.now().strftime('%Y%m%d'))
-                    
-                    # 过滤日期范围
-                    df = df[(df.index >= start_date_dt) & (df.index <= end_date_dt)]
-                    logger.debug(f"港股日期过滤后数据点数: {len(df)}")
-                    
-                except Exception as e:
-                    logger.warning(f"港股日期过滤出错: {str(e)}，使用原始数据")
-                
-            elif market_type in ['US']:
-                logger.debug(f"获取美股数据: {stock_code}")
-                try:
-                    df = ak.stock_us_daily(
-                        symbol=stock_code,
-                        adjust="qfq"
-                    )
-                    if df.empty:
-                        logger.warning(f"无法获取美股数据: {stock_code}，返回的DataFrame为空")
-                        return df
-
-                    logger.debug(f"美股数据原始列: {df.columns.tolist()}")
-                    logger.debug(f"美股数据形状: {df.shape}")
-                    
-                    # 确保索引是日期时间类型
-                    if not isinstance(df.index, pd.DatetimeIndex):
-                        # 如果存在命名为'date'的列，将其设为索引
-                        if 'date' in df.columns:
-                            df['date'] = pd.to_datetime(df['date'])
-                            df.set_index('date', inplace=True)
-                            logger.debug("已将'date'列设置为索引")
-                        else:
-                            # 否则将当前索引转换为日期类型
-                            df.index = pd.to_datetime(df.index)
-                            logger.debug("已将索引转换为DatetimeIndex")
-                    
-                    # 计算美股的成交额（Amount）= 成交量（Volume）× 收盘价（Close）
-                    volume_col = next((col for col in df.columns if col.lower() == 'volume'), None)
-                    close_col = next((col for col in df.columns if col.lower() == 'close'), None)
-                    
-                    if volume_col and close_col:
-                        df['amount'] = df[volume_col] * df[close_col]
-                        logger.debug("已为美股数据计算成交额(amount)字段")
-                    else:
-                        logger.warning(f"美股数据缺少volume或close列，无法计算amount。当前列: {df.columns.tolist()}")
-                        # 添加空的amount列，避免后续处理错误
-                        df['amount'] = 0.0
-                        
-                    # 将所有列名转为小写以进行统一处理
-                    df.columns = [col.lower() for col in df.columns]
-                    
-                except Exception as e:
-                    logger.error(f"获取美股数据失败 {stock_code}: {str(e)}")
-                    raise ValueError(f"获取美股数据失败 {stock_code}: {str(e)}")
-                
-                # 将字符串日期转换为日期时间对象进行比较
-                try:
-                    # 尝试多种格式解析日期
-                    # 如果日期是数字格式（20220101），使用适当的格式
-                    if start_date.isdigit() and len(start_date) == 8:
-                        start_date_dt = pd.to_datetime(start_date, format='%Y%m%d')
-                    else:
-                        # 否则让pandas自动推断格式
-                        start_date_dt = pd.to_datetime(start_date)
-                        
-                    if end_date.isdigit() and len(end_date) == 8:
-                        end_date_dt = pd.to_datetime(end_date, format='%Y%m%d')
-                    else:
-                        end_date_dt = pd.to_datetime(end_date)
-                except Exception as e:
-                    logger.warning(f"日期转换出错: {str(e)}，使用默认值")
-                    # 如果转换失败，使用合理的默认值
-                    start_date_dt = pd.to_datetime('20000101', format='%Y%m%d')
-                    end_date_dt = pd.to_datetime(datetime.now().strftime('%Y%m%d'), format='%Y%m%d')
-                
-                # 过滤日期
-                try:
-                    df = df[(df.index >= start_date_dt) & (df.index <= end_date_dt)]
-                    logger.debug(f"日期过滤后数据点数: {len(df)}")
-                except Exception as e:
-                    logger.warning(f"日期过滤出错: {str(e)}，返回原始数据")
-                    
-            elif market_type in ['ETF']:
-                logger.debug(f"获取{market_type}基金数据: {stock_code}")
-                df = ak.fund_etf_hist_em(
-                    symbol=stock_code,
-                    start_date=start_date.replace('-', ''),
-                    end_date=end_date.replace('-', '')
-                )
-                if df.empty:
-                    logger.warning(f"无法获取ETF基金数据: {stock_code}，返回的DataFrame为空")
-                    return df
-            elif market_type in ['LOF']:
-                logger.debug(f"获取{market_type}基金数据: {stock_code}")
-                df = ak.fund_lof_hist_em(
-                    symbol=stock_code,
-                    start_date=start_date.replace('-', ''),
-                    end_date=end_date.replace('-', '')
-                )
-                if df.empty:
-                    logger.warning(f"无法获取LOF基金数据: {stock_code}，返回的DataFrame为空")
-                    return df
-                
-            else:
+            if market_type not in SUPPORTED_MARKETS:
                 error_msg = f"不支持的市场类型: {market_type}"
                 logger.error(f"[市场类型错误] {error_msg}")
                 raise ValueError(error_msg)
-                
-            # 标准化列名
+            
+            source = self.get_data_source(market_type, adjust)
+            logger.debug(f"通过数据源 {source.name} 获取{market_type}数据: {stock_code}")
+            df = source.fetch_history(stock_code, market_type, start_date, end_date)
+            
             if df.empty:
-                logger.debug(f"数据获取结果为空DataFrame，跳过列名标准化: {stock_code}")
+                logger.warning(f"无法获取{market_type}数据: {stock_code}，返回的DataFrame为空")
                 return df
                 
-            if market_type == 'A':
-                # 根据实际数据结构调整列名映射
-                # 实际数据列：['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
-                df.columns = ['Date', 'Code', 'Open', 'Close', 'High', 'Low', 'Volume', 'Amount', 'Amplitude', 'Change_pct', 'Change', 'Turnover']
-            elif market_type in ['HK', 'US']:
-                # 美股数据列可能不同，需要通过映射处理
-                columns_mapping = {
-                    'open': 'Open',
-                    'high': 'High',
-                    'low': 'Low',
-                    'close': 'Close',
-                    'volume': 'Volume',
-                    'amount': 'Amount'
-                }
-                
-                # 创建新的DataFrame以确保列顺序和存在性
-                new_df = pd.DataFrame(index=df.index)
-                
-                # 遍历映射，填充新DataFrame
-                for orig_col, new_col in columns_mapping.items():
-                    if orig_col in df.columns:
-                        new_df[new_col] = df[orig_col]
-                    else:
-                        # 如果原始列不存在，创建一个填充0的列
-                        logger.warning(f"数据中缺少{orig_col}列，使用0值填充")
-                        new_df[new_col] = 0.0
-                
-                # 替换原始df
-                df = new_df
-                
-            elif market_type in ['ETF', 'LOF']:
-                # 基金数据可能有不同的列
-                df.columns = ['Date', 'Open', 'Close', 'High', 'Low', 'Volume', 'Amount', 'Amplitude', 'Change_pct', 'Change', 'Turnover']
-                
-            # 确保日期列是日期类型
-            if 'Date' in df.columns:
-                df['Date'] = pd.to_datetime(df['Date'])
-                df.set_index('Date', inplace=True)
-                
-            # 确保按日期升序排序
-            df.sort_index(inplace=True)
-                
             logger.info(f"成功获取{market_type}数据 {stock_code}, 数据点数: {len(df)}")
             return df
             
         except Exception as e:
-            error_msg = f"获取{market_type}数据失败 {stock_code}: {str(e)}"
-            logger.error(error_msg)
-            logger.exception(e)
-            # 使用空的DataFrame并添加错误信息，而不是抛出异常
-            # 这样上层调用者可以检查是否有错误并适当处理
-            df = pd.DataFrame()
-            df.error = error_msg  # 添加错误属性
-            return df
+            return self._error_result(stock_code, market_type, e)
+    
+    def _get_full_history_sync(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        """
+        数据源能低成本提供全量历史时返回全量K线，否则返回None
+        """
+        try:
+            return self.get_data_source(market_type).fetch_full_history(stock_code, market_type)
+        except Exception as e:
+            logger.warning(f"获取{market_type}全量历史失败 {stock_code}: {str(e)}")
+            return None
             
     async def get_multiple_stocks_data(self, stock_codes: List[str], 
                                      market_type: str = 'A',
                                      start_date: Optional[str] = None, 
                                      end_date: Optional[str] = None,
-                                     max_concurrency: int = 5) -> Dict[str, pd.DataFrame]:
+                                     max_concurrency: Optional[int] = None,
+                                     lookback: Optional[int] = None) -> Dict[str, pd.DataFrame]:
         """
         异步批量获取多只股票数据
         
@@ -293,27 +658,84 @@ class StockDataProvider:
             market_type: 市场类型，默认为'A'股
             start_date: 开始日期，格式YYYYMMDD
             end_date: 结束日期，格式YYYYMMDD
-            max_concurrency: 最大并发数，默认为5
+            max_concurrency: 已弃用，并发数由全局获取调度器（FETCH_MAX_WORKERS）统一控制
+            lookback: 未指定start_date时获取的K线数，见get_stock_data
             
         Returns:
             字典，键为股票代码，值为对应的DataFrame
         """
-        # 使用信号量控制并发数
-        semaphore = asyncio.Semaphore(max_concurrency)
+        # 本次批量请求的所有任务共用一个调度分组，与其他请求轮询分配线程
+        fetch_group = object()
         
-        async def get_with_semaphore(code):
-            async with semaphore:
-                try:
-                    return code, await self.get_stock_data(code, market_type, start_date, end_date)
-                except Exception as e:
-                    logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
-                    return code, None
+        async def get_one(code):
+            try:
+                return code, await self.get_stock_data(code, market_type, start_date, end_date,
+                                                       fetch_group=fetch_group, lookback=lookback)
+            except Exception as e:
+                logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
+                return code, None
         
         # 创建异步任务
-        tasks = [get_with_semaphore(code) for code in stock_codes]
+        tasks = [get_one(code) for code in stock_codes]
         
         # 等待所有任务完成
         results = await asyncio.gather(*tasks)
         
         # 构建结果字典，过滤掉失败的请求
-        return {code: df for code, df in results if df is not None}
\ No newline at end of file
+        return {code: df for code, df in results if df is not None}
+    
+    async def iter_multiple_stocks_data(self, stock_codes: List[str], 
+                                        market_type: str = 'A',
+                                        start_date: Optional[str] = None, 
+                                        end_date: Optional[str] = None,
+                                        timeout: Optional[float] = None,
+                                        lookback: Optional[int] = None,
+                                        columns: Optional[Sequence[str]] = None,
+                                        compact: bool = False) -> AsyncIterator[Tuple[str, pd.DataFrame]]:
+        """
+        异步批量获取多只股票数据，按完成顺序逐只返回
+        
+        Args:
+            stock_codes: 股票代码列表
+            market_type: 市场类型，默认为'A'股
+            start_date: 开始日期，格式YYYYMMDD
+            end_date: 结束日期，格式YYYYMMDD
+            timeout: 单只股票的获取超时秒数，默认读取环境变量 STOCK_FETCH_TIMEOUT（默认30秒）
+            lookback: 未指定start_date时获取的K线数，见get_stock_data
+            columns: 只返回需要的列，见get_stock_data
+            compact: 是否返回紧凑数据类型，见get_stock_data
+            
+        Returns:
+            异步迭代器，生成(股票代码, DataFrame)；获取失败或超时时DataFrame为空并带有error属性
+        """
+        if timeout is None:
+            timeout = self.fetch_timeout
+        if self._should_validate(market_type):
+            # 批量请求先加载代码主表，无效代码可直接返回而不占用获取线程
+            await symbol_master.ensure_loaded(market_type)
+        # 本次批量请求的所有任务共用一个调度分组，与其他请求轮询分配线程
+        fetch_group = object()
+        
+        async def get_one(code):
+            try:
+                df = await self.get_stock_data(code, market_type, start_date, end_date,
+                                               fetch_group=fetch_group, timeout=timeout, lookback=lookback,
+                                               columns=columns, compact=compact)
+            except asyncio.TimeoutError:
+                logger.error(f"获取股票 {code} 数据超时（{timeout}秒）")
+                df = pd.DataFrame()
+                df.error = f"获取{market_type}数据超时 {code}"
+            except Exception as e:
+                logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
+                df = pd.DataFrame()
+                df.error = f"获取{market_type}数据失败 {code}: {str(e)}"
+            return code, df
+        
+        tasks = [asyncio.ensure_future(get_one(code)) for code in stock_codes]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前结束迭代时取消尚未完成的任务
+            for task in tasks:
+                task.cancel()
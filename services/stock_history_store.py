@@ -0,0 +1,294 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Any
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 后复权累计因子列：后复权价格 = 不复权价格 × 因子
+FACTOR_COLUMN = 'Factor'
+
+# 复权时需要换算的价格列
+ADJUSTED_COLUMNS = ('Open', 'Close', 'High', 'Low', 'Change')
+
+# 两次获取的复权因子在重叠日期上的相对差异超过该值时，认为因子基准不同
+FACTOR_TOLERANCE = 1e-3
+
+# df.attrs中记录估算列的键（如备用接口按成交量估算的成交额），追加时不覆盖已存储的值
+ESTIMATED_COLUMNS_ATTR = 'estimated_columns'
+
+def derive_factors(raw: pd.DataFrame, hfq: pd.DataFrame) -> pd.DataFrame:
+    """
+    由同一区间的不复权和后复权K线计算每根K线的后复权累计因子
+
+    Args:
+        raw: 不复权K线
+        hfq: 后复权K线
+
+    Returns:
+        不复权K线的副本，增加 Factor 列
+    """
+    close = raw['Close'].where(raw['Close'] > 0)
+    factor = (hfq['Close'].reindex(raw.index) / close).ffill().bfill().fillna(1.0)
+    result = raw.copy()
+    result[FACTOR_COLUMN] = factor.to_numpy(dtype=np.float64)
+    return result
+
+def apply_adjustment(df: pd.DataFrame, adjust: str, anchor: Optional[float] = None) -> pd.DataFrame:
+    """
+    读取时按复权方式换算价格（向量化乘法）
+
+    Args:
+        df: 含 Factor 列的不复权K线，不含该列时视为已复权数据原样返回
+        adjust: 'qfq'（前复权）、'hfq'（后复权）或 ''（不复权）
+        anchor: 前复权的基准因子（通常为存储中最后一根K线的因子），默认为df最后一行的因子
+
+    Returns:
+        去掉 Factor 列的新DataFrame
+    """
+    if FACTOR_COLUMN not in df.columns:
+        return df
+    factor = df[FACTOR_COLUMN].to_numpy(dtype=np.float64)
+    result = df.drop(columns=[FACTOR_COLUMN])
+    if result.empty or adjust not in ('qfq', 'hfq'):
+        return result
+    if adjust == 'qfq':
+        factor = factor / (anchor if anchor is not None else factor[-1])
+    columns = [col for col in ADJUSTED_COLUMNS if col in result.columns]
+    result[columns] = result[columns].to_numpy(dtype=np.float64) * factor[:, None]
+    return result
+
+class StockHistoryStore:
+    """
+    本地K线历史存储
+    每个市场/代码对应一个 .npz 文件，按列保存标准化后的日线数据，
+    读取时无需访问网络，追加时只写入新的K线
+    """
+
+    def __init__(self, base_dir: Optional[str] = None):
+        """
+        初始化历史存储
+
+        Args:
+            base_dir: 存储根目录，默认读取环境变量 STOCK_HISTORY_DIR，未设置时为 data/history
+        """
+        self.base_dir = base_dir or os.getenv('STOCK_HISTORY_DIR', os.path.join('data', 'history'))
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        logger.debug(f"初始化StockHistoryStore，存储目录: {self.base_dir}")
+
+    def _path(self, market_type: str, stock_code: str) -> str:
+        """返回指定市场/代码的存储文件路径"""
+        safe_code = "".join(c if c.isalnum() or c in '-_.' else '_' for c in str(stock_code))
+        return os.path.join(self.base_dir, market_type, f"{safe_code}.npz")
+
+    def _lock(self, market_type: str, stock_code: str) -> threading.Lock:
+        """获取指定市场/代码的文件锁，避免并发写入同一文件"""
+        key = f"{market_type}:{stock_code}"
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[key] = lock
+            return lock
+
+    def load(self, market_type: str, stock_code: str) -> Optional[pd.DataFrame]:
+        """
+        读取本地存储的K线数据
+
+        Args:
+            market_type: 市场类型
+            stock_code: 股票代码
+
+        Returns:
+            以日期为索引的DataFrame，不存在或读取失败时返回None；
+            存储元数据保存在 df.attrs['store_meta'] 中
+        """
+        with self._lock(market_type, stock_code):
+            return self._load_unlocked(market_type, stock_code)
+
+    def _load_unlocked(self, market_type: str, stock_code: str) -> Optional[pd.DataFrame]:
+        """load的实现，调用者需持有该代码的文件锁"""
+        path = self._path(market_type, stock_code)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = [str(c) for c in data['__columns__']]
+                index = pd.DatetimeIndex(data['__index__'].astype('datetime64[ns]'), name='Date')
+                df = pd.DataFrame({col: data[f"col:{col}"] for col in columns}, index=index)
+                meta = {
+                    'coverage_start': pd.Timestamp(int(data['__coverage_start__'])),
+                    'updated_at': float(data['__updated_at__']),
+                }
+            df.attrs['store_meta'] = meta
+            return df
+        except Exception as e:
+            logger.warning(f"读取本地K线存储失败 {market_type}:{stock_code}: {str(e)}")
+            return None
+
+    def save(self, market_type: str, stock_code: str, df: pd.DataFrame,
+             coverage_start: Optional[pd.Timestamp] = None) -> None:
+        """
+        覆盖写入K线数据（先写临时文件再原子替换）
+
+        Args:
+            market_type: 市场类型
+            stock_code: 股票代码
+            df: 以日期为索引的标准化K线数据
+            coverage_start: 已覆盖的最早请求日期，默认为数据的第一个日期
+        """
+        with self._lock(market_type, stock_code):
+            self._save_unlocked(market_type, stock_code, df, coverage_start)
+
+    def _save_unlocked(self, market_type: str, stock_code: str, df: pd.DataFrame,
+                       coverage_start: Optional[pd.Timestamp] = None) -> None:
+        """save的实现，调用者需持有该代码的文件锁"""
+        if df is None or df.empty:
+            return
+
+        if coverage_start is None:
+            coverage_start = df.index[0]
+
+        arrays: Dict[str, Any] = {
+            '__index__': pd.DatetimeIndex(df.index).asi8,
+            '__columns__': np.array([str(c) for c in df.columns]),
+            '__coverage_start__': np.int64(pd.Timestamp(coverage_start).value),
+            '__updated_at__': np.float64(time.time()),
+        }
+        for col in df.columns:
+            values = df[col].to_numpy()
+            # 对象列（如股票代码）转为定长字符串，避免依赖pickle
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"col:{col}"] = values
+
+        path = self._path(market_type, stock_code)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+            logger.debug(f"已写入本地K线存储 {market_type}:{stock_code}, 数据点数: {len(df)}")
+        except Exception as e:
+            logger.warning(f"写入本地K线存储失败 {market_type}:{stock_code}: {str(e)}")
+
+    def append(self, market_type: str, stock_code: str, new_df: pd.DataFrame,
+               coverage_start: Optional[pd.Timestamp] = None,
+               coverage_end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """
+        追加新的K线数据，与已存储数据合并，同一日期以新数据为准，
+        但新数据缺失（NaN）的值和估算列（见 ESTIMATED_COLUMNS_ATTR）保留已存储的值；
+        双方都含复权因子时，新数据的因子按重叠日期换算到已存储因子的基准，
+        除权除息只会在因子序列中追加新的值，不需要改写已存储的K线
+
+        覆盖范围始终是从覆盖起点到最后一根K线的一段连续区间，见 _merged_coverage
+
+        Args:
+            market_type: 市场类型
+            stock_code: 股票代码
+            new_df: 新获取的K线数据
+            coverage_start: 本次请求的开始日期，默认为新数据的第一个日期
+            coverage_end: 本次请求的结束日期，默认为新数据的最后一个日期
+
+        Returns:
+            合并后的完整DataFrame
+        """
+        # 读取、合并、写入期间持有文件锁，并发追加同一代码时不会丢失另一方写入的K线
+        with self._lock(market_type, stock_code):
+            return self._append_unlocked(market_type, stock_code, new_df, coverage_start, coverage_end)
+
+    def _append_unlocked(self, market_type: str, stock_code: str, new_df: pd.DataFrame,
+                         coverage_start: Optional[pd.Timestamp] = None,
+                         coverage_end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        existing = self._load_unlocked(market_type, stock_code)
+        if existing is None or existing.empty:
+            merged = new_df
+        else:
+            coverage_start = self._merged_coverage(existing, new_df, coverage_start, coverage_end)
+            if new_df is None or new_df.empty:
+                merged = existing
+            else:
+                if FACTOR_COLUMN in existing.columns and FACTOR_COLUMN in new_df.columns:
+                    new_df = self._align_factors(existing, new_df)
+                new_df = self._keep_existing_values(existing, new_df)
+                merged = pd.concat([existing, new_df])
+                merged = merged[~merged.index.duplicated(keep='last')]
+
+        if merged is None or merged.empty:
+            return merged
+
+        merged = merged.sort_index()
+        merged.index.name = 'Date'
+        self._save_unlocked(market_type, stock_code, merged, coverage_start)
+        return merged
+
+    @staticmethod
+    def _merged_coverage(existing: pd.DataFrame, new_df: Optional[pd.DataFrame],
+                         coverage_start: Optional[pd.Timestamp],
+                         coverage_end: Optional[pd.Timestamp]) -> pd.Timestamp:
+        """
+        合并后的覆盖起点：从覆盖起点到最后一根K线之间的K线都已获取，读取时可直接使用
+
+        新请求区间与已覆盖区间相交或相接时合并为一段；在覆盖起点之前且不相接时，
+        中间的K线未获取，保持原覆盖起点；在最后一根K线之后开始时，无法确定中间是否缺少交易日，
+        以新区间的开始日期为覆盖起点（之前的K线仍保留，但不再视为已覆盖）
+        """
+        previous_start = existing.attrs['store_meta']['coverage_start']
+        if new_df is None or new_df.empty:
+            return previous_start
+        new_start = pd.Timestamp(coverage_start) if coverage_start is not None else new_df.index[0]
+        new_end = pd.Timestamp(coverage_end) if coverage_end is not None else new_df.index[-1]
+        if new_start > existing.index[-1]:
+            logger.debug(f"新K线区间 {new_start.date()} 起与已存储的K线不相接，覆盖起点改为该日期")
+            return new_start
+        if new_end < previous_start:
+            logger.debug(f"新K线区间在覆盖起点 {previous_start.date()} 之前且不相接，保持原覆盖起点")
+            return previous_start
+        return min(previous_start, new_start)
+
+    @staticmethod
+    def _align_factors(existing: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        把新数据的复权因子换算到已存储因子的基准（如两次获取来自不同的备用接口）
+
+        前复权只依赖因子之比，统一基准后已存储的K线和因子都无需改写
+        """
+        overlap = existing.index.intersection(new_df.index)
+        if overlap.empty:
+            return new_df
+        day = overlap[0]
+        ratio = float(existing.at[day, FACTOR_COLUMN]) / float(new_df.at[day, FACTOR_COLUMN])
+        if not np.isfinite(ratio) or abs(ratio - 1.0) <= FACTOR_TOLERANCE:
+            return new_df
+        logger.debug(f"复权因子基准不一致，按 {day.date()} 的因子换算: {ratio:.6f}")
+        new_df = new_df.copy()
+        new_df[FACTOR_COLUMN] = new_df[FACTOR_COLUMN] * ratio
+        return new_df
+
+    @staticmethod
+    def _keep_existing_values(existing: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        重叠日期上，新数据中缺失的值和估算列改用已存储的值
+        （如备用接口的增量数据首行没有涨跌幅、成交额为估算值、换手率缺失）
+        """
+        overlap = new_df.index.intersection(existing.index)
+        if overlap.empty:
+            return new_df
+        estimated = set(new_df.attrs.get(ESTIMATED_COLUMNS_ATTR, ()))
+        result = None
+        for col in new_df.columns.intersection(existing.columns):
+            old = existing.loc[overlap, col]
+            new = new_df.loc[overlap, col]
+            keep = old.notna() & (new.isna() | (col in estimated))
+            if keep.any():
+                if result is None:
+                    result = new_df.copy()
+                result.loc[overlap[keep.to_numpy()], col] = old[keep]
+        return new_df if result is None else result
@@ -11,6 +11,9 @@ class StockScorer:
     负责根据技术指标计算股票的综合评分
     """
     
+    # 评分使用的指标列，调用方可只计算这些指标
+    REQUIRED_INDICATORS = ('MA5', 'MA20', 'MA60', 'RSI', 'MACD', 'Signal', 'Volume_Ratio')
+    
     def __init__(self):
         """初始化股票评分服务"""
         logger.debug("初始化StockScorer股票评分服务")
@@ -0,0 +1,177 @@
+import os
+import re
+import time
+import asyncio
+import pandas as pd
+from typing import Dict, Optional, Set
+from utils.logger import get_logger
+from utils.single_flight import SingleFlight
+from services.fetch_scheduler import fetch_scheduler
+from services.trading_calendar import get_trading_calendar
+
+# 获取日志器
+logger = get_logger()
+
+# 各市场代码列表的akshare接口及其代码、名称列
+SYMBOL_LIST_FUNCTIONS: Dict[str, tuple] = {
+    'A': ('stock_info_a_code_name', 'code', 'name'),
+    'HK': ('stock_hk_spot_em', '代码', '名称'),
+    'US': ('stock_us_spot_em', '代码', '名称'),
+    'ETF': ('fund_etf_spot_em', '代码', '名称'),
+    'LOF': ('fund_lof_spot_em', '代码', '名称'),
+}
+
+# 代码格式校验（只对格式固定的市场校验）
+CODE_PATTERNS: Dict[str, re.Pattern] = {
+    'A': re.compile(r'^\d{6}$'),
+    'ETF': re.compile(r'^\d{6}$'),
+    'LOF': re.compile(r'^\d{6}$'),
+}
+
+class SymbolMaster:
+    """
+    各市场证券代码主表
+    每个市场每天（市场当地日期）最多从akshare下载一次代码和名称列表，并保存到本地目录，
+    重启后可直接使用；用于在请求上游之前快速识别无效代码
+    """
+
+    # 下载失败后的重试间隔（秒）
+    RETRY_INTERVAL = 600
+
+    def __init__(self, base_dir: Optional[str] = None):
+        """
+        初始化代码主表
+
+        Args:
+            base_dir: 本地保存目录，默认读取环境变量 SYMBOL_MASTER_DIR，未设置时为 data/symbols
+        """
+        self.base_dir = base_dir or os.getenv('SYMBOL_MASTER_DIR', os.path.join('data', 'symbols'))
+        # 市场 -> 以code、name为列的DataFrame
+        self._tables: Dict[str, pd.DataFrame] = {}
+        self._codes: Dict[str, Set[str]] = {}
+        self._loaded_on: Dict[str, str] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._flight = SingleFlight()
+        self._background: Dict[str, asyncio.Task] = {}
+        logger.debug(f"初始化SymbolMaster，保存目录: {self.base_dir}")
+
+    def _path(self, market_type: str) -> str:
+        return os.path.join(self.base_dir, f"{market_type}.csv")
+
+    @staticmethod
+    def normalize_code(market_type: str, stock_code: str) -> str:
+        """统一代码格式：美股转为大写"""
+        code = str(stock_code).strip()
+        return code.upper() if market_type == 'US' else code
+
+    def is_valid_format(self, market_type: str, stock_code: str) -> bool:
+        """按市场代码格式快速校验"""
+        pattern = CODE_PATTERNS.get(market_type)
+        return pattern is None or bool(pattern.match(str(stock_code)))
+
+    def is_loaded(self, market_type: str) -> bool:
+        """代码表是否已加载（可能是之前保存的版本）"""
+        return market_type in self._codes
+
+    def is_known(self, market_type: str, stock_code: str) -> Optional[bool]:
+        """
+        判断代码是否存在
+
+        Returns:
+            True/False；代码表尚未加载时返回None（无法判断）
+        """
+        if not self.is_valid_format(market_type, stock_code):
+            return False
+        codes = self._codes.get(market_type)
+        if codes is None:
+            return None
+        return self.normalize_code(market_type, stock_code) in codes
+
+    def get_table(self, market_type: str) -> Optional[pd.DataFrame]:
+        """返回已加载的代码表（code、name两列），未加载时返回None"""
+        return self._tables.get(market_type)
+
+    def _needs_refresh(self, market_type: str) -> bool:
+        today = get_trading_calendar(market_type).now().strftime('%Y%m%d')
+        if self._loaded_on.get(market_type) == today:
+            return False
+        return time.time() - self._failed_at.get(market_type, 0) >= self.RETRY_INTERVAL
+
+    def _set_table(self, market_type: str, table: pd.DataFrame, loaded_on: Optional[str]) -> None:
+        self._tables[market_type] = table
+        self._codes[market_type] = set(table['code'])
+        if loaded_on is not None:
+            self._loaded_on[market_type] = loaded_on
+
+    async def ensure_loaded(self, market_type: str) -> bool:
+        """
+        确保代码表已加载并且是当天的版本，下载失败时继续使用之前的版本
+
+        Returns:
+            代码表是否可用
+        """
+        if market_type not in SYMBOL_LIST_FUNCTIONS:
+            return False
+        if not self.is_loaded(market_type):
+            # 先读取本地保存的版本
+            table = await fetch_scheduler.run(self._read_saved, market_type)
+            if table is not None:
+                self._set_table(market_type, table, None)
+        if self._needs_refresh(market_type):
+            await self._flight.do(market_type, lambda: self._refresh(market_type))
+        return self.is_loaded(market_type)
+
+    def load_in_background(self, market_type: str) -> None:
+        """在后台加载代码表，不阻塞当前请求"""
+        task = self._background.get(market_type)
+        if task is None or task.done():
+            self._background[market_type] = asyncio.ensure_future(self.ensure_loaded(market_type))
+
+    async def _refresh(self, market_type: str) -> None:
+        if not self._needs_refresh(market_type):
+            return
+        try:
+            table = await fetch_scheduler.run(self._download, market_type, source='spot')
+            self._set_table(market_type, table, get_trading_calendar(market_type).now().strftime('%Y%m%d'))
+            await fetch_scheduler.run(self._save, market_type, table)
+            logger.info(f"{market_type}代码表更新完成，共 {len(table)} 个代码")
+        except Exception as e:
+            self._failed_at[market_type] = time.time()
+            logger.warning(f"更新{market_type}代码表失败: {str(e)}")
+
+    def _download(self, market_type: str) -> pd.DataFrame:
+        """从akshare下载代码和名称列表（在获取线程中执行）"""
+        import akshare as ak
+
+        func_name, code_col, name_col = SYMBOL_LIST_FUNCTIONS[market_type]
+        logger.info(f"下载{market_type}代码表: ak.{func_name}()")
+        raw = getattr(ak, func_name)()
+        codes = raw[code_col].astype(str)
+        if market_type == 'US':
+            # 美股代码形如'105.AAPL'，历史数据接口使用'AAPL'
+            codes = codes.str.split('.').str[-1].str.upper()
+        table = pd.DataFrame({'code': codes.values, 'name': raw[name_col].astype(str).values})
+        table = table[table['code'] != ''].drop_duplicates('code').reset_index(drop=True)
+        if table.empty:
+            raise ValueError("代码表为空")
+        return table
+
+    def _read_saved(self, market_type: str) -> Optional[pd.DataFrame]:
+        path = self._path(market_type)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_csv(path, dtype=str, keep_default_na=False)
+        except Exception as e:
+            logger.warning(f"读取本地{market_type}代码表失败: {str(e)}")
+            return None
+
+    def _save(self, market_type: str, table: pd.DataFrame) -> None:
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = self._path(market_type)
+        tmp_path = f"{path}.tmp"
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+# 进程内共享的代码主表实例
+symbol_master = SymbolMaster()
@@ -0,0 +1,386 @@
+import os
+import time
+import asyncio
+import pandas as pd
+from bisect import bisect_left, bisect_right
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from utils.logger import get_logger
+from utils.single_flight import SingleFlight
+from services.fetch_scheduler import fetch_scheduler
+from services.symbol_master import symbol_master, SYMBOL_LIST_FUNCTIONS
+
+# 拼音首字母依赖pypinyin（可选），未安装时不支持按拼音首字母搜索
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# 获取日志器
+logger = get_logger()
+
+# 搜索结果中各市场的先后顺序
+SEARCH_MARKETS: Tuple[str, ...] = ('A', 'HK', 'US', 'ETF', 'LOF')
+
+# 索引为空时，搜索请求最多等待首次加载的秒数
+FIRST_LOAD_WAIT = 5.0
+
+def pinyin_initials(name: str) -> str:
+    """
+    返回名称的拼音首字母（小写），如 "贵州茅台" -> "gzmt"；
+    非中文部分保留其中的字母和数字，如 "沪深300ETF" -> "hs300etf"，未安装pypinyin或名称不含中文时返回空字符串
+    """
+    if lazy_pinyin is None or not any('\u4e00' <= ch <= '\u9fff' for ch in name):
+        return ''
+    letters = lazy_pinyin(name, style=Style.FIRST_LETTER)
+    return ''.join(ch for ch in ''.join(letters).lower() if ch.isalnum())
+
+class _PrefixIndex:
+    """排序后的键列表，用二分查找返回以指定前缀开头的条目"""
+
+    def __init__(self, pairs: List[Tuple[str, int]]):
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.ids = [entry_id for _, entry_id in pairs]
+
+    def match(self, prefix: str):
+        start = bisect_left(self.keys, prefix)
+        # '\uffff' 大于任何实际字符，得到前缀区间的右端
+        end = bisect_right(self.keys, prefix + '\uffff', lo=start)
+        return self.ids[start:end]
+
+class TextIndex:
+    """
+    代码/名称文本索引（构建后只读）
+    代码、名称、拼音首字母三个排序前缀索引用于前缀匹配，
+    所有条目拼接成的一个字符串用于子串匹配（str.find在C层扫描）；
+    条目编号即构建时传入的代码和名称的位置
+    """
+
+    # 子串匹配最多检查的条目数（有过滤条件时避免扫描全部条目）
+    MAX_SUBSTRING_SCAN = 5000
+
+    def __init__(self, codes: Sequence[str], names: Sequence[str]):
+        """
+        Args:
+            codes: 代码列表
+            names: 与代码一一对应的名称列表
+        """
+        self.by_code: Dict[str, List[int]] = {}
+        code_pairs, name_pairs, initials_pairs = [], [], []
+        blob_parts = []
+        for entry_id, (code, name) in enumerate(zip(codes, names)):
+            code_key = str(code).lower()
+            name_key = str(name).lower()
+            initials = pinyin_initials(str(name))
+            self.by_code.setdefault(code_key, []).append(entry_id)
+            code_pairs.append((code_key, entry_id))
+            name_pairs.append((name_key, entry_id))
+            if initials:
+                initials_pairs.append((initials, entry_id))
+            blob_parts.append(f"{code_key}\t{name_key}\t{initials}\n")
+
+        self.size = len(blob_parts)
+        self.code_index = _PrefixIndex(code_pairs)
+        self.name_index = _PrefixIndex(name_pairs)
+        self.initials_index = _PrefixIndex(initials_pairs)
+        # 每个条目为 "代码\t名称\t拼音首字母\n"，starts为各条目在拼接字符串中的起始偏移
+        self.blob = ''.join(blob_parts)
+        self.starts: List[int] = []
+        offset = 0
+        for part in blob_parts:
+            self.starts.append(offset)
+            offset += len(part)
+
+    def search(self, keyword: str, limit: int = 10,
+               accept: Optional[Callable[[int], bool]] = None) -> List[Tuple[int, str]]:
+        """
+        搜索条目
+
+        匹配优先级：代码完全匹配 > 代码前缀 > 拼音首字母前缀 > 名称前缀 > 代码/名称/拼音首字母子串
+
+        Args:
+            keyword: 代码、名称或拼音首字母（不区分大小写）
+            limit: 最多返回的结果数
+            accept: 条目过滤函数，返回False的条目被跳过
+
+        Returns:
+            [(条目编号, 匹配方式)]，匹配方式为 code/code_prefix/pinyin_prefix/name_prefix/substring
+        """
+        query = keyword.strip().lower()
+        if not query or limit <= 0:
+            return []
+
+        seen = set()
+        results: List[Tuple[int, str]] = []
+
+        def add(ids, match: str) -> bool:
+            for entry_id in ids:
+                if entry_id in seen or (accept is not None and not accept(entry_id)):
+                    continue
+                seen.add(entry_id)
+                results.append((entry_id, match))
+                if len(results) >= limit:
+                    return True
+            return False
+
+        if add(self.by_code.get(query, ()), 'code'):
+            return results
+        for index, match in ((self.code_index, 'code_prefix'),
+                             (self.initials_index, 'pinyin_prefix'),
+                             (self.name_index, 'name_prefix')):
+            if add(index.match(query), match):
+                return results
+
+        # 子串匹配：在拼接字符串中查找，再按偏移量定位条目
+        if '\t' in query or '\n' in query:
+            return results
+        blob, starts = self.blob, self.starts
+        position = blob.find(query)
+        scanned = 0
+        while position != -1 and scanned < self.MAX_SUBSTRING_SCAN:
+            scanned += 1
+            entry_id = bisect_right(starts, position) - 1
+            if add((entry_id,), 'substring'):
+                break
+            # 跳到下一条目，同一条目只匹配一次
+            next_start = starts[entry_id + 1] if entry_id + 1 < len(starts) else len(blob)
+            position = blob.find(query, next_start)
+        return results
+
+class SymbolSearchIndex:
+    """
+    跨市场（A/HK/US/ETF/LOF）证券代码搜索索引
+    基于SymbolMaster的代码表构建并常驻内存，后台定期检查代码表更新并重建
+    """
+
+    def __init__(self, refresh_interval: Optional[float] = None):
+        """
+        Args:
+            refresh_interval: 检查代码表更新的间隔秒数，默认读取环境变量 SYMBOL_REFRESH_INTERVAL（默认3600秒）
+        """
+        self.refresh_interval = refresh_interval or float(os.getenv('SYMBOL_REFRESH_INTERVAL', '3600'))
+        # 是否在应用启动时加载代码表；关闭时在首次搜索时加载
+        self.preload = os.getenv('ENABLE_SYMBOL_SEARCH_PRELOAD', 'false').lower() == 'true'
+        # (条目列表, 文本索引)，条目为 (代码, 名称, 市场类型)；构建完成后整体替换
+        self._data: Tuple[List[Tuple[str, str, str]], TextIndex] = ([], TextIndex([], []))
+        # 构建索引时使用的代码表（按对象判断代码表是否已更新）
+        self._sources: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flight = SingleFlight()
+        logger.debug(f"初始化SymbolSearchIndex，刷新间隔: {self.refresh_interval}秒")
+
+    @property
+    def ready(self) -> bool:
+        """索引是否已包含数据"""
+        return bool(self._data[0])
+
+    def markets(self) -> List[str]:
+        """已建立索引的市场"""
+        return [market for market in SEARCH_MARKETS if market in self._sources]
+
+    def _changed_tables(self) -> Dict[str, Any]:
+        tables = {market: symbol_master.get_table(market) for market in SYMBOL_LIST_FUNCTIONS}
+        tables = {market: table for market, table in tables.items() if table is not None}
+        if all(self._sources.get(market) is table for market, table in tables.items()) and len(tables) == len(self._sources):
+            return {}
+        return tables
+
+    def build(self, tables: Dict[str, Any]) -> None:
+        """
+        按各市场代码表重建索引（在获取线程中执行），构建完成后整体替换，搜索不受影响
+
+        Args:
+            tables: 市场类型 -> 以code、name为列的DataFrame
+        """
+        started = time.perf_counter()
+        entries: List[Tuple[str, str, str]] = []
+        for market in SEARCH_MARKETS:
+            table = tables.get(market)
+            if table is not None:
+                entries.extend((code, name, market) for code, name in
+                               zip(table['code'].astype(str), table['name'].astype(str)))
+
+        index = TextIndex([entry[0] for entry in entries], [entry[1] for entry in entries])
+        self._data = (entries, index)
+        self._sources = dict(tables)
+        logger.info(f"代码搜索索引构建完成，共 {len(entries)} 个条目，"
+                    f"耗时 {time.perf_counter() - started:.2f} 秒"
+                    f"{'' if lazy_pinyin is not None else '（未安装pypinyin，不支持拼音首字母搜索）'}")
+
+    async def refresh(self) -> None:
+        """确保各市场代码表已加载（每天最多下载一次），代码表有更新时重建索引；并发调用共享同一次刷新"""
+        await self._flight.do('refresh', self._refresh)
+
+    async def _refresh(self) -> None:
+        for market in SEARCH_MARKETS:
+            await symbol_master.ensure_loaded(market)
+        tables = self._changed_tables()
+        if tables:
+            await fetch_scheduler.run(self.build, tables)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"刷新代码搜索索引失败: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """启动后台定期刷新任务（应用启动时按 preload 调用，或首次搜索时调用），已启动时不重复启动"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def ensure_started(self, timeout: float = FIRST_LOAD_WAIT) -> None:
+        """
+        启动后台刷新任务；索引为空时最多等待timeout秒完成首次加载，超时后加载继续在后台进行
+
+        Args:
+            timeout: 最多等待的秒数
+        """
+        self.start()
+        if self.ready:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.refresh()), timeout)
+        except asyncio.TimeoutError:
+            logger.debug(f"代码搜索索引在 {timeout} 秒内未加载完成，继续在后台加载")
+        except Exception as e:
+            logger.warning(f"加载代码搜索索引失败: {str(e)}")
+
+    async def stop(self) -> None:
+        """停止后台刷新任务（应用关闭时调用）"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def search(self, keyword: str, market_type: str = '', limit: int = 10) -> List[Dict[str, str]]:
+        """
+        搜索证券代码
+
+        Args:
+            keyword: 代码、名称或拼音首字母（不区分大小写）
+            market_type: 只返回指定市场的结果，为空时搜索全部市场
+            limit: 最多返回的结果数
+
+        Returns:
+            [{'code', 'name', 'market_type', 'match'}]，按TextIndex.search的优先级排列
+        """
+        entries, index = self._data
+        accept = (lambda entry_id: entries[entry_id][2] == market_type) if market_type else None
+        results = []
+        for entry_id, match in index.search(keyword, limit, accept):
+            code, name, market = entries[entry_id]
+            results.append({'code': code, 'name': name, 'market_type': market, 'match': match})
+        return results
+
+class SpotSearchIndex:
+    """
+    基于行情表（美股、ETF、LOF全市场行情）的搜索索引
+    搜索只读取内存中的索引；行情表缓存过期或被替换后在后台重新加载并重建索引，
+    重建期间继续使用旧索引，只有首次搜索需要等待加载
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Awaitable[pd.DataFrame]],
+                 current: Callable[[], Optional[pd.DataFrame]],
+                 symbol_column: str = 'symbol', name_column: str = 'name',
+                 code_func: Optional[Callable[[pd.Series], pd.Series]] = None):
+        """
+        Args:
+            name: 索引名称（用于日志）
+            loader: 返回最新行情表的协程函数（可能请求网络）
+            current: 返回缓存中行情表的函数，缓存过期时返回None（不请求网络）
+            symbol_column: 代码列名
+            name_column: 名称列名
+            code_func: 把代码列转换为用于搜索的代码，如美股'105.AAPL' -> 'AAPL'
+        """
+        self.name = name
+        self._loader = loader
+        self._current = current
+        self.symbol_column = symbol_column
+        self.name_column = name_column
+        self._code_func = code_func
+        # (行情表, 文本索引)，重建完成后整体替换；_source为构建索引时使用的原始行情表
+        self._data: Optional[Tuple[pd.DataFrame, TextIndex]] = None
+        self._source: Optional[pd.DataFrame] = None
+        self._flight = SingleFlight()
+        self._background: Optional[asyncio.Task] = None
+
+    def _build(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, TextIndex]:
+        started = time.perf_counter()
+        df = df.reset_index(drop=True)
+        codes = df[self.symbol_column].astype(str)
+        if self._code_func is not None:
+            codes = self._code_func(codes)
+        index = TextIndex(codes.tolist(), df[self.name_column].fillna('').astype(str).tolist())
+        logger.info(f"{self.name}搜索索引构建完成，共 {index.size} 个条目，耗时 {time.perf_counter() - started:.2f} 秒")
+        return df, index
+
+    async def _rebuild(self, df: Optional[pd.DataFrame] = None) -> Tuple[pd.DataFrame, TextIndex]:
+        if df is None:
+            df = await self._loader()
+        if df is None or df.empty:
+            raise ValueError(f"{self.name}行情表为空")
+        data = await fetch_scheduler.run(self._build, df)
+        self._data, self._source = data, df
+        return data
+
+    async def _refresh_in_background(self, df: Optional[pd.DataFrame]) -> None:
+        try:
+            await self._flight.do(self.name, lambda: self._rebuild(df))
+        except Exception as e:
+            logger.warning(f"后台刷新{self.name}搜索索引失败，继续使用旧索引: {str(e)}")
+
+    async def get(self) -> Tuple[pd.DataFrame, TextIndex]:
+        """
+        返回 (行情表, 文本索引)；索引与缓存中的行情表不一致（过期或已被其他请求更新）时在后台重建
+        """
+        data = self._data
+        if data is None:
+            return await self._flight.do(self.name, self._rebuild)
+        current = self._current()
+        if current is not self._source and (self._background is None or self._background.done()):
+            self._background = asyncio.ensure_future(self._refresh_in_background(current))
+        return data
+
+    async def search(self, keyword: str, limit: int = 10) -> pd.DataFrame:
+        """
+        搜索行情表
+
+        Args:
+            keyword: 代码、名称或拼音首字母
+            limit: 最多返回的行数
+
+        Returns:
+            按匹配优先级排列的行情表行
+        """
+        df, index = await self.get()
+        matches = index.search(keyword, limit)
+        return df.iloc[[entry_id for entry_id, _ in matches]]
+
+def format_search_rows(rows: pd.DataFrame, text_columns: Sequence[str],
+                       numeric_columns: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    把搜索结果行整体转换为字典列表：文本列缺失时为空字符串，数值列缺失或无法解析时为0.0
+
+    Args:
+        rows: 搜索结果行
+        text_columns: 文本列
+        numeric_columns: 数值列
+    """
+    columns = {}
+    for column in text_columns:
+        columns[column] = rows[column].fillna('').astype(str) if column in rows else ''
+    for column in numeric_columns:
+        if column in rows:
+            columns[column] = pd.to_numeric(rows[column], errors='coerce').fillna(0.0).astype(float)
+        else:
+            columns[column] = 0.0
+    return pd.DataFrame(columns, index=rows.index).to_dict('records')
+
+# 进程内共享的代码搜索索引
+symbol_search = SymbolSearchIndex()
@@ -1,6 +1,12 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, Optional, Any
+from typing import Dict, Mapping, Optional, Sequence, Any
 from utils.logger import get_logger
+from services import indicator_kernels as kernels
+from services.indicator_graph import IndicatorGraph
+from services.indicator_panel import IndicatorPanel, join_indicators
+from services.indicator_state import IndicatorState
+from services.indicator_cache import IndicatorCache, indicator_cache
 
 # 获取日志器
 logger = get_logger()
@@ -11,12 +17,19 @@ class TechnicalIndicator:
     负责计算常见的股票技术指标
     """
     
-    def __init__(self, params: Optional[Dict[str, Any]] = None):
+    # EMA预热周期倍数
+    EMA_WARMUP_FACTOR = 3
+    
+    # 计算指标需要的输入列
+    REQUIRED_COLUMNS = ('High', 'Low', 'Close', 'Volume')
+    
+    def __init__(self, params: Optional[Dict[str, Any]] = None, cache: Optional[IndicatorCache] = None):
         """
         初始化技术指标计算服务
         
         Args:
             params: 技术指标参数配置
+            cache: 指标结果缓存，默认使用进程内共享的缓存（环境变量 ENABLE_INDICATOR_CACHE=false 时不缓存）
         """
         # 默认参数设置
         self.params = params or {
@@ -28,8 +41,44 @@ class TechnicalIndicator:
             'atr_period': 14
         }
         
+        self.cache = cache or (indicator_cache if indicator_cache.enabled else None)
+        
         logger.debug(f"初始化TechnicalIndicator技术指标计算服务，参数: {self.params}")
     
+    def warmup_bars(self) -> int:
+        """
+        计算所有指标在最新一根K线上稳定所需的历史K线数
+        
+        滚动窗口类指标需要完整窗口；EMA类指标（MACD）需要约 EMA_WARMUP_FACTOR 倍周期
+        才能使初始值的影响衰减到可忽略（span=26时剩余权重约0.25%）
+        
+        Returns:
+            预热K线数
+        """
+        windows = [
+            max(self.params['ma_periods'].values()),
+            self.params['rsi_period'] + 1,  # diff会消耗一根K线
+            self.params['bollinger_period'],
+            self.params['volume_ma_period'],
+            self.params['atr_period'] + 1,
+            20,  # 波动率窗口
+        ]
+        # MACD：慢线EMA(26)收敛后，信号线EMA(9)再在MACD上收敛
+        macd_warmup = self.EMA_WARMUP_FACTOR * (26 + 9)
+        return max(max(windows), macd_warmup)
+    
+    def required_bars(self, analysis_days: int = 30) -> int:
+        """
+        计算分析所需的最少K线数：指标预热 + 分析天数 + 1（用于与前一日比较）
+        
+        Args:
+            analysis_days: 需要完整指标值的最近K线数（AI分析和图表使用的天数）
+            
+        Returns:
+            最少K线数
+        """
+        return self.warmup_bars() + max(1, analysis_days) + 1
+    
     def calculate_ema(self, series: pd.Series, period: int) -> pd.Series:
         """
         计算指数移动平均线
@@ -41,7 +90,7 @@ class TechnicalIndicator:
         Returns:
             EMA序列
         """
-        return series.ewm(span=period, adjust=False).mean()
+        return pd.Series(kernels.ema(series.to_numpy(dtype=np.float64), period), index=series.index)
     
     def calculate_rsi(self, series: pd.Series, period: int) -> pd.Series:
         """
@@ -54,17 +103,7 @@ class TechnicalIndicator:
         Returns:
             RSI序列
         """
-        delta = series.diff()
-        gain = delta.where(delta > 0, 0)
-        loss = -delta.where(delta < 0, 0)
-        
-        avg_gain = gain.rolling(window=period).mean()
-        avg_loss = loss.rolling(window=period).mean()
-        
-        rs = avg_gain / avg_loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        return rsi
+        return self._calculate_series(series, 'RSI', rsi_period=period)
     
     def calculate_macd(self, series: pd.Series) -> tuple:
         """
@@ -76,14 +115,7 @@ class TechnicalIndicator:
         Returns:
             (MACD线, 信号线, 柱状图)的元组
         """
-        ema12 = self.calculate_ema(series, 12)
-        ema26 = self.calculate_ema(series, 26)
-        
-        macd = ema12 - ema26
-        signal = self.calculate_ema(macd, 9)
-        histogram = macd - signal
-        
-        return macd, signal, histogram
+        return tuple(self._calculate_series(series, name) for name in ('MACD', 'Signal', 'Histogram'))
     
     def calculate_bollinger_bands(self, series: pd.Series, period: int, std_dev: float) -> tuple:
         """
@@ -97,13 +129,8 @@ class TechnicalIndicator:
         Returns:
             (中轨, 上轨, 下轨)的元组
         """
-        middle = series.rolling(window=period).mean()
-        std = series.rolling(window=period).std()
-        
-        upper = middle + std_dev * std
-        lower = middle - std_dev * std
-        
-        return middle, upper, lower
+        return tuple(self._calculate_series(series, name, bollinger_period=period, bollinger_std=std_dev)
+                     for name in ('BB_Middle', 'BB_Upper', 'BB_Lower'))
     
     def calculate_atr(self, df: pd.DataFrame, period: int) -> pd.Series:
         """
@@ -116,71 +143,122 @@ class TechnicalIndicator:
         Returns:
             ATR序列
         """
-        high = df['High']
-        low = df['Low']
-        close = df['Close']
-        
-        tr1 = high - low
-        tr2 = abs(high - close.shift())
-        tr3 = abs(low - close.shift())
-        
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-        atr = tr.rolling(window=period).mean()
-        
-        return atr
+        high, low, close = (df[col].to_numpy(dtype=np.float64) for col in ('High', 'Low', 'Close'))
+        tr = kernels.true_range(high, low, kernels.shift(close))
+        return pd.Series(kernels.rolling_mean(tr, period), index=df.index)
+    
+    def _calculate_series(self, series: pd.Series, output: str, **params) -> pd.Series:
+        """按指标依赖图计算只依赖收盘价的单个指标，params覆盖默认参数"""
+        close = series.to_numpy(dtype=np.float64)
+        inputs = {'Close': close, 'High': close, 'Low': close, 'Volume': close}
+        values = IndicatorGraph({**self.params, **params}).evaluate(inputs, [output])[output]
+        return pd.Series(values, index=series.index)
     
-    def calculate_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
+    def calculate_indicators(self, df: pd.DataFrame, outputs: Optional[Sequence[str]] = None) -> pd.DataFrame:
         """
-        计算所有技术指标
+        计算技术指标
+        
+        指标按依赖图计算（见 IndicatorGraph），共用的中间结果（如20日均值、标准差）只计算一次；
+        相同输入K线和参数的结果从指标缓存读取；末尾为盘中临时K线时见 _calculate_provisional
         
         Args:
             df: 原始价格数据，包含Open, High, Low, Close, Volume列
+            outputs: 需要的指标列（如 StockScorer.REQUIRED_INDICATORS），默认为全部指标
             
         Returns:
             添加了技术指标的DataFrame
         """
         try:
-            # 复制数据框
-            result_df = df.copy()
+            if df.attrs.get('provisional_bar') and self.cache is not None and len(df) > 1:
+                return self._calculate_provisional(df, outputs)
             
-            # 移动平均线
-            for name, period in self.params['ma_periods'].items():
-                result_df[f'MA{period}'] = result_df['Close'].rolling(window=period).mean()
+            key = self._cache_key(df, outputs)
+            if key is not None:
+                cached = self.cache.get(key, persistent=outputs is None)
+                if cached is not None:
+                    return cached
             
-            # RSI
-            result_df['RSI'] = self.calculate_rsi(result_df['Close'], self.params['rsi_period'])
-            
-            # MACD
-            macd, signal, histogram = self.calculate_macd(result_df['Close'])
-            result_df['MACD'] = macd
-            result_df['Signal'] = signal
-            result_df['Histogram'] = histogram
-            
-            # 布林带
-            middle, upper, lower = self.calculate_bollinger_bands(
-                result_df['Close'], 
-                self.params['bollinger_period'], 
-                self.params['bollinger_std']
-            )
-            result_df['BB_Middle'] = middle
-            result_df['BB_Upper'] = upper
-            result_df['BB_Lower'] = lower
-            
-            # 成交量移动平均
-            result_df['Volume_MA'] = result_df['Volume'].rolling(window=self.params['volume_ma_period']).mean()
-            
-            # 成交量比率
-            result_df['Volume_Ratio'] = result_df['Volume'] / result_df['Volume_MA']
-            
-            # ATR
-            result_df['ATR'] = self.calculate_atr(result_df, self.params['atr_period'])
-            
-            # 波动率 (过去20天收盘价的标准差/均值)
-            result_df['Volatility'] = result_df['Close'].rolling(window=20).std() / result_df['Close'].rolling(window=20).mean() * 100
-            
-            return result_df
+            inputs = {col: df[col].to_numpy(dtype=np.float64) for col in self.REQUIRED_COLUMNS}
+            indicators = IndicatorGraph(self.params).evaluate(inputs, outputs)
+            # 返回新的DataFrame，不修改原数据
+            result = join_indicators(df, indicators)
+            if key is not None:
+                self.cache.set(key, result, persistent=outputs is None)
+            return result
             
         except Exception as e:
             logger.error(f"计算技术指标时出错: {str(e)}")
             logger.exception(e)
-            raise 
\ No newline at end of file
+            raise
+    
+    def _calculate_provisional(self, df: pd.DataFrame, outputs: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        计算末尾为临时K线（df.attrs['provisional_bar']，见 SpotSnapshotService.merge_provisional_bar）的指标
+        
+        历史部分在快照刷新之间不变，其指标从缓存读取；临时K线的指标由历史部分的增量指标状态
+        以常数时间计算（状态按历史K线的缓存键保存，前复权基准变化时键随之变化），
+        快照每次刷新不需要重新计算整个序列
+        """
+        history = df.iloc[:-1]
+        history.attrs = {k: v for k, v in df.attrs.items() if k != 'provisional_bar'}
+        base = self.calculate_indicators(history, outputs)
+        
+        key = self._cache_key(history, None)
+        state = self.cache.get_state(key)
+        if state is None:
+            state = self.create_state(history)
+            self.cache.set_state(key, state)
+        values = state.preview(df.iloc[-1], df.index[-1])
+        
+        indicators = {name: np.array([values[name]]) for name in base.columns if name in values}
+        result = pd.concat([base, join_indicators(df.iloc[-1:], indicators)])
+        result.attrs = dict(df.attrs)
+        return result
+    
+    def calculate_indicators_batch(self, frames: Mapping[str, pd.DataFrame],
+                                   outputs: Optional[Sequence[str]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        在 日期×代码 面板上一次计算多只股票的技术指标，结果与逐只调用 calculate_indicators 一致
+        
+        Args:
+            frames: 代码 -> 原始价格数据（包含High, Low, Close, Volume列）
+            outputs: 需要的指标列，默认为全部指标
+            
+        Returns:
+            代码 -> 添加了技术指标的DataFrame（空数据原样返回，命中指标缓存的股票不参与计算）
+        """
+        result = {code: df for code, df in frames.items() if df.empty}
+        keys = {}
+        for code, df in frames.items():
+            if code in result:
+                continue
+            keys[code] = self._cache_key(df, outputs)
+            if keys[code] is not None:
+                cached = self.cache.get(keys[code], persistent=outputs is None)
+                if cached is not None:
+                    result[code] = cached
+        
+        # 只在面板上计算未命中缓存的股票
+        panel = IndicatorPanel({code: df for code, df in frames.items() if code not in result})
+        if panel.codes:
+            computed = panel.to_frames(panel.calculate(self.params, outputs))
+            for code, df in computed.items():
+                if keys[code] is not None:
+                    self.cache.set(keys[code], df, persistent=outputs is None)
+            result.update(computed)
+        return {code: result[code] for code in frames}
+    
+    def _cache_key(self, df: pd.DataFrame, outputs: Optional[Sequence[str]]) -> Optional[str]:
+        """指标缓存键，未启用缓存或数据为空时返回None"""
+        if self.cache is None or df.empty:
+            return None
+        return self.cache.key(df, self.params, outputs)
+    
+    def create_state(self, df: pd.DataFrame) -> IndicatorState:
+        """
+        用K线历史创建增量指标状态，之后每根新K线调用 state.update 以常数时间更新指标
+        
+        Args:
+            df: 原始价格数据，包含High, Low, Close, Volume列
+        """
+        return IndicatorState.from_frame(df, self.params)
@@ -0,0 +1,258 @@
+import os
+import time
+import threading
+import pandas as pd
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, Holiday, GoodFriday, USLaborDay, USMartinLutherKingJr,
+    USMemorialDay, USPresidentsDay, USThanksgivingDay, nearest_workday, sunday_to_monday
+)
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 各市场的时区和交易时段（本地时间）
+MARKET_SESSIONS: Dict[str, Tuple[str, List[Tuple[str, str]]]] = {
+    'A': ('Asia/Shanghai', [('09:30', '11:30'), ('13:00', '15:00')]),
+    'ETF': ('Asia/Shanghai', [('09:30', '11:30'), ('13:00', '15:00')]),
+    'LOF': ('Asia/Shanghai', [('09:30', '11:30'), ('13:00', '15:00')]),
+    'HK': ('Asia/Hong_Kong', [('09:30', '12:00'), ('13:00', '16:00')]),
+    'US': ('America/New_York', [('09:30', '16:00')]),
+}
+
+# 共用同一交易日历的市场
+CALENDAR_ALIASES: Dict[str, str] = {'ETF': 'A', 'LOF': 'A'}
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """纽交所全天休市的节假日（不含临时休市和提前收盘）"""
+    rules = [
+        Holiday('NewYearsDay', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-06-19', observance=nearest_workday),
+        Holiday('USIndependenceDay', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+class TradingCalendar:
+    """
+    单个市场的交易日历
+    交易日优先使用交易所日历（A股通过akshare获取），未加载或超出范围时按工作日判断，
+    并排除规则节假日和环境变量 TRADING_HOLIDAYS_<市场>（逗号分隔的YYYY-MM-DD）中配置的休市日
+    """
+
+    # 交易所日历加载失败后的重试间隔（秒）
+    RETRY_INTERVAL = 3600
+
+    def __init__(self, market_type: str):
+        """
+        Args:
+            market_type: 市场类型（A/HK/US）
+        """
+        self.market_type = market_type
+        tz_name, sessions = MARKET_SESSIONS[market_type]
+        self.tz = ZoneInfo(tz_name)
+        self.sessions = [(datetime.strptime(open_str, '%H:%M').time(), datetime.strptime(close_str, '%H:%M').time())
+                         for open_str, close_str in sessions]
+
+        self.holidays: Set[date] = set()
+        if market_type == 'US':
+            this_year = datetime.now(self.tz).year
+            self.holidays.update(d.date() for d in NYSEHolidayCalendar().holidays(
+                start=f'{this_year - 5}-01-01', end=f'{this_year + 2}-12-31'))
+        for item in os.getenv(f'TRADING_HOLIDAYS_{market_type}', '').split(','):
+            if item.strip():
+                self.holidays.add(pd.Timestamp(item.strip()).date())
+
+        # 交易所日历：覆盖范围内的全部交易日
+        self._trade_dates: Optional[Set[date]] = None
+        self._trade_range: Optional[Tuple[date, date]] = None
+        self._loaded_on: Optional[date] = None
+        self._load_failed_at = 0.0
+        self._load_lock = threading.Lock()
+
+    def now(self) -> datetime:
+        """市场当地的当前时间"""
+        return datetime.now(self.tz)
+
+    def _local(self, now: Optional[datetime]) -> datetime:
+        return now.astimezone(self.tz) if now is not None else self.now()
+
+    def is_trading_day(self, day: date) -> bool:
+        """判断某天是否为交易日"""
+        if self._trade_dates is not None and self._trade_range[0] <= day <= self._trade_range[1]:
+            return day in self._trade_dates
+        return day.weekday() < 5 and day not in self.holidays
+
+    def previous_trading_day(self, day: date) -> date:
+        """返回某天之前（不含当天）最近的交易日"""
+        for offset in range(1, 31):
+            candidate = day - timedelta(days=offset)
+            if self.is_trading_day(candidate):
+                return candidate
+        return day - timedelta(days=1)
+
+    def trading_days_back(self, day: date, count: int) -> date:
+        """
+        返回从某天（含，当天为交易日时计入）往前数第count个交易日的日期
+
+        Args:
+            day: 结束日期
+            count: 交易日数
+        """
+        found = 0
+        current = day
+        # 最多回溯的自然日数，避免交易日历异常时死循环
+        for _ in range(count * 3 + 30):
+            if self.is_trading_day(current):
+                found += 1
+                if found >= count:
+                    return current
+            current -= timedelta(days=1)
+        return current
+
+    def session_bounds(self, day: date) -> Tuple[datetime, datetime]:
+        """返回某天第一个时段的开盘时间和最后一个时段的收盘时间（市场当地时间）"""
+        return (datetime.combine(day, self.sessions[0][0], tzinfo=self.tz),
+                datetime.combine(day, self.sessions[-1][1], tzinfo=self.tz))
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        """判断当前是否处于交易时段"""
+        now = self._local(now)
+        if not self.is_trading_day(now.date()):
+            return False
+        return any(open_t <= now.time() < close_t for open_t, close_t in self.sessions)
+
+    def latest_session_date(self, now: Optional[datetime] = None) -> date:
+        """
+        返回最近一个已开始的交易日：今天是交易日且已开盘时为今天，否则为之前最近的交易日
+        """
+        now = self._local(now)
+        today = now.date()
+        if self.is_trading_day(today) and now >= self.session_bounds(today)[0]:
+            return today
+        return self.previous_trading_day(today)
+
+    def last_session_end(self, now: Optional[datetime] = None) -> datetime:
+        """返回最近一次已经结束的交易时段的收盘时间（含午间休市前的上午时段）"""
+        now = self._local(now)
+        day = now.date()
+        for _ in range(31):
+            if self.is_trading_day(day):
+                for _, close_t in reversed(self.sessions):
+                    close_dt = datetime.combine(day, close_t, tzinfo=self.tz)
+                    if close_dt <= now:
+                        return close_dt
+            day -= timedelta(days=1)
+        return now
+
+    def next_open(self, now: Optional[datetime] = None) -> datetime:
+        """返回下一次开盘时间（含午间休市后的下午开盘）"""
+        now = self._local(now)
+        day = now.date()
+        for _ in range(31):
+            if self.is_trading_day(day):
+                for open_t, _ in self.sessions:
+                    open_dt = datetime.combine(day, open_t, tzinfo=self.tz)
+                    if open_dt > now:
+                        return open_dt
+            day += timedelta(days=1)
+        return now + timedelta(days=1)
+
+    def next_close(self, now: Optional[datetime] = None) -> datetime:
+        """返回下一次（或当前时段的）收盘时间"""
+        now = self._local(now)
+        day = now.date()
+        for _ in range(31):
+            if self.is_trading_day(day):
+                for _, close_t in self.sessions:
+                    close_dt = datetime.combine(day, close_t, tzinfo=self.tz)
+                    if close_dt > now:
+                        return close_dt
+            day += timedelta(days=1)
+        return now + timedelta(days=1)
+
+    def has_new_data(self, last_bar: pd.Timestamp, updated_at: float,
+                     now: Optional[datetime] = None) -> bool:
+        """
+        判断在已有数据之后上游是否可能产生新的K线
+
+        盘中总是可能有新数据；非交易时段时，如果最后一根K线已是最近交易日，
+        且数据在最近一次收盘之后更新过，则不会有新数据
+
+        Args:
+            last_bar: 已有数据的最后一个日期
+            updated_at: 已有数据的更新时间（Unix时间戳）
+            now: 当前时间（带时区），默认为系统当前时间
+        """
+        now = self._local(now)
+        if self.is_open(now):
+            return True
+        if last_bar.date() < self.latest_session_date(now):
+            return True
+        return updated_at < self.last_session_end(now).timestamp()
+
+    def needs_load(self) -> bool:
+        """是否需要（重新）加载交易所日历：每天最多加载一次，失败后间隔一段时间重试"""
+        if self.market_type != 'A':
+            return False
+        if self._loaded_on == self.now().date():
+            return False
+        return time.time() - self._load_failed_at >= self.RETRY_INTERVAL
+
+    def load(self) -> None:
+        """
+        同步加载交易所日历（在获取线程中调用），失败时保留现有规则
+        """
+        with self._load_lock:
+            if not self.needs_load():
+                return
+            try:
+                import akshare as ak
+                logger.info(f"加载{self.market_type}交易日历: ak.tool_trade_date_hist_sina()")
+                df = ak.tool_trade_date_hist_sina()
+                dates = set(pd.to_datetime(df['trade_date']).dt.date)
+                if not dates:
+                    raise ValueError("交易日历为空")
+                self._trade_dates = dates - self.holidays
+                self._trade_range = (min(dates), max(dates))
+                self._loaded_on = self.now().date()
+                logger.info(f"{self.market_type}交易日历加载完成，范围: {self._trade_range[0]} ~ {self._trade_range[1]}")
+            except Exception as e:
+                self._load_failed_at = time.time()
+                logger.warning(f"加载{self.market_type}交易日历失败，按工作日规则判断: {str(e)}")
+
+# 进程内共享的交易日历实例
+_calendars: Dict[str, TradingCalendar] = {}
+_calendars_lock = threading.Lock()
+
+def get_trading_calendar(market_type: str) -> TradingCalendar:
+    """
+    返回指定市场的共享交易日历，ETF/LOF使用A股日历，未知市场按A股处理
+    """
+    market = CALENDAR_ALIASES.get(market_type, market_type)
+    if market not in MARKET_SESSIONS:
+        market = 'A'
+    with _calendars_lock:
+        calendar = _calendars.get(market)
+        if calendar is None:
+            calendar = TradingCalendar(market)
+            _calendars[market] = calendar
+        return calendar
+
+def is_market_open(market_type: str, now: Optional[datetime] = None) -> bool:
+    """
+    判断市场当前是否处于交易时段（按交易日历和交易时段判断）
+
+    Args:
+        market_type: 市场类型
+        now: 当前时间（带时区），默认为系统当前时间
+    """
+    return get_trading_calendar(market_type).is_open(now)
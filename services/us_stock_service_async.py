@@ -1,7 +1,9 @@
-import asyncio
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 from utils.logger import get_logger
+from services.data_cache import RefreshingDataset
+from services.fetch_scheduler import fetch_scheduler
+from services.symbol_search import SpotSearchIndex, format_search_rows
 
 # 获取日志器
 logger = get_logger()
@@ -15,10 +17,18 @@ class USStockServiceAsync:
     def __init__(self):
         """初始化美股服务"""
         logger.debug("初始化USStockServiceAsync")
-        
-        # 可选：添加缓存以减少频繁请求
-        self._cache = None
-        self._cache_timestamp = None
+        # 美股行情表：到期后继续使用旧数据并在后台刷新；搜索和详情查找同时支持'AAPL'形式的代码
+        self._dataset = RefreshingDataset('美股行情', self._load_us_stocks_data, 'US', key_func=self._ticker)
+        self._search_index = SpotSearchIndex('美股', self._dataset.get, self._dataset.current, code_func=self._ticker)
+    
+    async def warm_up(self) -> None:
+        """预先加载美股行情表并构建搜索索引（应用启动预热时调用）"""
+        await self._search_index.get()
+    
+    @staticmethod
+    def _ticker(codes: pd.Series) -> pd.Series:
+        """美股代码形如'105.AAPL'，返回'AAPL'部分"""
+        return codes.str.split('.').str[-1]
     
     async def search_us_stocks(self, keyword: str) -> List[Dict[str, Any]]:
         """
@@ -33,25 +43,9 @@ class USStockServiceAsync:
         try:
             logger.info(f"异步搜索美股: {keyword}")
             
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
-            
-            # 模糊匹配搜索
-            mask = df['name'].str.contains(keyword, case=False, na=False)
-            results = df[mask]
-            
-            # 格式化返回结果并处理 NaN 值
-            formatted_results = []
-            for _, row in results.iterrows():
-                formatted_results.append({
-                    'name': row['name'] if pd.notna(row['name']) else '',
-                    'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                    'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                    'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0
-                })
-                # 限制只返回前10个结果
-                if len(formatted_results) >= 10:
-                    break
+            # 在内存索引中搜索（索引在后台随行情表刷新），并整体格式化结果
+            rows = await self._search_index.search(keyword, limit=10)
+            formatted_results = format_search_rows(rows, ['name', 'symbol'], ['price', 'market_value'])
             
             logger.info(f"美股搜索完成，找到 {len(formatted_results)} 个匹配项（限制显示前10个）")
             return formatted_results
@@ -62,6 +56,16 @@ class USStockServiceAsync:
             logger.exception(e)
             raise Exception(error_msg)
     
+    async def _load_us_stocks_data(self) -> pd.DataFrame:
+        """
+        获取全量美股行情数据（由行情表数据集在需要刷新时调用）
+        
+        Returns:
+            包含美股数据的DataFrame
+        """
+        # 使用专用获取线程池执行同步的akshare调用
+        return await fetch_scheduler.run(self._get_us_stocks_data, source='spot')
+    
     def _get_us_stocks_data(self) -> pd.DataFrame:
         """
         获取美股数据（同步方法，将被异步方法调用）
@@ -120,18 +124,12 @@ class USStockServiceAsync:
         try:
             logger.info(f"获取美股详情: {symbol}")
             
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
-            
-            # 精确匹配股票代码
-            result = df[df['symbol'] == symbol]
+            # 按代码字典查找（行情表到期时返回旧数据并在后台刷新）
+            row = await self._dataset.lookup(symbol)
             
-            if len(result) == 0:
+            if row is None:
                 raise Exception(f"未找到股票代码: {symbol}")
             
-            # 获取第一行数据
-            row = result.iloc[0]
-            
             # 格式化为字典
             stock_detail = {
                 'name': row['name'] if pd.notna(row['name']) else '',
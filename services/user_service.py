@@ -4,7 +4,7 @@ import hashlib
 import os
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlmodel import SQLModel, Field, create_engine, Session, select, func
 from pydantic import BaseModel
 from utils.logger import get_logger
 from collections import defaultdict
@@ -454,6 +454,63 @@ class UserService:
             logger.error(f"获取分析历史失败: {str(e)}")
             return []
 
+    def get_prefetch_candidates(self, history_days: int = 30, history_limit: int = 2000) -> List[Dict[str, Any]]:
+        """
+        获取后台预取的候选代码（所有用户）：持仓、收藏、近期分析历史中的代码，
+        各类内部按涉及的用户数/分析次数降序，去重后按 持仓 > 收藏 > 分析历史 排列
+
+        Args:
+            history_days: 统计最近多少天的分析历史
+            history_limit: 最多读取的分析历史记录数
+
+        Returns:
+            [{'stock_code', 'market_type', 'reason', 'count'}]
+        """
+        try:
+            with Session(self.engine) as session:
+                holdings = session.exec(
+                    select(PortfolioHolding.market_type, PortfolioHolding.stock_code, func.count(PortfolioHolding.id))
+                    .group_by(PortfolioHolding.market_type, PortfolioHolding.stock_code)
+                    .order_by(func.count(PortfolioHolding.id).desc())
+                ).all()
+                favorites = session.exec(
+                    select(UserFavorite.market_type, UserFavorite.stock_code, func.count(UserFavorite.id))
+                    .group_by(UserFavorite.market_type, UserFavorite.stock_code)
+                    .order_by(func.count(UserFavorite.id).desc())
+                ).all()
+                histories = session.exec(
+                    select(AnalysisHistory.market_type, AnalysisHistory.stock_codes)
+                    .where(AnalysisHistory.created_at >= datetime.utcnow() - timedelta(days=history_days))
+                    .order_by(AnalysisHistory.created_at.desc())
+                    .limit(history_limit)
+                ).all()
+
+            # 分析历史中的代码保存为JSON列表，按出现次数统计
+            popular = defaultdict(int)
+            for market_type, stock_codes in histories:
+                try:
+                    for code in json.loads(stock_codes) if stock_codes else []:
+                        popular[(market_type, str(code))] += 1
+                except json.JSONDecodeError:
+                    continue
+            popular_rows = sorted(((m, c, n) for (m, c), n in popular.items()), key=lambda row: -row[2])
+
+            result = []
+            seen = set()
+            for reason, rows in (('holding', holdings), ('favorite', favorites), ('history', popular_rows)):
+                for market_type, stock_code, count in rows:
+                    key = (market_type, stock_code.strip())
+                    if key in seen or not key[1]:
+                        continue
+                    seen.add(key)
+                    result.append({"stock_code": key[1], "market_type": market_type,
+                                   "reason": reason, "count": int(count)})
+            return result
+
+        except Exception as e:
+            logger.error(f"获取预取候选代码失败: {str(e)}")
+            return []
+
     def delete_analysis_history(self, user_id: int, history_id: int) -> bool:
         """删除分析历史"""
         try:
@@ -0,0 +1,107 @@
+import os
+import time
+import asyncio
+import importlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from services.fetch_scheduler import fetch_scheduler
+from services.async_fetchers import http_client_pool, EASTMONEY_KLINE_URL, TENCENT_KLINE_URL
+from services.trading_calendar import get_trading_calendar
+from services.symbol_search import symbol_search
+
+# 获取日志器
+logger = get_logger()
+
+class StartupWarmup:
+    """
+    应用启动预热（可选）
+    在后台依次导入akshare、加载交易日历、建立上游连接、加载代码表和行情表，
+    避免部署后的第一个用户承担数秒的导入和加载耗时；预热完成前readiness为False，
+    供容器健康检查等待
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Args:
+            timeout: 预热总超时秒数，默认读取环境变量 STARTUP_WARMUP_TIMEOUT（默认120秒），
+                     超时后未完成的步骤记为失败，服务仍标记为就绪
+        """
+        self.enabled = os.getenv('ENABLE_STARTUP_WARMUP', 'false').lower() == 'true'
+        self.timeout = timeout or float(os.getenv('STARTUP_WARMUP_TIMEOUT', '120'))
+        # (步骤名称, 返回协程的无参可调用对象)，按顺序执行
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = [
+            ('akshare', self._import_akshare),
+            ('trading_calendar', self._load_calendar),
+            ('connections', self._prime_connections),
+            ('symbols', symbol_search.refresh),
+        ]
+        self.state = 'pending' if self.enabled else 'disabled'
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        """服务是否就绪：未启用预热时始终就绪，启用时预热结束（含部分步骤失败）后就绪"""
+        return self.state in ('disabled', 'done')
+
+    def add_step(self, name: str, func: Callable[[], Awaitable[Any]]) -> None:
+        """追加一个预热步骤（如加载行情表），在内置步骤之后执行"""
+        self._steps.append((name, func))
+
+    @staticmethod
+    async def _import_akshare() -> None:
+        # akshare导入耗时数秒，在获取线程中执行，之后各处的 import akshare 直接使用已加载的模块
+        await fetch_scheduler.run(importlib.import_module, 'akshare')
+
+    @staticmethod
+    async def _load_calendar() -> None:
+        calendar = get_trading_calendar('A')
+        if calendar.needs_load():
+            await fetch_scheduler.run(calendar.load)
+
+    @staticmethod
+    async def _prime_connections() -> None:
+        connected = await http_client_pool.prime([EASTMONEY_KLINE_URL, TENCENT_KLINE_URL])
+        if connected == 0:
+            raise ConnectionError("无法连接上游数据源")
+
+    async def _run_steps(self) -> None:
+        for name, func in self._steps:
+            started = time.perf_counter()
+            self.results[name] = {'state': 'running'}
+            try:
+                await func()
+                self.results[name] = {'state': 'ok', 'elapsed': round(time.perf_counter() - started, 2)}
+            except Exception as e:
+                # 单个步骤失败不影响后续步骤，相应数据在首次使用时再加载
+                self.results[name] = {'state': 'failed', 'elapsed': round(time.perf_counter() - started, 2),
+                                      'error': str(e)}
+                logger.warning(f"启动预热步骤 {name} 失败: {str(e)}")
+
+    async def run(self) -> None:
+        """执行全部预热步骤，超时或失败的步骤记录在results中"""
+        self.state = 'running'
+        started = time.perf_counter()
+        logger.info("开始启动预热")
+        try:
+            await asyncio.wait_for(self._run_steps(), self.timeout)
+        except asyncio.TimeoutError:
+            for name, result in self.results.items():
+                if result['state'] == 'running':
+                    self.results[name] = {'state': 'failed', 'error': f"超过 {self.timeout} 秒"}
+            logger.warning(f"启动预热超时（{self.timeout}秒），未完成的数据在首次使用时加载")
+        finally:
+            self.state = 'done'
+        logger.info(f"启动预热完成，耗时 {time.perf_counter() - started:.1f} 秒: {self.results}")
+
+    def start(self) -> None:
+        """在后台启动预热（应用启动时调用），未启用时不做任何事"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def status(self) -> Dict[str, Any]:
+        """返回预热状态"""
+        return {'ready': self.ready, 'state': self.state, 'steps': dict(self.results)}
+
+# 进程内共享的启动预热实例
+startup_warmup = StartupWarmup()
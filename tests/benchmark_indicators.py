@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+技术指标计算基准测试 - 对比pandas写法与NumPy/SciPy数组计算函数（indicator_kernels）
+
+不需要启动服务器，使用随机生成的K线：
+    python tests/benchmark_indicators.py --symbols 500 --bars 300
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.technical_indicator import TechnicalIndicator
+
+def pandas_indicators(df: pd.DataFrame, params: dict) -> pd.DataFrame:
+    """原pandas实现（rolling/ewm/concat.max），作为速度和数值的对照"""
+    result = df.copy()
+    close = result['Close']
+    for period in params['ma_periods'].values():
+        result[f'MA{period}'] = close.rolling(window=period).mean()
+    delta = close.diff()
+    gain = delta.where(delta > 0, 0).rolling(window=params['rsi_period']).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=params['rsi_period']).mean()
+    result['RSI'] = 100 - (100 / (1 + gain / loss))
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    result['MACD'] = macd
+    result['Signal'] = signal
+    result['Histogram'] = macd - signal
+    middle = close.rolling(window=params['bollinger_period']).mean()
+    std = close.rolling(window=params['bollinger_period']).std()
+    result['BB_Middle'] = middle
+    result['BB_Upper'] = middle + params['bollinger_std'] * std
+    result['BB_Lower'] = middle - params['bollinger_std'] * std
+    result['Volume_MA'] = result['Volume'].rolling(window=params['volume_ma_period']).mean()
+    result['Volume_Ratio'] = result['Volume'] / result['Volume_MA']
+    tr = pd.concat([result['High'] - result['Low'],
+                    abs(result['High'] - close.shift()),
+                    abs(result['Low'] - close.shift())], axis=1).max(axis=1)
+    result['ATR'] = tr.rolling(window=params['atr_period']).mean()
+    result['Volatility'] = close.rolling(window=20).std() / close.rolling(window=20).mean() * 100
+    return result
+
+def random_bars(symbols: int, bars: int, seed: int = 0) -> dict:
+    """生成随机K线（长度在 bars/2 到 bars 之间）"""
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for i in range(symbols):
+        n = int(rng.integers(bars // 2, bars + 1))
+        close = np.cumprod(1 + rng.normal(0, 0.02, n)) * rng.uniform(3, 300)
+        frames[f'{i:06d}'] = pd.DataFrame({
+            'Open': close,
+            'High': close * (1 + rng.uniform(0, 0.03, n)),
+            'Low': close * (1 - rng.uniform(0, 0.03, n)),
+            'Close': close,
+            'Volume': rng.integers(1, 10 ** 7, n),
+        }, index=pd.bdate_range(end='2024-12-31', periods=n, name='Date'))
+    return frames
+
+def timed(func, repeat: int) -> float:
+    """返回多次执行的最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='技术指标计算基准测试')
+    parser.add_argument('--symbols', type=int, default=500, help='股票数量 (默认: 500)')
+    parser.add_argument('--bars', type=int, default=300, help='每只股票最多K线数 (默认: 300)')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最短耗时 (默认: 3)')
+    args = parser.parse_args()
+
+    indicator = TechnicalIndicator()
+    # 关闭指标缓存，重复计算时测量的是计算本身
+    indicator.cache = None
+    frames = random_bars(args.symbols, args.bars)
+
+    # 数值一致性
+    max_diff = 0.0
+    for df in frames.values():
+        expected = pandas_indicators(df, indicator.params)
+        actual = indicator.calculate_indicators(df)
+        for col in expected.columns:
+            a, b = expected[col].to_numpy(dtype=float), actual[col].to_numpy(dtype=float)
+            if not np.allclose(a, b, rtol=1e-9, atol=1e-9, equal_nan=True):
+                print(f"❌ 数值不一致: {col}")
+                sys.exit(1)
+            with np.errstate(invalid='ignore'):
+                max_diff = max(max_diff, float(np.nanmax(np.abs(a - b), initial=0.0)))
+    print(f"✓ 数值一致（{args.symbols} 只股票，最大绝对误差 {max_diff:.2e}）")
+
+    items = list(frames.values())
+    pandas_time = timed(lambda: [pandas_indicators(df, indicator.params) for df in items], args.repeat)
+    kernel_time = timed(lambda: [indicator.calculate_indicators(df) for df in items], args.repeat)
+    panel_time = timed(lambda: indicator.calculate_indicators_batch(frames), args.repeat)
+
+    per_symbol = lambda seconds: seconds / len(items) * 1000
+    print(f"\n{'实现':<28}{'总耗时(秒)':>12}{'每只(毫秒)':>12}{'加速比':>10}")
+    for name, seconds in (('pandas 逐只', pandas_time),
+                          ('indicator_kernels 逐只', kernel_time),
+                          ('indicator_kernels 面板', panel_time)):
+        print(f"{name:<28}{seconds:>12.3f}{per_symbol(seconds):>12.3f}{pandas_time / seconds:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# HTTP接口测试和基准测试是独立脚本（需要运行中的服务器，见README），pytest只收集单元测试
+collect_ignore = [
+    'run_api_tests.py',
+    'test_api_endpoints.py',
+    'test_api_quick.py',
+    'test-docker-compose.py',
+    'benchmark_indicators.py',
+]
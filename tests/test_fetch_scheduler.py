@@ -0,0 +1,44 @@
+"""
+FetchScheduler 单元测试：分组轮询分配槽位，超时不计入排队时间
+
+    python -m pytest tests/test_fetch_scheduler.py
+"""
+
+import asyncio
+
+from services.fetch_scheduler import FetchScheduler
+
+def test_groups_share_slots_round_robin():
+    scheduler = FetchScheduler(max_workers=1, rate_limits={})
+    order = []
+
+    async def task(name: str):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+    async def main():
+        batch = [scheduler.arun(lambda i=i: task(f"batch{i}"), group='batch') for i in range(5)]
+        interactive = scheduler.arun(lambda: task('interactive'), group='interactive')
+        await asyncio.gather(*batch, interactive)
+
+    asyncio.run(main())
+    # 批量请求已排队时，交互请求不需要等待整个批次完成
+    assert order.index('interactive') <= 2
+    assert scheduler.stats()['active'] == 0
+
+def test_timeout_excludes_queue_wait():
+    scheduler = FetchScheduler(max_workers=1, rate_limits={})
+
+    async def main():
+        first = asyncio.ensure_future(scheduler.arun(lambda: asyncio.sleep(0.3), group='a'))
+        await asyncio.sleep(0)
+        # 排队约0.3秒，实际请求只需0.05秒，0.2秒的超时不应触发
+        second = await scheduler.arun(lambda: asyncio.sleep(0.05, result='ok'), group='b', timeout=0.2)
+        await first
+        return second
+
+    assert asyncio.run(main()) == 'ok'
+
+def test_run_executes_in_thread_pool():
+    scheduler = FetchScheduler(max_workers=2, rate_limits={})
+    assert asyncio.run(scheduler.run(sum, [1, 2, 3], timeout=1)) == 6
@@ -0,0 +1,74 @@
+"""
+IndicatorCache 单元测试：磁盘层使用临时目录
+
+    python -m pytest tests/test_indicator_cache.py
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from services.indicator_cache import IndicatorCache
+
+def make_result(rows: int = 50) -> pd.DataFrame:
+    index = pd.bdate_range('2024-01-01', periods=rows, name='Date')
+    return pd.DataFrame({'Close': np.linspace(10, 20, rows), 'RSI': np.linspace(30, 70, rows)}, index=index)
+
+def test_set_does_not_wait_for_disk_write(tmp_path):
+    cache = IndicatorCache(base_dir=str(tmp_path))
+    release = threading.Event()
+    write = cache._write
+    cache._write = lambda key, df: (release.wait(5), write(key, df))
+
+    started = time.perf_counter()
+    cache.set('k' * 32, make_result())
+    assert time.perf_counter() - started < 1
+    # 磁盘写入完成前内存层已可读取
+    assert cache.get('k' * 32, persistent=False) is not None
+    assert cache.stats()['disk_writes'] == 0
+
+    release.set()
+    cache.flush()
+    assert cache.stats()['disk_writes'] == 1
+    assert IndicatorCache(base_dir=str(tmp_path)).get('k' * 32) is not None
+
+def test_hit_miss_and_disk_layer(tmp_path):
+    cache = IndicatorCache(base_dir=str(tmp_path))
+    bars = make_result()
+    key = cache.key(bars, {'rsi_period': 14})
+    assert cache.get(key) is None
+
+    cache.set(key, bars)
+    hit = cache.get(key)
+    pd.testing.assert_frame_equal(hit, bars)
+    # 返回副本，调用方修改不影响缓存
+    hit['Close'] = 0.0
+    assert cache.get(key)['Close'].iloc[-1] == bars['Close'].iloc[-1]
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+    cache.flush()
+    cache.memory.clear()
+    pd.testing.assert_frame_equal(cache.get(key), bars, check_freq=False)
+    assert cache.stats()['disk_hits'] == 1
+    # 只保存在内存中的结果不写入磁盘层
+    cache.set('m' * 32, bars, persistent=False)
+    cache.flush()
+    cache.memory.clear()
+    assert cache.get('m' * 32) is None
+
+def test_key_changes_with_input_params_and_outputs():
+    bars = make_result()
+    key = IndicatorCache.key(bars, {'rsi_period': 14})
+    assert IndicatorCache.key(bars.copy(), {'rsi_period': 14}) == key
+    assert IndicatorCache.key(bars, {'rsi_period': 6}) != key
+    assert IndicatorCache.key(bars, {'rsi_period': 14}, ['RSI']) != key
+
+    # 新K线、盘中更新的最后一根K线和前复权基准变化（整体价格换算）都使缓存失效
+    appended = pd.concat([bars, make_result(51).iloc[-1:]])
+    revised = bars.copy()
+    revised.iloc[-1, revised.columns.get_loc('Close')] += 0.01
+    rebased = bars.copy()
+    rebased['Close'] *= 0.98
+    keys = {IndicatorCache.key(df, {'rsi_period': 14}) for df in (appended, revised, rebased)}
+    assert key not in keys and len(keys) == 3
@@ -0,0 +1,61 @@
+"""
+IndicatorState 单元测试：增量更新和盘中临时K线的指标值与 calculate_indicators 整体计算一致
+
+    python -m pytest tests/test_indicator_state.py
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.indicator_cache import IndicatorCache
+from services.indicator_state import IndicatorState
+from services.technical_indicator import TechnicalIndicator
+
+def make_bars(rows: int, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = np.cumprod(1 + rng.normal(0, 0.02, rows)) * 50
+    close[100:120] = close[99]  # 连续相同的收盘价：RSI为0/0，标准差为0
+    df = pd.DataFrame({'Open': close, 'High': close * 1.01, 'Low': close * 0.98, 'Close': close,
+                       'Volume': rng.integers(0, 10 ** 6, rows).astype(float)},
+                      index=pd.bdate_range('2015-01-01', periods=rows, name='Date'))
+    df.iloc[300, df.columns.get_loc('Close')] = np.nan  # 缺失值按pandas规则处理
+    return df
+
+def assert_matches(values: dict, expected: pd.Series) -> None:
+    for name, value in values.items():
+        assert np.isclose(value, expected[name], rtol=1e-7, atol=1e-8, equal_nan=True), name
+
+def test_update_matches_calculate_indicators():
+    indicator = TechnicalIndicator()
+    indicator.cache = None
+    df = make_bars(1500)
+    expected = indicator.calculate_indicators(df)
+
+    state = indicator.create_state(df.iloc[:5])
+    for i in range(5, len(df)):
+        if i == 700:
+            # 中途经JSON序列化恢复
+            state = IndicatorState.from_dict(json.loads(json.dumps(state.to_dict())))
+        assert_matches(state.update(df.iloc[i], df.index[i]), expected.iloc[i])
+
+@pytest.mark.parametrize('outputs', [None, ['RSI', 'MACD', 'MA20']])
+def test_provisional_bar_matches_full_calculation(tmp_path, outputs):
+    indicator = TechnicalIndicator(cache=IndicatorCache(base_dir=str(tmp_path)))
+    df = make_bars(400)
+    expected = TechnicalIndicator(cache=IndicatorCache(base_dir=str(tmp_path / 'full'))).calculate_indicators(df, outputs)
+
+    provisional = df.copy()
+    provisional.attrs['provisional_bar'] = True
+    for close in (df['Close'].iloc[-1] * 0.97, df['Close'].iloc[-1]):
+        # 快照刷新：只有临时K线变化，历史部分的指标和增量状态从缓存读取
+        provisional.iloc[-1, provisional.columns.get_loc('Close')] = close
+        result = indicator.calculate_indicators(provisional, outputs)
+    indicator.cache.flush()
+
+    assert list(result.columns) == list(expected.columns)
+    assert result.index.equals(expected.index)
+    assert result.attrs.get('provisional_bar') is True
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-7, check_freq=False)
+    assert indicator.cache.stats()['states'] == 1
@@ -0,0 +1,161 @@
+"""
+StockDataProvider 单元测试：使用假数据源和临时目录中的本地历史存储，不访问网络
+
+    python -m pytest tests/test_stock_data_provider.py
+"""
+
+import asyncio
+import time
+import pandas as pd
+import pytest
+
+from services.stock_data_provider import StockDataProvider
+from services.stock_history_store import StockHistoryStore
+
+class FakeDataSource:
+    """按工作日生成确定性K线的假数据源，记录每次请求的区间"""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        self.calls.append((start_date, end_date))
+        index = pd.bdate_range(pd.to_datetime(start_date, format='%Y%m%d'),
+                               pd.to_datetime(end_date, format='%Y%m%d'), name='Date')
+        close = 100.0 + (index - pd.Timestamp('2000-01-03')).days.to_numpy() * 0.01
+        return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                             'Volume': 1000.0, 'Amount': close * 1000}, index=index)
+
+    def fetch_full_history(self, stock_code: str, market_type: str):
+        return None
+
+@pytest.fixture
+def provider(tmp_path):
+    provider = StockDataProvider(history_store=StockHistoryStore(str(tmp_path)))
+    provider.validate_symbols = False
+    provider.intraday = False
+    provider.register_data_source('HK', FakeDataSource())
+    return provider
+
+def get(provider, code, start, end):
+    return asyncio.run(provider.get_stock_data(code, 'HK', start, end))
+
+def test_disjoint_ranges_do_not_leave_hole(provider):
+    """先后请求两段不相接的区间后，覆盖两者的请求不能直接读取中间缺失K线的存储"""
+    source = provider.get_data_source('HK')
+    get(provider, '00001', '20240101', '20240630')
+    get(provider, '00001', '20200101', '20200630')
+    df = get(provider, '00001', '20200101', '20240630')
+
+    expected = pd.bdate_range('2020-01-01', '2024-06-30')
+    assert len(df) == len(expected) == 1173
+    assert df.index.equals(expected)
+    stored = provider.history_store.load('HK', '00001')
+    assert stored.index.is_unique and len(pd.bdate_range(stored.index[0], stored.index[-1])) == len(stored)
+    # 第二次请求延长到覆盖起点补齐中间的K线，之后的请求直接读取本地存储
+    assert source.calls[-1] == ('20200101', '20240101')
+    assert len(source.calls) == 2
+
+class FakeAdjustedSource:
+    """
+    带一次现金分红的假A股数据源：adjust为''时返回不复权K线（涨跌额按除权参考价计算），
+    为'hfq'时返回后复权K线
+    """
+
+    name = 'fake'
+    ORIGIN = pd.Timestamp('2024-01-01')
+    EX_DATE = pd.Timestamp('2024-02-05')
+    DIVIDEND = 0.5
+
+    def __init__(self, adjust: str, calls: list):
+        self.adjust = adjust
+        self.calls = calls
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        self.calls.append((self.adjust, start_date, end_date))
+        index = pd.bdate_range(self.ORIGIN, pd.to_datetime(end_date, format='%Y%m%d'), name='Date')
+        close = pd.Series(10.0 + (pd.Series(range(len(index))) % 7).to_numpy() * 0.1, index=index).round(2)
+        reference = close.shift(1) - (index == self.EX_DATE) * self.DIVIDEND
+        df = pd.DataFrame({'Open': close, 'High': close + 0.1, 'Low': close - 0.1, 'Close': close,
+                           'Volume': 1000.0, 'Change': (close - reference).round(2)}, index=index)
+        if self.adjust == 'hfq':
+            factor = pd.Series(1.0, index=index)
+            if self.EX_DATE in index:
+                ex_close = close.shift(1)[self.EX_DATE]
+                factor[index >= self.EX_DATE] = ex_close / (ex_close - self.DIVIDEND)
+            df[['Open', 'High', 'Low', 'Close']] = df[['Open', 'High', 'Low', 'Close']].mul(factor, axis=0)
+        return df[df.index >= pd.to_datetime(start_date, format='%Y%m%d')]
+
+    def fetch_full_history(self, stock_code: str, market_type: str):
+        return None
+
+@pytest.fixture
+def factor_provider(provider):
+    calls = []
+    sources = {adjust: FakeAdjustedSource(adjust, calls) for adjust in ('', 'hfq')}
+    provider.get_data_source = lambda market_type, adjust=None: sources[adjust]
+    provider.calls = calls
+    return provider
+
+def test_delta_reuses_factor_without_corporate_action(factor_provider):
+    provider = factor_provider
+    bars = provider._get_factor_bars_sync('600000', 'A', '20240101', '20240119')
+    stored = provider.history_store.append('A', '600000', bars)
+    provider.calls.clear()
+
+    delta = provider._get_factor_bars_sync('600000', 'A', '20240119', '20240202', stored)
+    assert provider.calls == [('', '20240119', '20240202')]
+    assert (delta['Factor'] == stored['Factor'].iloc[-1]).all()
+
+def test_delta_across_dividend_fetches_hfq(factor_provider):
+    provider = factor_provider
+    bars = provider._get_factor_bars_sync('600000', 'A', '20240101', '20240119')
+    stored = provider.history_store.append('A', '600000', bars)
+    provider.calls.clear()
+
+    delta = provider._get_factor_bars_sync('600000', 'A', '20240119', '20240216', stored)
+    assert [adjust for adjust, _, _ in provider.calls] == ['', 'hfq']
+    merged = provider.history_store.append('A', '600000', delta, coverage_start=stored.index[-1])
+
+    qfq = provider._read_stored(merged, '20240101', '20240216')
+    hfq = FakeAdjustedSource('hfq', []).fetch_history('600000', 'A', '20240101', '20240216')
+    expected = hfq['Close'] * (qfq['Close'].iloc[-1] / hfq['Close'].iloc[-1])
+    assert (qfq['Close'] - expected).abs().max() < 1e-9
+    # 除权除息日之前的前复权价格低于不复权价格
+    before = merged.index < FakeAdjustedSource.EX_DATE
+    assert (qfq['Close'][before] < merged['Close'][before]).all()
+
+class SlowDataSource(FakeDataSource):
+    """每次请求耗时delay秒的假数据源（在获取线程中执行）"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def fetch_history(self, stock_code: str, market_type: str,
+                      start_date: str, end_date: str) -> pd.DataFrame:
+        time.sleep(self.delay)
+        return super().fetch_history(stock_code, market_type, start_date, end_date)
+
+def test_coalesced_fetch_applies_each_callers_timeout(provider):
+    source = SlowDataSource(0.5)
+    provider.register_data_source('HK', source)
+
+    async def main():
+        return await asyncio.gather(
+            provider.get_stock_data('00002', 'HK', '20240101', '20240131', timeout=0.1),
+            provider.get_stock_data('00002', 'HK', '20240101', '20240131'),
+            provider.get_stock_data('00002', 'HK', '20240101', '20240131', timeout=5),
+            return_exceptions=True,
+        )
+
+    short, unbounded, long = asyncio.run(main())
+    # 超时只影响该调用者，共享的获取继续完成，其他调用者拿到各自的副本
+    assert isinstance(short, asyncio.TimeoutError)
+    assert len(unbounded) == len(long) == len(pd.bdate_range('2024-01-01', '2024-01-31'))
+    assert unbounded is not long
+    assert len(source.calls) == 1
@@ -0,0 +1,97 @@
+"""
+StockHistoryStore 单元测试：合并规则、覆盖范围和复权因子，存储目录使用临时目录
+
+    python -m pytest tests/test_stock_history_store.py
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.stock_history_store import (
+    StockHistoryStore, ESTIMATED_COLUMNS_ATTR, FACTOR_COLUMN, apply_adjustment
+)
+
+def make_bars(start: str, end: str, close: float = 10.0) -> pd.DataFrame:
+    index = pd.bdate_range(start, end, name='Date')
+    values = close + np.arange(len(index)) * 0.01
+    return pd.DataFrame({'Open': values, 'High': values + 0.1, 'Low': values - 0.1, 'Close': values,
+                         'Volume': 1000.0, 'Amount': values * 1000}, index=index)
+
+@pytest.fixture
+def store(tmp_path):
+    return StockHistoryStore(str(tmp_path))
+
+def coverage(store: StockHistoryStore, code: str = '00001') -> pd.Timestamp:
+    return store.load('HK', code).attrs['store_meta']['coverage_start']
+
+def test_append_merges_and_keeps_existing_values(store):
+    store.append('HK', '00001', make_bars('2024-01-01', '2024-01-31'))
+    delta = make_bars('2024-01-31', '2024-02-09', close=20.0)
+    delta.loc['2024-01-31', 'Volume'] = np.nan
+    delta.attrs[ESTIMATED_COLUMNS_ATTR] = ('Amount',)
+    merged = store.append('HK', '00001', delta)
+
+    assert merged.index.is_unique and merged.index.is_monotonic_increasing
+    assert merged.index[0] == pd.Timestamp('2024-01-01') and merged.index[-1] == pd.Timestamp('2024-02-09')
+    # 同一日期以新数据为准，新数据缺失的值和估算列保留已存储的值
+    assert merged.at[pd.Timestamp('2024-01-31'), 'Close'] == 20.0
+    assert merged.at[pd.Timestamp('2024-01-31'), 'Volume'] == 1000.0
+    assert merged.at[pd.Timestamp('2024-01-31'), 'Amount'] == pytest.approx(10.22 * 1000)
+    assert store.load('HK', '00001').equals(merged)
+
+def test_coverage_extends_when_ranges_meet(store):
+    store.append('HK', '00001', make_bars('2024-01-01', '2024-06-28'), coverage_start=pd.Timestamp('2024-01-01'))
+    # 以覆盖起点为结束日期的请求与已覆盖区间相接
+    store.append('HK', '00001', make_bars('2023-07-03', '2023-12-29'),
+                 coverage_start=pd.Timestamp('2023-07-01'), coverage_end=pd.Timestamp('2024-01-01'))
+    assert coverage(store) == pd.Timestamp('2023-07-01')
+
+def test_coverage_ignores_disjoint_earlier_range(store):
+    store.append('HK', '00001', make_bars('2024-01-01', '2024-06-28'), coverage_start=pd.Timestamp('2024-01-01'))
+    store.append('HK', '00001', make_bars('2020-01-01', '2020-06-30'),
+                 coverage_start=pd.Timestamp('2020-01-01'), coverage_end=pd.Timestamp('2020-06-30'))
+    # 中间的K线没有获取，覆盖起点不变（更早的K线保留在存储中）
+    assert coverage(store) == pd.Timestamp('2024-01-01')
+    assert store.load('HK', '00001').index[0] == pd.Timestamp('2020-01-01')
+
+def test_coverage_restarts_after_disjoint_later_range(store):
+    store.append('HK', '00001', make_bars('2020-01-01', '2020-06-30'), coverage_start=pd.Timestamp('2020-01-01'))
+    store.append('HK', '00001', make_bars('2024-01-01', '2024-06-28'), coverage_start=pd.Timestamp('2024-01-01'))
+    assert coverage(store) == pd.Timestamp('2024-01-01')
+
+def test_delta_across_dividend_aligns_factor_basis(store):
+    """
+    增量数据来自因子基准不同的数据源并跨越除权除息日：
+    因子按重叠日期换算到已存储的基准，前复权价格只在除权除息日之前按比例下调
+    """
+    ex_date = pd.Timestamp('2024-02-05')
+    stored = make_bars('2024-01-01', '2024-01-31')
+    stored[FACTOR_COLUMN] = 1.0
+    store.append('A', '600000', stored)
+
+    delta = make_bars('2024-01-31', '2024-02-16', close=stored['Close'].iloc[-1])
+    # 每股派息0.5：除权除息日起后复权因子增大，另一数据源的因子基准为2
+    ratio = delta['Close'].shift(1)[ex_date] / (delta['Close'].shift(1)[ex_date] - 0.5)
+    delta[FACTOR_COLUMN] = np.where(delta.index >= ex_date, 2.0 * ratio, 2.0)
+    merged = store.append('A', '600000', delta)
+
+    assert merged[FACTOR_COLUMN][merged.index < ex_date].eq(1.0).all()
+    assert merged[FACTOR_COLUMN][merged.index >= ex_date].sub(ratio).abs().max() < 1e-12
+    qfq = apply_adjustment(merged, 'qfq')
+    before = merged.index < ex_date
+    np.testing.assert_allclose(qfq['Close'][before], merged['Close'][before] / ratio)
+    np.testing.assert_allclose(qfq['Close'][~before], merged['Close'][~before])
+    assert FACTOR_COLUMN not in qfq.columns
+
+def test_concurrent_appends_keep_every_bar(store):
+    days = pd.bdate_range('2024-01-01', periods=200, name='Date')
+    bars = make_bars(str(days[0].date()), str(days[-1].date()))
+    threads = [threading.Thread(target=store.append, args=('HK', '00001', bars.iloc[i:i + 10]))
+               for i in range(0, 200, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.load('HK', '00001').index.equals(days)
@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    请求合并（single-flight）
+    相同key的并发调用共享同一个进行中的任务，任务完成后即从表中移除，
+    因此只合并并发请求，不充当缓存
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入一个进行中的调用
+
+        Args:
+            key: 合并键，相同key的并发调用只执行一次func
+            func: 返回协程的无参可调用对象
+
+        Returns:
+            func的执行结果（所有等待者拿到同一个对象）
+        """
+        # 按事件循环区分，避免跨循环等待同一个Future
+        flight_key = (id(asyncio.get_running_loop()), key)
+        future = self._inflight.get(flight_key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[flight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        # shield保证某个调用者被取消时不会取消其他调用者共享的任务
+        return await asyncio.shield(future)
+
+    def inflight_count(self) -> int:
+        """返回当前进行中的调用数量"""
+        return len(self._inflight)
@@ -9,6 +9,13 @@ from services.stock_analyzer_service import StockAnalyzerService
 from services.us_stock_service_async import USStockServiceAsync
 from services.fund_service_async import FundServiceAsync
 from services.user_service import user_service, UserRegisterRequest, UserLoginRequest, FavoriteRequest, UserSettingsRequest, APIConfigRequest
+from services.data_cache import data_cache, negative_cache
+from services.indicator_cache import indicator_cache
+from services.source_health import source_health
+from services.async_fetchers import http_client_pool
+from services.symbol_search import symbol_search
+from services.prefetcher import prefetcher
+from services.warmup import startup_warmup
 import os
 import httpx
 from utils.logger import get_logger
@@ -60,6 +67,10 @@ app.add_middleware(
 us_stock_service = USStockServiceAsync()
 fund_service = FundServiceAsync()
 
+# 启动预热在内置步骤之后加载美股和基金行情表
+startup_warmup.add_step('us_spot', us_stock_service.warm_up)
+startup_warmup.add_step('fund_spot', fund_service.warm_up)
+
 # 在应用启动时添加数据库迁移检查
 @app.on_event("startup")
 async def startup_event():
@@ -67,6 +78,20 @@ async def startup_event():
     migrator = DatabaseMigrator()
     await migrator.check_and_apply_migrations()
     logger.info("数据库迁移检查完成")
+    # 可选的启动预热：导入akshare、建立上游连接、加载代码表和行情表，完成前/api/ready返回503
+    startup_warmup.start()
+    # 可选：启动时在后台加载代码表并构建搜索索引，不阻塞启动；未开启时在首次搜索时加载
+    if symbol_search.preload:
+        symbol_search.start()
+    # 收盘后和开盘前为持仓、收藏和热门代码预取数据
+    prefetcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await symbol_search.stop()
+    await prefetcher.stop()
+    # 关闭原生异步获取器的连接池
+    await http_client_pool.aclose()
 
 # 定义请求和响应模型
 class AnalyzeRequest(BaseModel):
@@ -1137,6 +1162,17 @@ async def analyze(request: AnalyzeRequest, current_user: dict = Depends(get_curr
         logger.exception(e)
         raise HTTPException(status_code=500, detail=error_msg)
 
+# 跨市场搜索证券代码
+@app.get("/api/search")
+async def search_symbols(keyword: str = "", market_type: str = "", limit: int = 10,
+                         username: str = Depends(verify_token)):
+    """按代码、名称或拼音首字母搜索A股/港股/美股/ETF/LOF，结果来自内存索引"""
+    if not keyword:
+        raise HTTPException(status_code=400, detail="请输入搜索关键词")
+    await symbol_search.ensure_started()
+    results = symbol_search.search(keyword, market_type.upper(), max(1, min(limit, 50)))
+    return {"results": results, "ready": symbol_search.ready, "markets": symbol_search.markets()}
+
 # 搜索美股代码
 @app.get("/api/search_us_stocks")
 async def search_us_stocks(keyword: str = "", username: str = Depends(verify_token)):
@@ -1197,6 +1233,19 @@ async def get_fund_detail(symbol: str, market_type: str = "ETF", username: str =
         logger.error(f"获取基金详情时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 获取数据缓存统计
+@app.get("/api/cache_stats")
+async def get_cache_stats(username: str = Depends(verify_token)):
+    """返回进程内数据缓存的命中、未命中和淘汰计数，无数据退避中的请求数，技术指标缓存和后台预取状态"""
+    return {**data_cache.stats(), 'negative': negative_cache.stats(),
+            'indicators': indicator_cache.stats(), 'prefetch': prefetcher.stats()}
+
+# 获取数据源健康状态
+@app.get("/api/source_health")
+async def get_source_health(username: str = Depends(verify_token)):
+    """返回各数据源的熔断状态、失败次数和延迟分位数"""
+    return source_health.snapshot()
+
 # 测试API连接
 @app.post("/api/test_api_connection")
 async def test_api_connection(request: TestAPIRequest, username: str = Depends(verify_token)):
@@ -1270,6 +1319,13 @@ async def test_api_connection(request: TestAPIRequest, username: str = Depends(v
             content={"success": False, "message": f"API 测试连接时出错: {str(e)}"}
         )
 
+# 就绪检查（供容器健康检查使用）
+@app.get("/api/ready")
+async def readiness():
+    """启动预热完成（或未启用预热）时返回200，否则返回503"""
+    status = startup_warmup.status()
+    return JSONResponse(status_code=200 if status['ready'] else 503, content=status)
+
 # 检查是否需要登录
 @app.get("/api/need_login")
 async def need_login():